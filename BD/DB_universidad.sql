@@ -695,4 +695,2152 @@ FROM seguridad.usuarios u
 LEFT JOIN seguridad.usuario_rol ur ON ur.id_usuario = u.id_usuario
 LEFT JOIN seguridad.roles r        ON r.id_rol     = ur.id_rol
 GROUP BY rol, estado
-ORDER BY rol, estado;
\ No newline at end of file
+ORDER BY rol, estado;
+-- ======================================
+-- 4.y) CONSOLA DE EVENTOS: ÍNDICES Y RESUMEN POR HORA
+-- ======================================
+-- Índices para filtros + paginación por llave (intentado_en, id_intento)
+CREATE INDEX IF NOT EXISTS idx_intentos_login_fecha
+  ON seguridad.intentos_login (intentado_en DESC, id_intento DESC);
+CREATE INDEX IF NOT EXISTS idx_intentos_login_ip_fecha
+  ON seguridad.intentos_login (direccion_ip, intentado_en DESC, id_intento DESC);
+CREATE INDEX IF NOT EXISTS idx_intentos_login_ident_fecha
+  ON seguridad.intentos_login (LOWER(identificador), intentado_en DESC, id_intento DESC);
+
+-- Resúmenes por hora (mantenidos por trigger de sentencia)
+CREATE TABLE IF NOT EXISTS seguridad.resumen_login_ip_hora (
+  hora          TIMESTAMPTZ NOT NULL,
+  direccion_ip  INET,
+  intentos      INTEGER NOT NULL DEFAULT 0,
+  fallidos      INTEGER NOT NULL DEFAULT 0,
+  CONSTRAINT uq_resumen_login_ip_hora UNIQUE NULLS NOT DISTINCT (hora, direccion_ip)
+);
+CREATE TABLE IF NOT EXISTS seguridad.resumen_login_usuario_hora (
+  hora           TIMESTAMPTZ  NOT NULL,
+  identificador  VARCHAR(255) NOT NULL,          -- LOWER(intentos_login.identificador)
+  intentos       INTEGER NOT NULL DEFAULT 0,
+  fallidos       INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (hora, identificador)
+);
+
+CREATE OR REPLACE FUNCTION seguridad.fn_resumen_login_hora()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+  -- ORDER BY: todas las transacciones bloquean las filas en el mismo orden
+  INSERT INTO seguridad.resumen_login_ip_hora AS r (hora, direccion_ip, intentos, fallidos)
+  SELECT date_trunc('hour', n.intentado_en), n.direccion_ip,
+         COUNT(*), COUNT(*) FILTER (WHERE NOT n.exitoso)
+  FROM nuevos n
+  GROUP BY 1, 2
+  ORDER BY 1, 2
+  ON CONFLICT ON CONSTRAINT uq_resumen_login_ip_hora DO UPDATE
+    SET intentos = r.intentos + EXCLUDED.intentos,
+        fallidos = r.fallidos + EXCLUDED.fallidos;
+
+  INSERT INTO seguridad.resumen_login_usuario_hora AS r (hora, identificador, intentos, fallidos)
+  SELECT date_trunc('hour', n.intentado_en), LOWER(n.identificador),
+         COUNT(*), COUNT(*) FILTER (WHERE NOT n.exitoso)
+  FROM nuevos n
+  GROUP BY 1, 2
+  ORDER BY 1, 2
+  ON CONFLICT (hora, identificador) DO UPDATE
+    SET intentos = r.intentos + EXCLUDED.intentos,
+        fallidos = r.fallidos + EXCLUDED.fallidos;
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_intentos_login_resumen ON seguridad.intentos_login;
+CREATE TRIGGER tg_intentos_login_resumen
+AFTER INSERT ON seguridad.intentos_login
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION seguridad.fn_resumen_login_hora();
+
+-- Carga inicial desde los intentos existentes
+INSERT INTO seguridad.resumen_login_ip_hora (hora, direccion_ip, intentos, fallidos)
+SELECT date_trunc('hour', intentado_en), direccion_ip,
+       COUNT(*), COUNT(*) FILTER (WHERE NOT exitoso)
+FROM seguridad.intentos_login
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+
+INSERT INTO seguridad.resumen_login_usuario_hora (hora, identificador, intentos, fallidos)
+SELECT date_trunc('hour', intentado_en), LOWER(identificador),
+       COUNT(*), COUNT(*) FILTER (WHERE NOT exitoso)
+FROM seguridad.intentos_login
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+
+-- ======================================
+-- 4.z) PARTICIONADO MENSUAL DE BITÁCORAS DE SEGURIDAD
+-- ======================================
+-- seguridad.intentos_login (intentado_en) y seguridad.eventos (fecha) se
+-- convierten en tablas particionadas por mes con `flask bitacoras-particionar`
+-- (la tabla actual queda adjunta como partición *_legacy sin re-escanearla).
+-- `flask bitacoras-retencion` archiva en .csv.gz y elimina particiones viejas.
+
+-- Crea las particiones del mes actual y de los p_meses siguientes.
+CREATE OR REPLACE FUNCTION seguridad.fn_crear_particiones_mensuales(p_tabla TEXT, p_meses INT DEFAULT 3)
+RETURNS INT LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = seguridad, pg_temp AS $$
+DECLARE
+  v_inicio  DATE := date_trunc('month', NOW())::date;
+  v_desde   DATE;
+  v_nombre  TEXT;
+  v_creadas INT := 0;
+BEGIN
+  FOR i IN 0..p_meses LOOP
+    v_desde  := (v_inicio + make_interval(months => i))::date;
+    v_nombre := format('%s_y%sm%s', p_tabla, to_char(v_desde, 'YYYY'), to_char(v_desde, 'MM'));
+    CONTINUE WHEN to_regclass(format('seguridad.%I', v_nombre)) IS NOT NULL;
+    BEGIN
+      EXECUTE format(
+        'CREATE TABLE seguridad.%I PARTITION OF seguridad.%I FOR VALUES FROM (%L) TO (%L)',
+        v_nombre, p_tabla, v_desde, (v_desde + INTERVAL '1 month')::date
+      );
+      v_creadas := v_creadas + 1;
+    EXCEPTION WHEN invalid_object_definition THEN
+      NULL;  -- rango ya cubierto (p.ej. por la partición *_legacy)
+    END;
+  END LOOP;
+  RETURN v_creadas;
+END$$;
+
+-- Particiones de una tabla con su límite superior (NULL = MAXVALUE).
+CREATE OR REPLACE FUNCTION seguridad.fn_particiones(p_tabla REGCLASS)
+RETURNS TABLE(particion TEXT, hasta TIMESTAMPTZ)
+LANGUAGE sql STABLE AS $$
+  SELECT format('%I.%I', n.nspname, c.relname),
+         substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::timestamptz
+  FROM pg_inherits i
+  JOIN pg_class c     ON c.oid = i.inhrelid
+  JOIN pg_namespace n ON n.oid = c.relnamespace
+  WHERE i.inhparent = p_tabla
+  ORDER BY 2 NULLS LAST;
+$$;
+
+-- ======================================
+-- 4.w) COLA DE CORREO SALIENTE
+-- ======================================
+CREATE TABLE IF NOT EXISTS seguridad.cola_correos (
+  id_correo          BIGSERIAL PRIMARY KEY,
+  destinatario       VARCHAR(255) NOT NULL,
+  asunto             VARCHAR(255) NOT NULL,
+  cuerpo             TEXT NOT NULL,               -- se vacía al enviarse o fallar
+  estado             VARCHAR(20) NOT NULL DEFAULT 'pendiente'
+                     CHECK (estado IN ('pendiente', 'enviando', 'enviado', 'fallido')),
+  intentos           SMALLINT NOT NULL DEFAULT 0,
+  max_intentos       SMALLINT NOT NULL DEFAULT 5,
+  proximo_intento_en TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  bloqueado_hasta    TIMESTAMPTZ,                 -- reserva del worker ('enviando')
+  ultimo_error       TEXT,
+  creado_en          TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  enviado_en         TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_cola_correos_pendientes
+  ON seguridad.cola_correos (proximo_intento_en) WHERE estado = 'pendiente';
+CREATE INDEX IF NOT EXISTS idx_cola_correos_reservados
+  ON seguridad.cola_correos (bloqueado_hasta) WHERE estado = 'enviando';
+
+-- Los cuerpos pueden llevar contraseñas temporales: no se guardan en filas
+-- cerradas (las de versiones anteriores que conservaron el cuerpo)
+UPDATE seguridad.cola_correos
+SET cuerpo = ''
+WHERE estado IN ('enviado', 'fallido') AND cuerpo <> '';
+
+-- ======================================
+-- 4.v) IMPORTACIONES MASIVAS DE USUARIOS
+-- ======================================
+-- Avance y resultado de cada importación CSV (la pantalla de admin la
+-- consulta mientras corre en segundo plano).
+CREATE TABLE IF NOT EXISTS seguridad.importaciones_usuarios (
+  id_importacion BIGSERIAL PRIMARY KEY,
+  creado_por     BIGINT REFERENCES seguridad.usuarios(id_usuario) ON DELETE SET NULL,
+  archivo        VARCHAR(255) NOT NULL,
+  simulacion     BOOLEAN NOT NULL DEFAULT FALSE,
+  estado         VARCHAR(20) NOT NULL DEFAULT 'procesando'
+                 CHECK (estado IN ('procesando', 'completada', 'fallida')),
+  filas_leidas   INT NOT NULL DEFAULT 0,
+  insertadas     INT NOT NULL DEFAULT 0,
+  total_errores  INT NOT NULL DEFAULT 0,
+  errores        JSONB NOT NULL DEFAULT '[]'::jsonb,   -- [{linea, error}, ...]
+  mensaje        TEXT,
+  creado_en      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  terminado_en   TIMESTAMPTZ
+);
+
+-- ======================================
+-- 4.u) ACCIONES MASIVAS SOBRE USUARIOS
+-- ======================================
+-- Filtros de /admin/usuarios/masivo: inactividad (nunca accedió = desde la
+-- creación), fecha de alta y rol.
+CREATE INDEX IF NOT EXISTS idx_usuarios_ultima_actividad
+  ON seguridad.usuarios ((COALESCE(ultimo_acceso_en, creado_en)));
+CREATE INDEX IF NOT EXISTS idx_usuarios_creado_en
+  ON seguridad.usuarios (creado_en);
+CREATE INDEX IF NOT EXISTS idx_usuario_rol_rol
+  ON seguridad.usuario_rol (id_rol, id_usuario);
+
+-- Resets masivos desde la web: corren en segundo plano (bcrypt por cuenta)
+-- y la pantalla de admin consulta aquí el avance y el resumen.
+CREATE TABLE IF NOT EXISTS seguridad.acciones_masivas (
+  id_accion         BIGSERIAL PRIMARY KEY,
+  creado_por        BIGINT REFERENCES seguridad.usuarios(id_usuario) ON DELETE SET NULL,
+  accion            VARCHAR(20) NOT NULL,
+  estado            VARCHAR(20) NOT NULL DEFAULT 'procesando'
+                    CHECK (estado IN ('procesando', 'completada', 'fallida')),
+  seleccionados     INT NOT NULL DEFAULT 0,
+  afectados         INT NOT NULL DEFAULT 0,
+  correos_encolados INT NOT NULL DEFAULT 0,
+  mensaje           TEXT,
+  creado_en         TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  terminado_en      TIMESTAMPTZ
+);
+
+-- ======================================
+-- 4.t) DIRECTORIO DE USUARIOS: BÚSQUEDA Y RESUMEN POR ROL
+-- ======================================
+-- Búsqueda por subcadena (ILIKE '%q%') con índices trigram.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_usuarios_nombre_trgm
+  ON seguridad.usuarios USING gin (nombre_usuario gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_usuarios_correo_trgm
+  ON seguridad.usuarios USING gin (correo_electronico gin_trgm_ops);
+
+-- Resumen por rol y estado: una fila por (rol, activo) con el mismo conteo
+-- que el LEFT JOIN usuarios/usuario_rol/roles agrupado (id_rol NULL = "Sin rol").
+-- Los cambios de rol se hacen con INSERT/DELETE sobre usuario_rol.
+CREATE TABLE IF NOT EXISTS seguridad.resumen_usuarios_rol (
+  id_rol  SMALLINT REFERENCES seguridad.roles(id_rol) ON DELETE CASCADE,
+  activo  BOOLEAN NOT NULL,
+  total   BIGINT  NOT NULL DEFAULT 0,
+  CONSTRAINT uq_resumen_usuarios_rol UNIQUE NULLS NOT DISTINCT (id_rol, activo)
+);
+
+-- Cada trigger arma sus deltas (id_rol, activo, n) y los suma con
+-- INSERT ... ON CONFLICT, en orden fijo para no provocar interbloqueos.
+
+-- usuarios: alta (sin roles todavía) y cambio de activo
+CREATE OR REPLACE FUNCTION seguridad.fn_resumen_usuarios_usuarios()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO seguridad.resumen_usuarios_rol AS r (id_rol, activo, total)
+    SELECT NULL, n.activo, COUNT(*)
+    FROM nuevos n
+    GROUP BY n.activo
+    ORDER BY n.activo
+    ON CONFLICT ON CONSTRAINT uq_resumen_usuarios_rol DO UPDATE
+      SET total = r.total + EXCLUDED.total;
+  ELSE
+    INSERT INTO seguridad.resumen_usuarios_rol AS r (id_rol, activo, total)
+    SELECT d.id_rol, d.activo, SUM(d.n)
+    FROM (
+      SELECT ur.id_rol, o.activo, -1 AS n
+      FROM nuevos n
+      JOIN viejos o ON o.id_usuario = n.id_usuario AND o.activo IS DISTINCT FROM n.activo
+      LEFT JOIN seguridad.usuario_rol ur ON ur.id_usuario = n.id_usuario
+      UNION ALL
+      SELECT ur.id_rol, n.activo, 1
+      FROM nuevos n
+      JOIN viejos o ON o.id_usuario = n.id_usuario AND o.activo IS DISTINCT FROM n.activo
+      LEFT JOIN seguridad.usuario_rol ur ON ur.id_usuario = n.id_usuario
+    ) d
+    GROUP BY 1, 2
+    HAVING SUM(d.n) <> 0
+    ORDER BY 1, 2
+    ON CONFLICT ON CONSTRAINT uq_resumen_usuarios_rol DO UPDATE
+      SET total = r.total + EXCLUDED.total;
+  END IF;
+  RETURN NULL;
+END$$;
+
+-- usuarios: baja. Por fila y BEFORE porque el ON DELETE CASCADE borra
+-- usuario_rol antes de que corra un trigger AFTER de sentencia.
+CREATE OR REPLACE FUNCTION seguridad.fn_resumen_usuarios_baja()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO seguridad.resumen_usuarios_rol AS r (id_rol, activo, total)
+  SELECT ur.id_rol, OLD.activo, -1
+  FROM (SELECT OLD.id_usuario AS id_usuario) u
+  LEFT JOIN seguridad.usuario_rol ur ON ur.id_usuario = u.id_usuario
+  ORDER BY 1
+  ON CONFLICT ON CONSTRAINT uq_resumen_usuarios_rol DO UPDATE
+    SET total = r.total + EXCLUDED.total;
+  RETURN OLD;
+END$$;
+
+-- usuario_rol: asignación y retiro de roles (incluye el paso por "Sin rol").
+-- Las filas en cascada de una baja se ignoran: el usuario ya no existe.
+CREATE OR REPLACE FUNCTION seguridad.fn_resumen_usuarios_roles()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO seguridad.resumen_usuarios_rol AS r (id_rol, activo, total)
+    SELECT d.id_rol, d.activo, SUM(d.n)
+    FROM (
+      SELECT n.id_rol, u.activo, 1 AS n
+      FROM nuevos n
+      JOIN seguridad.usuarios u ON u.id_usuario = n.id_usuario
+      UNION ALL
+      -- usuarios que antes no tenían ningún rol
+      SELECT NULL, u.activo, -1
+      FROM (SELECT id_usuario, COUNT(*) AS agregados FROM nuevos GROUP BY id_usuario) n
+      JOIN seguridad.usuarios u ON u.id_usuario = n.id_usuario
+      WHERE (SELECT COUNT(*) FROM seguridad.usuario_rol ur
+             WHERE ur.id_usuario = n.id_usuario) = n.agregados
+    ) d
+    GROUP BY 1, 2
+    HAVING SUM(d.n) <> 0
+    ORDER BY 1, 2
+    ON CONFLICT ON CONSTRAINT uq_resumen_usuarios_rol DO UPDATE
+      SET total = r.total + EXCLUDED.total;
+  ELSE
+    INSERT INTO seguridad.resumen_usuarios_rol AS r (id_rol, activo, total)
+    SELECT d.id_rol, d.activo, SUM(d.n)
+    FROM (
+      SELECT o.id_rol, u.activo, -1 AS n
+      FROM viejos o
+      JOIN seguridad.usuarios u ON u.id_usuario = o.id_usuario
+      UNION ALL
+      -- usuarios que se quedaron sin ningún rol
+      SELECT NULL, u.activo, 1
+      FROM (SELECT DISTINCT id_usuario FROM viejos) o
+      JOIN seguridad.usuarios u ON u.id_usuario = o.id_usuario
+      WHERE NOT EXISTS (SELECT 1 FROM seguridad.usuario_rol ur
+                        WHERE ur.id_usuario = o.id_usuario)
+    ) d
+    GROUP BY 1, 2
+    HAVING SUM(d.n) <> 0
+    ORDER BY 1, 2
+    ON CONFLICT ON CONSTRAINT uq_resumen_usuarios_rol DO UPDATE
+      SET total = r.total + EXCLUDED.total;
+  END IF;
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_usuarios_resumen_ins ON seguridad.usuarios;
+CREATE TRIGGER tg_usuarios_resumen_ins
+AFTER INSERT ON seguridad.usuarios
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION seguridad.fn_resumen_usuarios_usuarios();
+
+DROP TRIGGER IF EXISTS tg_usuarios_resumen_upd ON seguridad.usuarios;
+CREATE TRIGGER tg_usuarios_resumen_upd
+AFTER UPDATE ON seguridad.usuarios
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION seguridad.fn_resumen_usuarios_usuarios();
+
+DROP TRIGGER IF EXISTS tg_usuarios_resumen_del ON seguridad.usuarios;
+CREATE TRIGGER tg_usuarios_resumen_del
+BEFORE DELETE ON seguridad.usuarios
+FOR EACH ROW EXECUTE FUNCTION seguridad.fn_resumen_usuarios_baja();
+
+DROP TRIGGER IF EXISTS tg_usuario_rol_resumen_ins ON seguridad.usuario_rol;
+CREATE TRIGGER tg_usuario_rol_resumen_ins
+AFTER INSERT ON seguridad.usuario_rol
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION seguridad.fn_resumen_usuarios_roles();
+
+DROP TRIGGER IF EXISTS tg_usuario_rol_resumen_del ON seguridad.usuario_rol;
+CREATE TRIGGER tg_usuario_rol_resumen_del
+AFTER DELETE ON seguridad.usuario_rol
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION seguridad.fn_resumen_usuarios_roles();
+
+-- Recalcula el resumen completo (carga inicial o verificación).
+CREATE OR REPLACE FUNCTION seguridad.fn_resumen_usuarios_recalcular()
+RETURNS VOID LANGUAGE sql AS $$
+  LOCK TABLE seguridad.usuarios, seguridad.usuario_rol IN SHARE MODE;
+  DELETE FROM seguridad.resumen_usuarios_rol;
+  INSERT INTO seguridad.resumen_usuarios_rol (id_rol, activo, total)
+  SELECT ur.id_rol, u.activo, COUNT(*)
+  FROM seguridad.usuarios u
+  LEFT JOIN seguridad.usuario_rol ur ON ur.id_usuario = u.id_usuario
+  GROUP BY 1, 2;
+$$;
+
+SELECT seguridad.fn_resumen_usuarios_recalcular();
+
+-- ======================================
+-- 4.s) BÚSQUEDA EN EL CATÁLOGO DE BIBLIOTECA
+-- ======================================
+-- Un documento de búsqueda por libro (título, autores, temas, editorial,
+-- clasificación, ISBN) mantenido por triggers de sentencia. La app consulta
+-- solo esta tabla: FTS en español (índice GIN sobre `documento`) + similitud
+-- trigram por palabra (índice GIN trgm sobre `texto`) + ISBN exacto.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS biblioteca.libros_busqueda (
+  id_libro      INT PRIMARY KEY REFERENCES biblioteca.Libros(id_libro) ON DELETE CASCADE,
+  isbn          BIGINT,
+  autores       TEXT,
+  temas         TEXT,
+  editorial     VARCHAR(150),
+  clasificacion VARCHAR(20),
+  texto         TEXT NOT NULL,       -- todo concatenado, para trigram
+  documento     TSVECTOR NOT NULL    -- A: título/ISBN, B: autores, C: temas, D: editorial
+);
+
+CREATE INDEX IF NOT EXISTS idx_libros_busqueda_documento
+  ON biblioteca.libros_busqueda USING gin (documento);
+CREATE INDEX IF NOT EXISTS idx_libros_busqueda_texto_trgm
+  ON biblioteca.libros_busqueda USING gin (texto gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_libros_busqueda_isbn
+  ON biblioteca.libros_busqueda (isbn);
+
+-- Índices para encontrar los libros afectados al renombrar autor / tema.
+CREATE INDEX IF NOT EXISTS idx_autores_libros_autor ON biblioteca.Autores_Libros (id_autor);
+CREATE INDEX IF NOT EXISTS idx_libros_temas_tema ON biblioteca.Libros_Temas (id_tema);
+CREATE INDEX IF NOT EXISTS idx_libros_editorial ON biblioteca.Libros (id_editorial);
+CREATE INDEX IF NOT EXISTS idx_libros_clasificacion ON biblioteca.Libros (id_clasificacion);
+
+-- Recalcula el documento de los libros indicados (los que ya no existen se ignoran).
+CREATE OR REPLACE FUNCTION biblioteca.fn_libros_busqueda_refrescar(p_ids INT[])
+RETURNS VOID LANGUAGE sql AS $$
+  INSERT INTO biblioteca.libros_busqueda AS b
+    (id_libro, isbn, autores, temas, editorial, clasificacion, texto, documento)
+  SELECT
+    l.id_libro, l.isbn, a.autores, t.temas, e.nombre_editorial, c.codigo_clasificacion,
+    concat_ws(' ', l.titulo_libro, a.autores, t.temas, e.nombre_editorial,
+              c.codigo_clasificacion, l.isbn),
+    setweight(to_tsvector('spanish', l.titulo_libro), 'A')
+      || setweight(to_tsvector('simple', COALESCE(l.isbn::text, '')), 'A')
+      || setweight(to_tsvector('spanish', COALESCE(a.autores, '')), 'B')
+      || setweight(to_tsvector('spanish', COALESCE(t.temas, '')), 'C')
+      || setweight(to_tsvector('spanish', concat_ws(' ', e.nombre_editorial,
+                                                    c.codigo_clasificacion)), 'D')
+  FROM biblioteca.Libros l
+  LEFT JOIN biblioteca.Editoriales e     ON e.id_editorial = l.id_editorial
+  LEFT JOIN biblioteca.Clasificaciones c ON c.id_clasificacion = l.id_clasificacion
+  LEFT JOIN LATERAL (
+    SELECT string_agg(au.nombre_autor, ', ' ORDER BY al.id_autor_libro) AS autores
+    FROM biblioteca.Autores_Libros al
+    JOIN biblioteca.Autores au ON au.id_autor = al.id_autor
+    WHERE al.id_libro = l.id_libro
+  ) a ON TRUE
+  LEFT JOIN LATERAL (
+    SELECT string_agg(te.nombre_tema, ', ' ORDER BY te.nombre_tema) AS temas
+    FROM biblioteca.Libros_Temas lt
+    JOIN biblioteca.Temas te ON te.id_tema = lt.id_tema
+    WHERE lt.id_libro = l.id_libro
+  ) t ON TRUE
+  WHERE l.id_libro = ANY(p_ids)
+  ORDER BY l.id_libro
+  ON CONFLICT (id_libro) DO UPDATE
+    SET isbn = EXCLUDED.isbn,
+        autores = EXCLUDED.autores,
+        temas = EXCLUDED.temas,
+        editorial = EXCLUDED.editorial,
+        clasificacion = EXCLUDED.clasificacion,
+        texto = EXCLUDED.texto,
+        documento = EXCLUDED.documento;
+$$;
+
+-- Un solo trigger de sentencia por tabla/evento; decide qué libros refrescar.
+CREATE OR REPLACE FUNCTION biblioteca.fn_libros_busqueda_tg()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+DECLARE
+  v_ids INT[];
+BEGIN
+  IF TG_TABLE_NAME IN ('libros', 'autores_libros', 'libros_temas') THEN
+    IF TG_OP = 'DELETE' THEN
+      SELECT array_agg(DISTINCT id_libro) INTO v_ids FROM viejos;
+    ELSE
+      SELECT array_agg(DISTINCT id_libro) INTO v_ids FROM nuevos;
+    END IF;
+  ELSIF TG_TABLE_NAME = 'autores' THEN
+    SELECT array_agg(DISTINCT al.id_libro) INTO v_ids
+    FROM nuevos n JOIN biblioteca.Autores_Libros al ON al.id_autor = n.id_autor;
+  ELSIF TG_TABLE_NAME = 'temas' THEN
+    SELECT array_agg(DISTINCT lt.id_libro) INTO v_ids
+    FROM nuevos n JOIN biblioteca.Libros_Temas lt ON lt.id_tema = n.id_tema;
+  ELSIF TG_TABLE_NAME = 'editoriales' THEN
+    SELECT array_agg(l.id_libro) INTO v_ids
+    FROM nuevos n JOIN biblioteca.Libros l ON l.id_editorial = n.id_editorial;
+  ELSIF TG_TABLE_NAME = 'clasificaciones' THEN
+    SELECT array_agg(l.id_libro) INTO v_ids
+    FROM nuevos n JOIN biblioteca.Libros l ON l.id_clasificacion = n.id_clasificacion;
+  END IF;
+
+  IF v_ids IS NOT NULL THEN
+    PERFORM biblioteca.fn_libros_busqueda_refrescar(v_ids);
+  END IF;
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_libros_busqueda_ins ON biblioteca.Libros;
+CREATE TRIGGER tg_libros_busqueda_ins AFTER INSERT ON biblioteca.Libros
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+DROP TRIGGER IF EXISTS tg_libros_busqueda_upd ON biblioteca.Libros;
+CREATE TRIGGER tg_libros_busqueda_upd AFTER UPDATE ON biblioteca.Libros
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+
+DROP TRIGGER IF EXISTS tg_autores_libros_busqueda_ins ON biblioteca.Autores_Libros;
+CREATE TRIGGER tg_autores_libros_busqueda_ins AFTER INSERT ON biblioteca.Autores_Libros
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+DROP TRIGGER IF EXISTS tg_autores_libros_busqueda_del ON biblioteca.Autores_Libros;
+CREATE TRIGGER tg_autores_libros_busqueda_del AFTER DELETE ON biblioteca.Autores_Libros
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+
+DROP TRIGGER IF EXISTS tg_libros_temas_busqueda_ins ON biblioteca.Libros_Temas;
+CREATE TRIGGER tg_libros_temas_busqueda_ins AFTER INSERT ON biblioteca.Libros_Temas
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+DROP TRIGGER IF EXISTS tg_libros_temas_busqueda_del ON biblioteca.Libros_Temas;
+CREATE TRIGGER tg_libros_temas_busqueda_del AFTER DELETE ON biblioteca.Libros_Temas
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+
+DROP TRIGGER IF EXISTS tg_autores_busqueda_upd ON biblioteca.Autores;
+CREATE TRIGGER tg_autores_busqueda_upd AFTER UPDATE ON biblioteca.Autores
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+DROP TRIGGER IF EXISTS tg_temas_busqueda_upd ON biblioteca.Temas;
+CREATE TRIGGER tg_temas_busqueda_upd AFTER UPDATE ON biblioteca.Temas
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+DROP TRIGGER IF EXISTS tg_editoriales_busqueda_upd ON biblioteca.Editoriales;
+CREATE TRIGGER tg_editoriales_busqueda_upd AFTER UPDATE ON biblioteca.Editoriales
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+DROP TRIGGER IF EXISTS tg_clasificaciones_busqueda_upd ON biblioteca.Clasificaciones;
+CREATE TRIGGER tg_clasificaciones_busqueda_upd AFTER UPDATE ON biblioteca.Clasificaciones
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_libros_busqueda_tg();
+
+-- Carga inicial
+SELECT biblioteca.fn_libros_busqueda_refrescar(ARRAY(SELECT id_libro FROM biblioteca.Libros));
+
+-- ======================================
+-- 4.r) PRÉSTAMOS: INVENTARIO ATÓMICO Y LÍMITE POR ALUMNO
+-- ======================================
+-- El checkout descuenta inventario con un UPDATE condicional
+-- (cantidad_disponible > 0) y la devolución lo repone sin pasar de
+-- `cantidad`. Préstamo "abierto" = estado Activo o Vencido.
+ALTER TABLE biblioteca.Inventario DROP CONSTRAINT IF EXISTS ck_inventario_disponible_max;
+ALTER TABLE biblioteca.Inventario
+  ADD CONSTRAINT ck_inventario_disponible_max CHECK (cantidad_disponible <= cantidad) NOT VALID;
+
+INSERT INTO academico.parametros_globales (clave, valor_texto, descripcion, categoria)
+VALUES
+  ('biblioteca_max_prestamos_alumno', '3', 'Préstamos abiertos simultáneos por alumno', 'biblioteca'),
+  ('biblioteca_dias_prestamo',        '7', 'Días de préstamo a domicilio',              'biblioteca')
+ON CONFLICT (clave) DO NOTHING;
+
+-- Préstamos abiertos por alumno. La fila del alumno funciona como candado:
+-- dos checkouts simultáneos del mismo alumno se serializan en el UPDATE y
+-- el segundo ve el conteo ya incrementado.
+CREATE TABLE IF NOT EXISTS biblioteca.prestamos_activos_alumno (
+  fk_alumno VARCHAR(20) PRIMARY KEY REFERENCES academico.alumnos(numero_control) ON DELETE CASCADE,
+  activos   INT NOT NULL DEFAULT 0 CHECK (activos >= 0)
+);
+
+CREATE OR REPLACE FUNCTION biblioteca.fn_prestamos_activos_alumno()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+DECLARE
+  v_limite  INT;
+  v_activos INT;
+BEGIN
+  -- Sale el préstamo anterior (devolución, cambio de alumno o borrado)
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.fk_alumno IS NOT NULL AND OLD.estado <> 'Devuelto' THEN
+    UPDATE biblioteca.prestamos_activos_alumno
+    SET activos = activos - 1
+    WHERE fk_alumno = OLD.fk_alumno;
+  END IF;
+
+  -- Entra el nuevo (checkout); aquí se valida el límite
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.fk_alumno IS NOT NULL AND NEW.estado <> 'Devuelto' THEN
+    INSERT INTO biblioteca.prestamos_activos_alumno AS c (fk_alumno, activos)
+    VALUES (NEW.fk_alumno, 1)
+    ON CONFLICT (fk_alumno) DO UPDATE SET activos = c.activos + 1
+    RETURNING activos INTO v_activos;
+
+    SELECT COALESCE(MAX(valor_texto::int), 3) INTO v_limite
+    FROM academico.parametros_globales
+    WHERE clave = 'biblioteca_max_prestamos_alumno';
+
+    IF v_activos > v_limite THEN
+      RAISE EXCEPTION 'El alumno % ya tiene % préstamos abiertos (límite %).',
+        NEW.fk_alumno, v_activos - 1, v_limite
+        USING ERRCODE = 'check_violation';
+    END IF;
+  END IF;
+
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_prestamos_activos_alumno_ins ON biblioteca.Prestamos;
+CREATE TRIGGER tg_prestamos_activos_alumno_ins
+AFTER INSERT ON biblioteca.Prestamos
+FOR EACH ROW EXECUTE FUNCTION biblioteca.fn_prestamos_activos_alumno();
+
+-- Solo cuando cambia abierto/devuelto o el alumno (no al pasar Activo -> Vencido).
+DROP TRIGGER IF EXISTS tg_prestamos_activos_alumno_upd ON biblioteca.Prestamos;
+CREATE TRIGGER tg_prestamos_activos_alumno_upd
+AFTER UPDATE OF estado, fk_alumno ON biblioteca.Prestamos
+FOR EACH ROW
+WHEN ((OLD.estado = 'Devuelto') IS DISTINCT FROM (NEW.estado = 'Devuelto')
+      OR OLD.fk_alumno IS DISTINCT FROM NEW.fk_alumno)
+EXECUTE FUNCTION biblioteca.fn_prestamos_activos_alumno();
+
+DROP TRIGGER IF EXISTS tg_prestamos_activos_alumno_del ON biblioteca.Prestamos;
+CREATE TRIGGER tg_prestamos_activos_alumno_del
+AFTER DELETE ON biblioteca.Prestamos
+FOR EACH ROW EXECUTE FUNCTION biblioteca.fn_prestamos_activos_alumno();
+
+-- Carga inicial
+INSERT INTO biblioteca.prestamos_activos_alumno (fk_alumno, activos)
+SELECT fk_alumno, COUNT(*)
+FROM biblioteca.Prestamos
+WHERE fk_alumno IS NOT NULL AND estado <> 'Devuelto'
+GROUP BY fk_alumno
+ON CONFLICT (fk_alumno) DO UPDATE SET activos = EXCLUDED.activos;
+
+-- ======================================
+-- 4.q) RESUMEN DE BIBLIOTECA (CONTADORES)
+-- ======================================
+-- Una sola fila con los números del panel del bibliotecario, mantenida por
+-- triggers. "Estudiantes con préstamo" sale de prestamos_activos_alumno
+-- (solo cuenta transiciones 0 <-> >0). Los retrasados (Vencido o Activo con
+-- fecha estimada ya pasada) dependen del reloj: los recalcula el barrido
+-- programado fn_resumen_biblioteca_retrasados().
+CREATE INDEX IF NOT EXISTS idx_prestamos_estado_fecha_estimada
+  ON biblioteca.Prestamos (estado, fecha_devolucion_estimada);
+
+CREATE TABLE IF NOT EXISTS biblioteca.resumen_biblioteca (
+  id                       BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  total_libros             BIGINT NOT NULL DEFAULT 0,
+  prestamos_activos        BIGINT NOT NULL DEFAULT 0,   -- estado = 'Activo'
+  prestamos_vencidos       BIGINT NOT NULL DEFAULT 0,   -- estado = 'Vencido'
+  estudiantes_con_prestamo BIGINT NOT NULL DEFAULT 0,   -- alumnos con préstamos abiertos
+  prestamos_retrasados     BIGINT NOT NULL DEFAULT 0,   -- del último barrido
+  retrasados_calculado_en  TIMESTAMPTZ
+);
+INSERT INTO biblioteca.resumen_biblioteca (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION biblioteca.fn_resumen_biblioteca_libros()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE biblioteca.resumen_biblioteca
+    SET total_libros = total_libros + (SELECT COUNT(*) FROM nuevos);
+  ELSE
+    UPDATE biblioteca.resumen_biblioteca
+    SET total_libros = total_libros - (SELECT COUNT(*) FROM viejos);
+  END IF;
+  RETURN NULL;
+END$$;
+
+CREATE OR REPLACE FUNCTION biblioteca.fn_resumen_biblioteca_prestamos()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+DECLARE
+  v_activos  BIGINT := 0;
+  v_vencidos BIGINT := 0;
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    SELECT v_activos + COUNT(*) FILTER (WHERE estado = 'Activo'),
+           v_vencidos + COUNT(*) FILTER (WHERE estado = 'Vencido')
+    INTO v_activos, v_vencidos
+    FROM nuevos;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    SELECT v_activos - COUNT(*) FILTER (WHERE estado = 'Activo'),
+           v_vencidos - COUNT(*) FILTER (WHERE estado = 'Vencido')
+    INTO v_activos, v_vencidos
+    FROM viejos;
+  END IF;
+
+  IF v_activos <> 0 OR v_vencidos <> 0 THEN
+    UPDATE biblioteca.resumen_biblioteca
+    SET prestamos_activos  = prestamos_activos + v_activos,
+        prestamos_vencidos = prestamos_vencidos + v_vencidos;
+  END IF;
+  RETURN NULL;
+END$$;
+
+CREATE OR REPLACE FUNCTION biblioteca.fn_resumen_biblioteca_alumnos()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+DECLARE
+  v_delta INT := 0;
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.activos > 0 THEN
+    v_delta := v_delta + 1;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.activos > 0 THEN
+    v_delta := v_delta - 1;
+  END IF;
+  IF v_delta <> 0 THEN
+    UPDATE biblioteca.resumen_biblioteca
+    SET estudiantes_con_prestamo = estudiantes_con_prestamo + v_delta;
+  END IF;
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_resumen_biblioteca_libros_ins ON biblioteca.Libros;
+CREATE TRIGGER tg_resumen_biblioteca_libros_ins AFTER INSERT ON biblioteca.Libros
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_resumen_biblioteca_libros();
+DROP TRIGGER IF EXISTS tg_resumen_biblioteca_libros_del ON biblioteca.Libros;
+CREATE TRIGGER tg_resumen_biblioteca_libros_del AFTER DELETE ON biblioteca.Libros
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_resumen_biblioteca_libros();
+
+DROP TRIGGER IF EXISTS tg_resumen_biblioteca_prestamos_ins ON biblioteca.Prestamos;
+CREATE TRIGGER tg_resumen_biblioteca_prestamos_ins AFTER INSERT ON biblioteca.Prestamos
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_resumen_biblioteca_prestamos();
+DROP TRIGGER IF EXISTS tg_resumen_biblioteca_prestamos_upd ON biblioteca.Prestamos;
+CREATE TRIGGER tg_resumen_biblioteca_prestamos_upd AFTER UPDATE ON biblioteca.Prestamos
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_resumen_biblioteca_prestamos();
+DROP TRIGGER IF EXISTS tg_resumen_biblioteca_prestamos_del ON biblioteca.Prestamos;
+CREATE TRIGGER tg_resumen_biblioteca_prestamos_del AFTER DELETE ON biblioteca.Prestamos
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION biblioteca.fn_resumen_biblioteca_prestamos();
+
+DROP TRIGGER IF EXISTS tg_resumen_biblioteca_alumnos ON biblioteca.prestamos_activos_alumno;
+CREATE TRIGGER tg_resumen_biblioteca_alumnos
+AFTER INSERT OR UPDATE OR DELETE ON biblioteca.prestamos_activos_alumno
+FOR EACH ROW EXECUTE FUNCTION biblioteca.fn_resumen_biblioteca_alumnos();
+
+-- Barrido programado de retrasados (usa idx_prestamos_estado_fecha_estimada).
+CREATE OR REPLACE FUNCTION biblioteca.fn_resumen_biblioteca_retrasados()
+RETURNS BIGINT LANGUAGE sql AS $$
+  UPDATE biblioteca.resumen_biblioteca
+  SET prestamos_retrasados = (
+        SELECT COUNT(*) FROM biblioteca.Prestamos
+        WHERE estado = 'Vencido'
+           OR (estado = 'Activo' AND fecha_devolucion_estimada < NOW())
+      ),
+      retrasados_calculado_en = NOW()
+  RETURNING prestamos_retrasados;
+$$;
+
+-- Conteo completo, para verificar o reconstruir los contadores.
+CREATE OR REPLACE FUNCTION biblioteca.fn_resumen_biblioteca_recuento()
+RETURNS TABLE(total_libros BIGINT, prestamos_activos BIGINT, prestamos_vencidos BIGINT,
+              estudiantes_con_prestamo BIGINT)
+LANGUAGE sql STABLE AS $$
+  SELECT
+    (SELECT COUNT(*) FROM biblioteca.Libros),
+    (SELECT COUNT(*) FROM biblioteca.Prestamos WHERE estado = 'Activo'),
+    (SELECT COUNT(*) FROM biblioteca.Prestamos WHERE estado = 'Vencido'),
+    (SELECT COUNT(DISTINCT fk_alumno) FROM biblioteca.Prestamos
+     WHERE fk_alumno IS NOT NULL AND estado <> 'Devuelto');
+$$;
+
+-- Carga inicial
+UPDATE biblioteca.resumen_biblioteca r
+SET total_libros = c.total_libros,
+    prestamos_activos = c.prestamos_activos,
+    prestamos_vencidos = c.prestamos_vencidos,
+    estudiantes_con_prestamo = c.estudiantes_con_prestamo
+FROM biblioteca.fn_resumen_biblioteca_recuento() c;
+SELECT biblioteca.fn_resumen_biblioteca_retrasados();
+
+-- ======================================
+-- 4.p) NOTIFICACIONES A ALUMNOS Y BARRIDO DE PRÉSTAMOS VENCIDOS
+-- ======================================
+-- Bandeja de notificaciones del alumno. `clave` agrupa avisos repetibles
+-- (p. ej. 'biblioteca-vencidos:2025-03-01', un resumen por alumno y día);
+-- el UNIQUE hace idempotente el barrido aunque corra en varios workers.
+-- `pendiente_envio` marca las que aún deben pasar a seguridad.cola_correos.
+CREATE TABLE IF NOT EXISTS academico.notificaciones_alumno (
+  id_notificacion BIGSERIAL PRIMARY KEY,
+  fk_alumno VARCHAR(20) NOT NULL REFERENCES academico.alumnos(numero_control) ON DELETE CASCADE,
+  origen VARCHAR(30) NOT NULL DEFAULT 'general',
+  clave VARCHAR(100) NULL,
+  titulo VARCHAR(200) NOT NULL,
+  mensaje TEXT NOT NULL DEFAULT '',
+  leida BOOLEAN NOT NULL DEFAULT FALSE,
+  pendiente_envio BOOLEAN NOT NULL DEFAULT FALSE,
+  enviada_en TIMESTAMPTZ NULL,
+  fecha_creacion TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  CONSTRAINT uq_notificaciones_alumno_clave UNIQUE (fk_alumno, clave)
+);
+
+CREATE INDEX IF NOT EXISTS idx_notificaciones_alumno_bandeja
+  ON academico.notificaciones_alumno (fk_alumno, fecha_creacion DESC);
+CREATE INDEX IF NOT EXISTS idx_notificaciones_alumno_origen
+  ON academico.notificaciones_alumno (origen, fecha_creacion DESC);
+CREATE INDEX IF NOT EXISTS idx_notificaciones_alumno_pendientes
+  ON academico.notificaciones_alumno (id_notificacion) WHERE pendiente_envio;
+
+-- ======================================
+-- 4.o) RESERVAS (LISTA DE ESPERA POR LIBRO)
+-- ======================================
+-- Cola FIFO por id_libro; el orden es id_reserva. Un ejemplar devuelto
+-- pasa directo a la primera reserva 'En espera' (queda 'Apartada' y no
+-- vuelve a inventario); si nadie espera, se repone cantidad_disponible.
+-- La cabeza se bloquea con FOR UPDATE (sin SKIP LOCKED: saltarla rompería
+-- el orden FIFO); dos devoluciones o cancelaciones simultáneas se
+-- serializan sobre ella y nunca asignan la misma reserva.
+CREATE TABLE IF NOT EXISTS biblioteca.reservas (
+  id_reserva  BIGSERIAL PRIMARY KEY,
+  id_libro    INT NOT NULL REFERENCES biblioteca.Libros(id_libro) ON DELETE CASCADE,
+  fk_alumno   VARCHAR(20) NOT NULL REFERENCES academico.alumnos(numero_control) ON DELETE CASCADE,
+  estado      VARCHAR(20) NOT NULL DEFAULT 'En espera'
+              CHECK (estado IN ('En espera', 'Apartada', 'Cumplida', 'Cancelada', 'Expirada')),
+  creada_en   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  apartada_en TIMESTAMPTZ NULL,
+  expira_en   TIMESTAMPTZ NULL,
+  cerrada_en  TIMESTAMPTZ NULL
+);
+
+-- Una reserva abierta por alumno y libro
+CREATE UNIQUE INDEX IF NOT EXISTS uq_reservas_abierta
+  ON biblioteca.reservas (id_libro, fk_alumno) WHERE estado IN ('En espera', 'Apartada');
+-- Cola: cabeza y posición (solo filas en espera; las cerradas no pesan)
+CREATE INDEX IF NOT EXISTS idx_reservas_cola
+  ON biblioteca.reservas (id_libro, id_reserva) WHERE estado = 'En espera';
+CREATE INDEX IF NOT EXISTS idx_reservas_apartadas_expira
+  ON biblioteca.reservas (expira_en) WHERE estado = 'Apartada';
+CREATE INDEX IF NOT EXISTS idx_reservas_alumno_abiertas
+  ON biblioteca.reservas (fk_alumno) WHERE estado IN ('En espera', 'Apartada');
+
+INSERT INTO academico.parametros_globales (clave, valor_texto, descripcion, categoria)
+VALUES ('biblioteca_horas_apartado', '48', 'Horas que se guarda un libro apartado', 'biblioteca')
+ON CONFLICT (clave) DO NOTHING;
+
+-- Entrega un ejemplar libre del libro a la cabeza de la cola. Si no hay
+-- nadie esperando lo regresa a inventario y devuelve NULL. Quien la llame
+-- después de tocar Prestamos debe tener ya bloqueada la fila de Inventario
+-- (orden inventario → contadores → resumen, el mismo de un préstamo).
+CREATE OR REPLACE FUNCTION biblioteca.fn_reserva_asignar_ejemplar(p_id_libro INT)
+RETURNS BIGINT LANGUAGE plpgsql AS $$
+DECLARE
+  v_cabeza BIGINT;
+  v_id     BIGINT;
+  v_alumno VARCHAR(20);
+  v_expira TIMESTAMPTZ;
+BEGIN
+  LOOP
+    -- Si la cabeza estaba bloqueada y al liberarse ya no está en espera
+    -- (cancelada, asignada), FOR UPDATE + LIMIT puede no devolver filas:
+    -- se vuelve a buscar mientras quede alguien en espera.
+    SELECT id_reserva INTO v_cabeza
+    FROM biblioteca.reservas
+    WHERE id_libro = p_id_libro AND estado = 'En espera'
+    ORDER BY id_reserva
+    LIMIT 1
+    FOR UPDATE;
+
+    IF v_cabeza IS NULL THEN
+      EXIT WHEN NOT EXISTS (SELECT 1 FROM biblioteca.reservas
+                            WHERE id_libro = p_id_libro AND estado = 'En espera');
+      CONTINUE;
+    END IF;
+
+    UPDATE biblioteca.reservas r
+    SET estado = 'Apartada',
+        apartada_en = NOW(),
+        expira_en = NOW() + make_interval(hours => COALESCE((
+          SELECT valor_texto::int FROM academico.parametros_globales
+          WHERE clave = 'biblioteca_horas_apartado'), 48))
+    WHERE r.id_reserva = v_cabeza
+      AND r.estado = 'En espera'
+    RETURNING r.id_reserva, r.fk_alumno, r.expira_en INTO v_id, v_alumno, v_expira;
+    EXIT WHEN v_id IS NOT NULL;
+  END LOOP;
+
+  IF v_id IS NULL THEN
+    UPDATE biblioteca.Inventario
+    SET cantidad_disponible = cantidad_disponible + 1
+    WHERE id_libro = p_id_libro AND cantidad_disponible < cantidad;
+    RETURN NULL;
+  END IF;
+
+  INSERT INTO academico.notificaciones_alumno (fk_alumno, origen, clave, titulo, mensaje)
+  SELECT v_alumno, 'reservas', 'reserva:' || v_id, 'Tu libro reservado está listo',
+         'El libro "' || l.titulo_libro || '" está apartado a tu nombre hasta el '
+         || to_char(v_expira, 'DD/MM/YYYY HH24:MI') || '. Pasa a recogerlo a la biblioteca.'
+  FROM biblioteca.Libros l
+  WHERE l.id_libro = p_id_libro
+  ON CONFLICT (fk_alumno, clave) DO NOTHING;
+
+  RETURN v_id;
+END$$;
+
+-- Barrido por lotes: expira los apartados vencidos (el ejemplar pasa al
+-- siguiente de la cola) y atiende colas de libros que tienen ejemplares
+-- libres (p. ej. tras dar de alta ejemplares nuevos).
+CREATE OR REPLACE FUNCTION biblioteca.fn_reservas_liberar(p_lote INT)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+  r   RECORD;
+  v_n INT := 0;
+BEGIN
+  FOR r IN
+    WITH vencidas AS (
+      SELECT id_reserva FROM biblioteca.reservas
+      WHERE estado = 'Apartada' AND expira_en < NOW()
+      ORDER BY expira_en
+      LIMIT p_lote
+      FOR UPDATE SKIP LOCKED
+    )
+    UPDATE biblioteca.reservas x
+    SET estado = 'Expirada', cerrada_en = NOW()
+    FROM vencidas v
+    WHERE x.id_reserva = v.id_reserva
+    RETURNING x.id_libro
+  LOOP
+    PERFORM biblioteca.fn_reserva_asignar_ejemplar(r.id_libro);
+    v_n := v_n + 1;
+  END LOOP;
+
+  FOR r IN
+    SELECT i.id_libro
+    FROM biblioteca.Inventario i
+    WHERE i.cantidad_disponible > 0
+      AND EXISTS (SELECT 1 FROM biblioteca.reservas q
+                  WHERE q.id_libro = i.id_libro AND q.estado = 'En espera')
+    LIMIT p_lote
+  LOOP
+    LOOP
+      UPDATE biblioteca.Inventario
+      SET cantidad_disponible = cantidad_disponible - 1
+      WHERE id_libro = r.id_libro AND cantidad_disponible > 0;
+      EXIT WHEN NOT FOUND;
+      -- NULL = ya no quedaba nadie; el ejemplar regresó a inventario
+      EXIT WHEN biblioteca.fn_reserva_asignar_ejemplar(r.id_libro) IS NULL;
+      v_n := v_n + 1;
+    END LOOP;
+  END LOOP;
+
+  RETURN v_n;
+END$$;
+
+-- ======================================
+-- 4.n) RECOMENDACIONES "QUIENES PIDIERON ESTE LIBRO TAMBIÉN PIDIERON"
+-- ======================================
+-- Matriz dispersa alumno x libro (binaria) y su producto AᵀA guardado solo
+-- en las celdas no nulas (coprestamos). recomendaciones guarda el top-K
+-- por libro ya ordenado: servir es una lectura por llave primaria.
+-- Puntaje = coseno de co-préstamo + 0.1 por tema compartido.
+-- Los candidatos por tema están acotados: de cada libro solo cuentan sus
+-- 5 temas más raros y, de cada tema, 10·K libros (los más recientes). Con
+-- todos los pares que comparten tema, un tema grande del catálogo
+-- produciría del orden de n² filas.
+CREATE TABLE IF NOT EXISTS biblioteca.alumno_libro (
+  fk_alumno VARCHAR(20) NOT NULL REFERENCES academico.alumnos(numero_control) ON DELETE CASCADE,
+  id_libro  INT NOT NULL REFERENCES biblioteca.Libros(id_libro) ON DELETE CASCADE,
+  PRIMARY KEY (fk_alumno, id_libro)
+);
+CREATE INDEX IF NOT EXISTS idx_alumno_libro_libro ON biblioteca.alumno_libro (id_libro);
+-- Candidatos por tema: los 10·K id_libro más altos de un tema sin ordenar el tema completo
+CREATE INDEX IF NOT EXISTS idx_libros_temas_tema_libro
+  ON biblioteca.Libros_Temas (id_tema, id_libro);
+
+CREATE TABLE IF NOT EXISTS biblioteca.coprestamos (
+  id_libro INT NOT NULL REFERENCES biblioteca.Libros(id_libro) ON DELETE CASCADE,
+  id_otro  INT NOT NULL REFERENCES biblioteca.Libros(id_libro) ON DELETE CASCADE,
+  alumnos  INT NOT NULL,                  -- alumnos que pidieron ambos
+  PRIMARY KEY (id_libro, id_otro)
+);
+
+CREATE TABLE IF NOT EXISTS biblioteca.recomendaciones (
+  id_libro         INT NOT NULL REFERENCES biblioteca.Libros(id_libro) ON DELETE CASCADE,
+  rango            SMALLINT NOT NULL,
+  id_recomendado   INT NOT NULL REFERENCES biblioteca.Libros(id_libro) ON DELETE CASCADE,
+  puntaje          REAL NOT NULL,
+  alumnos_en_comun INT NOT NULL DEFAULT 0,
+  temas_en_comun   INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (id_libro, rango)
+);
+
+-- Marca de agua: último id_prestamo incorporado a la matriz
+CREATE TABLE IF NOT EXISTS biblioteca.recomendaciones_estado (
+  id              BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  ultimo_prestamo BIGINT NOT NULL DEFAULT 0,
+  actualizado_en  TIMESTAMPTZ
+);
+INSERT INTO biblioteca.recomendaciones_estado (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+-- Recalcula el top-K de los libros indicados.
+CREATE OR REPLACE FUNCTION biblioteca.fn_recomendaciones_calcular(p_libros INT[], p_k INT)
+RETURNS VOID LANGUAGE sql AS $$
+  DELETE FROM biblioteca.recomendaciones WHERE id_libro = ANY(p_libros);
+
+  WITH tamano_tema AS (
+    SELECT id_tema, COUNT(*) AS n
+    FROM biblioteca.Libros_Temas
+    WHERE id_tema IN (SELECT id_tema FROM biblioteca.Libros_Temas
+                      WHERE id_libro = ANY(p_libros))
+    GROUP BY id_tema
+  ),
+  -- Los 5 temas más raros de cada libro (los más informativos)
+  temas_libro AS (
+    SELECT l.id_libro, t.id_tema
+    FROM unnest(p_libros) AS l(id_libro)
+    CROSS JOIN LATERAL (
+      SELECT lt.id_tema
+      FROM biblioteca.Libros_Temas lt
+      JOIN tamano_tema tt ON tt.id_tema = lt.id_tema
+      WHERE lt.id_libro = l.id_libro
+      ORDER BY tt.n, lt.id_tema
+      LIMIT 5
+    ) t
+  ),
+  pares_tema AS (
+    SELECT DISTINCT tl.id_libro, o.id_libro AS id_otro
+    FROM temas_libro tl
+    CROSS JOIN LATERAL (
+      SELECT lt.id_libro
+      FROM biblioteca.Libros_Temas lt
+      WHERE lt.id_tema = tl.id_tema AND lt.id_libro <> tl.id_libro
+      ORDER BY lt.id_libro DESC
+      LIMIT 10 * p_k
+    ) o
+  ),
+  candidatos AS (
+    SELECT id_libro, id_otro, alumnos, 0 AS temas
+    FROM biblioteca.coprestamos
+    WHERE id_libro = ANY(p_libros)
+    UNION ALL
+    -- Temas en común contados completos, solo para los pares acotados
+    SELECT p.id_libro, p.id_otro, 0, COUNT(*)
+    FROM pares_tema p
+    JOIN biblioteca.Libros_Temas a ON a.id_libro = p.id_libro
+    JOIN biblioteca.Libros_Temas b ON b.id_libro = p.id_otro AND b.id_tema = a.id_tema
+    GROUP BY p.id_libro, p.id_otro
+  ),
+  lectores AS (
+    SELECT id_libro, COUNT(*)::real AS n
+    FROM biblioteca.alumno_libro
+    WHERE id_libro IN (SELECT id_libro FROM candidatos UNION SELECT id_otro FROM candidatos)
+    GROUP BY id_libro
+  ),
+  puntuados AS (
+    SELECT
+      c.id_libro, c.id_otro,
+      SUM(c.alumnos)::int AS alumnos,
+      SUM(c.temas)::int   AS temas,
+      COALESCE(SUM(c.alumnos) / sqrt(MAX(la.n) * MAX(lb.n)), 0) + 0.1 * SUM(c.temas) AS puntaje
+    FROM candidatos c
+    LEFT JOIN lectores la ON la.id_libro = c.id_libro
+    LEFT JOIN lectores lb ON lb.id_libro = c.id_otro
+    GROUP BY c.id_libro, c.id_otro
+  ),
+  ordenados AS (
+    SELECT *, row_number() OVER (PARTITION BY id_libro ORDER BY puntaje DESC, id_otro) AS rango
+    FROM puntuados
+  )
+  INSERT INTO biblioteca.recomendaciones
+    (id_libro, rango, id_recomendado, puntaje, alumnos_en_comun, temas_en_comun)
+  SELECT id_libro, rango, id_otro, puntaje, alumnos, temas
+  FROM ordenados
+  WHERE rango <= p_k;
+$$;
+
+-- Incremental: incorpora los préstamos nuevos a la matriz y recalcula solo
+-- los libros cuyas celdas cambiaron. Relee un margen antes de la marca
+-- (ids que se confirmaron fuera de orden); alumno_libro lo hace idempotente.
+CREATE OR REPLACE FUNCTION biblioteca.fn_recomendaciones_actualizar(p_k INT)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+  v_desde  BIGINT;
+  v_hasta  BIGINT;
+  v_libros INT[];
+BEGIN
+  -- La fila de estado serializa actualizaciones concurrentes
+  SELECT ultimo_prestamo INTO v_desde
+  FROM biblioteca.recomendaciones_estado FOR UPDATE;
+  SELECT COALESCE(MAX(id_prestamo), 0) INTO v_hasta FROM biblioteca.Prestamos;
+
+  WITH nuevos AS (
+    INSERT INTO biblioteca.alumno_libro (fk_alumno, id_libro)
+    SELECT DISTINCT fk_alumno, id_libro
+    FROM biblioteca.Prestamos
+    WHERE id_prestamo > v_desde - 1000
+      AND id_prestamo <= v_hasta
+      AND fk_alumno IS NOT NULL
+    ON CONFLICT DO NOTHING
+    RETURNING fk_alumno, id_libro
+  ),
+  -- alumno_libro aún no ve `nuevos` (mismo snapshot): viejo x nuevo en
+  -- ambos sentidos + nuevo x nuevo del mismo alumno.
+  incrementos AS (
+    SELECT n.id_libro, v.id_libro AS id_otro
+    FROM nuevos n JOIN biblioteca.alumno_libro v ON v.fk_alumno = n.fk_alumno
+    UNION ALL
+    SELECT v.id_libro, n.id_libro
+    FROM nuevos n JOIN biblioteca.alumno_libro v ON v.fk_alumno = n.fk_alumno
+    UNION ALL
+    SELECT n1.id_libro, n2.id_libro
+    FROM nuevos n1 JOIN nuevos n2
+      ON n2.fk_alumno = n1.fk_alumno AND n2.id_libro <> n1.id_libro
+  ),
+  celdas AS (
+    INSERT INTO biblioteca.coprestamos AS c (id_libro, id_otro, alumnos)
+    SELECT id_libro, id_otro, COUNT(*)
+    FROM incrementos
+    GROUP BY id_libro, id_otro
+    ORDER BY id_libro, id_otro
+    ON CONFLICT (id_libro, id_otro) DO UPDATE SET alumnos = c.alumnos + EXCLUDED.alumnos
+    RETURNING id_libro
+  )
+  SELECT array_agg(DISTINCT x.id_libro) INTO v_libros
+  FROM (SELECT id_libro FROM celdas UNION ALL SELECT id_libro FROM nuevos) x;
+
+  IF v_libros IS NOT NULL THEN
+    PERFORM biblioteca.fn_recomendaciones_calcular(v_libros, p_k);
+  END IF;
+
+  UPDATE biblioteca.recomendaciones_estado
+  SET ultimo_prestamo = GREATEST(v_desde, v_hasta), actualizado_en = NOW();
+
+  RETURN COALESCE(cardinality(v_libros), 0);
+END$$;
+
+-- Reconstrucción completa (cambios de temas, préstamos borrados).
+CREATE OR REPLACE FUNCTION biblioteca.fn_recomendaciones_reconstruir(p_k INT)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+  v_hasta  BIGINT;
+  v_libros INT[];
+BEGIN
+  PERFORM 1 FROM biblioteca.recomendaciones_estado FOR UPDATE;
+  SELECT COALESCE(MAX(id_prestamo), 0) INTO v_hasta FROM biblioteca.Prestamos;
+
+  TRUNCATE biblioteca.alumno_libro, biblioteca.coprestamos, biblioteca.recomendaciones;
+
+  INSERT INTO biblioteca.alumno_libro (fk_alumno, id_libro)
+  SELECT DISTINCT fk_alumno, id_libro
+  FROM biblioteca.Prestamos
+  WHERE fk_alumno IS NOT NULL AND id_prestamo <= v_hasta;
+
+  -- AᵀA: un renglón por par de libros con al menos un alumno en común
+  INSERT INTO biblioteca.coprestamos (id_libro, id_otro, alumnos)
+  SELECT a.id_libro, b.id_libro, COUNT(*)
+  FROM biblioteca.alumno_libro a
+  JOIN biblioteca.alumno_libro b ON b.fk_alumno = a.fk_alumno AND b.id_libro <> a.id_libro
+  GROUP BY a.id_libro, b.id_libro;
+
+  SELECT array_agg(id_libro) INTO v_libros FROM biblioteca.Libros;
+  IF v_libros IS NOT NULL THEN
+    PERFORM biblioteca.fn_recomendaciones_calcular(v_libros, p_k);
+  END IF;
+
+  UPDATE biblioteca.recomendaciones_estado
+  SET ultimo_prestamo = v_hasta, actualizado_en = NOW();
+
+  RETURN COALESCE(cardinality(v_libros), 0);
+END$$;
+
+-- Carga inicial
+SELECT biblioteca.fn_recomendaciones_reconstruir(10);
+
+-- ======================================
+-- 4.m) ESTADÍSTICAS DE CIRCULACIÓN (ACUMULADOS DIARIOS)
+-- ======================================
+-- Un renglón por día de préstamo y libro (cohorte: el préstamo cuenta en
+-- el día en que salió). Las páginas de estadísticas leen solo esta tabla.
+-- La actualización incremental recalcula completos los días de los
+-- préstamos modificados desde la marca de agua, así que reprocesar un
+-- día es idempotente y se puede releer un margen antes de la marca.
+ALTER TABLE biblioteca.Prestamos
+  ADD COLUMN IF NOT EXISTS modificado_en TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION biblioteca.fn_prestamos_modificado_en()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.modificado_en := NOW();
+  RETURN NEW;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_prestamos_modificado_en ON biblioteca.Prestamos;
+CREATE TRIGGER tg_prestamos_modificado_en
+BEFORE UPDATE ON biblioteca.Prestamos
+FOR EACH ROW EXECUTE FUNCTION biblioteca.fn_prestamos_modificado_en();
+
+CREATE INDEX IF NOT EXISTS idx_prestamos_modificado_en ON biblioteca.Prestamos (modificado_en);
+CREATE INDEX IF NOT EXISTS idx_prestamos_fecha_prestamo ON biblioteca.Prestamos (fecha_prestamo);
+
+CREATE TABLE IF NOT EXISTS biblioteca.circulacion_diaria (
+  dia              DATE NOT NULL,
+  id_libro         INT  NOT NULL REFERENCES biblioteca.Libros(id_libro) ON DELETE CASCADE,
+  id_clasificacion INT  NOT NULL,
+  prestamos        INT  NOT NULL,
+  devueltos        INT  NOT NULL,
+  dias_prestamo    NUMERIC(12,2) NOT NULL DEFAULT 0,  -- suma de duraciones de los devueltos
+  con_retraso      INT  NOT NULL,                      -- devueltos tarde o vencidos
+  PRIMARY KEY (dia, id_libro)
+);
+
+CREATE TABLE IF NOT EXISTS biblioteca.circulacion_estado (
+  id              BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  procesado_hasta TIMESTAMPTZ,
+  actualizado_en  TIMESTAMPTZ
+);
+INSERT INTO biblioteca.circulacion_estado (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION biblioteca.fn_circulacion_recalcular(p_dias DATE[])
+RETURNS VOID LANGUAGE sql AS $$
+  DELETE FROM biblioteca.circulacion_diaria WHERE dia = ANY(p_dias);
+
+  INSERT INTO biblioteca.circulacion_diaria
+    (dia, id_libro, id_clasificacion, prestamos, devueltos, dias_prestamo, con_retraso)
+  SELECT
+    d.dia,
+    p.id_libro,
+    l.id_clasificacion,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE p.estado = 'Devuelto'),
+    COALESCE(SUM(EXTRACT(EPOCH FROM p.fecha_devolucion_real - p.fecha_prestamo) / 86400)
+             FILTER (WHERE p.estado = 'Devuelto'), 0),
+    COUNT(*) FILTER (WHERE p.fecha_devolucion_real > p.fecha_devolucion_estimada
+                        OR p.estado = 'Vencido'
+                        OR (p.estado = 'Activo' AND p.fecha_devolucion_estimada < NOW()))
+  FROM unnest(p_dias) AS d(dia)
+  JOIN biblioteca.Prestamos p
+    ON p.fecha_prestamo >= d.dia AND p.fecha_prestamo < d.dia + 1
+  JOIN biblioteca.Libros l ON l.id_libro = p.id_libro
+  GROUP BY d.dia, p.id_libro, l.id_clasificacion;
+$$;
+
+-- Incremental (p_completo = FALSE) o reconstrucción total. Devuelve los
+-- días recalculados.
+CREATE OR REPLACE FUNCTION biblioteca.fn_circulacion_actualizar(p_completo BOOLEAN DEFAULT FALSE)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+  v_desde TIMESTAMPTZ;
+  v_dias  DATE[];
+BEGIN
+  SELECT procesado_hasta - INTERVAL '10 minutes' INTO v_desde
+  FROM biblioteca.circulacion_estado FOR UPDATE;
+
+  IF p_completo OR v_desde IS NULL THEN
+    TRUNCATE biblioteca.circulacion_diaria;
+    SELECT array_agg(DISTINCT fecha_prestamo::date) INTO v_dias FROM biblioteca.Prestamos;
+  ELSE
+    SELECT array_agg(DISTINCT fecha_prestamo::date) INTO v_dias
+    FROM biblioteca.Prestamos
+    WHERE modificado_en > v_desde;
+  END IF;
+
+  IF v_dias IS NOT NULL THEN
+    PERFORM biblioteca.fn_circulacion_recalcular(v_dias);
+  END IF;
+
+  UPDATE biblioteca.circulacion_estado
+  SET procesado_hasta = NOW(), actualizado_en = NOW();
+
+  RETURN COALESCE(cardinality(v_dias), 0);
+END$$;
+
+-- Carga inicial
+SELECT biblioteca.fn_circulacion_actualizar(TRUE);
+
+-- ======================================
+-- 4.l) LISTADOS PAGINADOS DE BIBLIOTECA
+-- ======================================
+-- Paginación por llave (columna de orden, id) en catálogo, préstamos
+-- abiertos e historial; cada orden permitido tiene su índice.
+CREATE INDEX IF NOT EXISTS idx_libros_titulo_id
+  ON biblioteca.Libros (titulo_libro, id_libro);
+
+CREATE INDEX IF NOT EXISTS idx_prestamos_abiertos_fecha
+  ON biblioteca.Prestamos (fecha_prestamo, id_prestamo) WHERE estado IN ('Activo', 'Vencido');
+CREATE INDEX IF NOT EXISTS idx_prestamos_abiertos_limite
+  ON biblioteca.Prestamos (fecha_devolucion_estimada, id_prestamo) WHERE estado IN ('Activo', 'Vencido');
+CREATE INDEX IF NOT EXISTS idx_prestamos_abiertos_id
+  ON biblioteca.Prestamos (id_prestamo) WHERE estado IN ('Activo', 'Vencido');
+
+-- Historial: reemplaza al índice simple de 4.m
+DROP INDEX IF EXISTS biblioteca.idx_prestamos_fecha_prestamo;
+CREATE INDEX IF NOT EXISTS idx_prestamos_fecha_prestamo_id
+  ON biblioteca.Prestamos (fecha_prestamo, id_prestamo);
+
+-- ======================================
+-- 4.k) HOJA DE CALIFICACIONES POR GRUPO
+-- ======================================
+-- La hoja del docente lee y actualiza la lista completa de un grupo;
+-- el UNIQUE (fk_alumno, fk_materia_alta) no sirve para buscar por grupo.
+CREATE INDEX IF NOT EXISTS idx_alumno_inscripcion_fk_materia_alta
+  ON academico.alumno_inscripcion (fk_materia_alta);
+
+-- ======================================
+-- 4.j) ASISTENCIA POR SESIÓN (MAPAS DE BITS)
+-- ======================================
+-- Cada inscripción recibe una posición fija en la lista de su grupo
+-- (nunca se reutiliza, aunque el alumno se dé de baja). Una sesión de
+-- clase guarda dos mapas de bits alineados a esas posiciones: quién
+-- estaba inscrito ese día y quién asistió. Un grupo de 40 alumnos ocupa
+-- unos 10 bytes por sesión en lugar de 40 filas.
+CREATE TABLE IF NOT EXISTS academico.asistencia_listas (
+  fk_materia_alta INT PRIMARY KEY REFERENCES planes.materia_alta(materia_alta_id) ON DELETE CASCADE,
+  ultima_posicion INT NOT NULL DEFAULT 0
+);
+
+ALTER TABLE academico.alumno_inscripcion
+  ADD COLUMN IF NOT EXISTS posicion_lista INT;
+
+-- Posiciones para las inscripciones existentes (orden de inscripción)
+INSERT INTO academico.asistencia_listas (fk_materia_alta)
+SELECT DISTINCT fk_materia_alta FROM academico.alumno_inscripcion
+ON CONFLICT (fk_materia_alta) DO NOTHING;
+
+UPDATE academico.alumno_inscripcion ai
+SET posicion_lista = l.ultima_posicion + n.pos
+FROM (
+  SELECT inscripcion_id, fk_materia_alta,
+         row_number() OVER (PARTITION BY fk_materia_alta ORDER BY inscripcion_id) AS pos
+  FROM academico.alumno_inscripcion
+  WHERE posicion_lista IS NULL
+) n
+JOIN academico.asistencia_listas l ON l.fk_materia_alta = n.fk_materia_alta
+WHERE ai.inscripcion_id = n.inscripcion_id;
+
+UPDATE academico.asistencia_listas l
+SET ultima_posicion = x.maxima
+FROM (
+  SELECT fk_materia_alta, MAX(posicion_lista) AS maxima
+  FROM academico.alumno_inscripcion
+  GROUP BY fk_materia_alta
+) x
+WHERE x.fk_materia_alta = l.fk_materia_alta
+  AND l.ultima_posicion < x.maxima;
+
+ALTER TABLE academico.alumno_inscripcion
+  ALTER COLUMN posicion_lista SET NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_alumno_inscripcion_posicion_lista
+  ON academico.alumno_inscripcion (fk_materia_alta, posicion_lista);
+
+CREATE OR REPLACE FUNCTION academico.fn_inscripcion_posicion_lista()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'INSERT' OR NEW.fk_materia_alta IS DISTINCT FROM OLD.fk_materia_alta THEN
+    INSERT INTO academico.asistencia_listas AS l (fk_materia_alta, ultima_posicion)
+    VALUES (NEW.fk_materia_alta, 1)
+    ON CONFLICT (fk_materia_alta)
+    DO UPDATE SET ultima_posicion = l.ultima_posicion + 1
+    RETURNING l.ultima_posicion INTO NEW.posicion_lista;
+  END IF;
+  RETURN NEW;
+END$$;
+
+DROP TRIGGER IF EXISTS trg_inscripcion_posicion_lista ON academico.alumno_inscripcion;
+CREATE TRIGGER trg_inscripcion_posicion_lista
+BEFORE INSERT OR UPDATE OF fk_materia_alta ON academico.alumno_inscripcion
+FOR EACH ROW EXECUTE FUNCTION academico.fn_inscripcion_posicion_lista();
+
+CREATE TABLE IF NOT EXISTS academico.asistencia_sesiones (
+  sesion_id       BIGSERIAL PRIMARY KEY,
+  fk_materia_alta INT  NOT NULL REFERENCES planes.materia_alta(materia_alta_id) ON DELETE CASCADE,
+  fecha           DATE NOT NULL,
+  inscritos       BIT VARYING NOT NULL,   -- bit i = posicion_lista i+1
+  presentes       BIT VARYING NOT NULL,
+  registrada_por  BIGINT REFERENCES seguridad.usuarios(id_usuario) ON DELETE SET NULL,
+  actualizado_en  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  CONSTRAINT uq_asistencia_sesion UNIQUE (fk_materia_alta, fecha),
+  CONSTRAINT ck_asistencia_mapas CHECK (
+    CASE WHEN bit_length(presentes) = bit_length(inscritos)
+         THEN (presentes & inscritos) = presentes
+         ELSE FALSE
+    END
+  )
+);
+
+-- ¿Está encendida la posición `pos` (1..n) del mapa? Falso fuera de rango
+-- (alumnos inscritos después de la sesión).
+CREATE OR REPLACE FUNCTION academico.fn_bit_lista(p_mapa BIT VARYING, p_pos INT)
+RETURNS BOOLEAN
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE WHEN p_pos BETWEEN 1 AND bit_length(p_mapa)
+              THEN get_bit(p_mapa, p_pos - 1) = 1
+              ELSE FALSE
+         END;
+$$;
+
+-- ======================================
+-- 4.i) CARGA DEL DOCENTE PRECALCULADA
+-- ======================================
+-- rrhh.docente_carga: materias, grupos, alumnos distintos e inscripciones
+-- por docente y ciclo, más una fila ciclo = '*' con los totales de todos
+-- los ciclos. Los triggers de materia_alta y alumno_inscripcion recalculan
+-- solo los docentes afectados por la sentencia (conteos distintos: no se
+-- pueden llevar con +1/-1). planes.materia_alta_inscritos lleva el número
+-- de inscritos por grupo con deltas.
+CREATE TABLE IF NOT EXISTS rrhh.docente_carga (
+  fk_personal    BIGINT NOT NULL REFERENCES rrhh.personal(id_personal) ON DELETE CASCADE,
+  ciclo          TEXT   NOT NULL,          -- '*' = todos los ciclos
+  materias       INT    NOT NULL,
+  grupos         INT    NOT NULL,
+  alumnos        INT    NOT NULL,
+  inscripciones  INT    NOT NULL,
+  actualizado_en TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (fk_personal, ciclo)
+);
+
+CREATE TABLE IF NOT EXISTS planes.materia_alta_inscritos (
+  materia_alta_id INT PRIMARY KEY REFERENCES planes.materia_alta(materia_alta_id) ON DELETE CASCADE,
+  inscritos       INT NOT NULL DEFAULT 0
+);
+
+-- Agregados en vivo (recálculo y verificación). NULL = todos los docentes.
+CREATE OR REPLACE FUNCTION rrhh.fn_docente_carga_recuento(p_personal BIGINT[] DEFAULT NULL)
+RETURNS TABLE (fk_personal BIGINT, ciclo TEXT, materias INT, grupos INT, alumnos INT, inscripciones INT)
+LANGUAGE sql STABLE AS $$
+  SELECT
+    ma.fk_personal,
+    COALESCE(ma.ciclo, '*'),
+    COUNT(DISTINCT cm.materia_id)::int,
+    COUNT(DISTINCT ma.materia_alta_id)::int,
+    COUNT(DISTINCT ai.fk_alumno)::int,
+    COUNT(ai.inscripcion_id)::int
+  FROM planes.materia_alta ma
+  JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+  LEFT JOIN academico.alumno_inscripcion ai ON ai.fk_materia_alta = ma.materia_alta_id
+  WHERE ma.fk_personal IS NOT NULL
+    AND (p_personal IS NULL OR ma.fk_personal = ANY (p_personal))
+  GROUP BY GROUPING SETS ((ma.fk_personal, ma.ciclo), (ma.fk_personal));
+$$;
+
+-- Recalcula las filas de los docentes indicados. El candado por docente
+-- serializa transacciones concurrentes: la segunda recalcula después de
+-- que la primera confirma y ve ambos cambios.
+CREATE OR REPLACE FUNCTION rrhh.fn_docente_carga_recalcular(p_personal BIGINT[])
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_ids BIGINT[];
+  v_id  BIGINT;
+BEGIN
+  SELECT array_agg(DISTINCT x ORDER BY x) INTO v_ids
+  FROM unnest(p_personal) AS x
+  WHERE x IS NOT NULL;
+  IF v_ids IS NULL THEN
+    RETURN;
+  END IF;
+
+  FOREACH v_id IN ARRAY v_ids LOOP
+    PERFORM pg_advisory_xact_lock(hashtext('rrhh.docente_carga'), (v_id % 2147483647)::int);
+  END LOOP;
+
+  DELETE FROM rrhh.docente_carga WHERE fk_personal = ANY (v_ids);
+  INSERT INTO rrhh.docente_carga (fk_personal, ciclo, materias, grupos, alumnos, inscripciones)
+  SELECT r.fk_personal, r.ciclo, r.materias, r.grupos, r.alumnos, r.inscripciones
+  FROM rrhh.fn_docente_carga_recuento(v_ids) r
+  JOIN rrhh.personal p ON p.id_personal = r.fk_personal;
+END$$;
+
+-- alumno_inscripcion: delta por grupo y recálculo de sus docentes.
+-- Las filas borradas en cascada de un grupo eliminado se ignoran aquí; el
+-- trigger de materia_alta recalcula a su docente.
+CREATE OR REPLACE FUNCTION academico.fn_inscripcion_carga_tg()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_mas   INT[] := '{}';
+  v_menos INT[] := '{}';
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT COALESCE(array_agg(fk_materia_alta), '{}') INTO v_mas FROM nuevos;
+  ELSIF TG_OP = 'DELETE' THEN
+    SELECT COALESCE(array_agg(fk_materia_alta), '{}') INTO v_menos FROM viejos;
+  ELSE
+    -- Solo cuentan los cambios de grupo o de alumno (no los de calificación)
+    SELECT COALESCE(array_agg(n.fk_materia_alta), '{}'),
+           COALESCE(array_agg(o.fk_materia_alta), '{}')
+    INTO v_mas, v_menos
+    FROM nuevos n
+    JOIN viejos o ON o.inscripcion_id = n.inscripcion_id
+    WHERE (n.fk_materia_alta, n.fk_alumno) IS DISTINCT FROM (o.fk_materia_alta, o.fk_alumno);
+  END IF;
+  IF cardinality(v_mas) = 0 AND cardinality(v_menos) = 0 THEN
+    RETURN NULL;
+  END IF;
+
+  INSERT INTO planes.materia_alta_inscritos AS i (materia_alta_id, inscritos)
+  SELECT d.grupo, SUM(d.n)
+  FROM (
+    SELECT g AS grupo, 1 AS n FROM unnest(v_mas) AS g
+    UNION ALL
+    SELECT g, -1 FROM unnest(v_menos) AS g
+  ) d
+  JOIN planes.materia_alta ma ON ma.materia_alta_id = d.grupo
+  GROUP BY d.grupo
+  HAVING SUM(d.n) <> 0
+  ORDER BY d.grupo
+  ON CONFLICT (materia_alta_id) DO UPDATE
+    SET inscritos = i.inscritos + EXCLUDED.inscritos;
+
+  PERFORM rrhh.fn_docente_carga_recalcular(ARRAY(
+    SELECT DISTINCT ma.fk_personal
+    FROM planes.materia_alta ma
+    WHERE ma.materia_alta_id = ANY (v_mas || v_menos)
+  ));
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_inscripcion_carga_ins ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_inscripcion_carga_ins
+AFTER INSERT ON academico.alumno_inscripcion
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_inscripcion_carga_tg();
+
+DROP TRIGGER IF EXISTS tg_inscripcion_carga_upd ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_inscripcion_carga_upd
+AFTER UPDATE ON academico.alumno_inscripcion
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_inscripcion_carga_tg();
+
+DROP TRIGGER IF EXISTS tg_inscripcion_carga_del ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_inscripcion_carga_del
+AFTER DELETE ON academico.alumno_inscripcion
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_inscripcion_carga_tg();
+
+-- materia_alta: alta, baja, cambio de docente, ciclo o materia.
+CREATE OR REPLACE FUNCTION planes.fn_materia_alta_carga_tg()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_docentes BIGINT[] := '{}';
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO planes.materia_alta_inscritos (materia_alta_id)
+    SELECT materia_alta_id FROM nuevos
+    ORDER BY materia_alta_id
+    ON CONFLICT (materia_alta_id) DO NOTHING;
+    SELECT COALESCE(array_agg(fk_personal), '{}') INTO v_docentes FROM nuevos;
+  ELSIF TG_OP = 'DELETE' THEN
+    SELECT COALESCE(array_agg(fk_personal), '{}') INTO v_docentes FROM viejos;
+  ELSE
+    -- Solo cambios de docente, ciclo o materia (no actualizado_en, esta_activo…)
+    SELECT COALESCE(array_agg(n.fk_personal), '{}') || COALESCE(array_agg(o.fk_personal), '{}')
+    INTO v_docentes
+    FROM nuevos n
+    JOIN viejos o ON o.materia_alta_id = n.materia_alta_id
+    WHERE (n.fk_personal, n.ciclo, n.carrera_materia_id)
+          IS DISTINCT FROM (o.fk_personal, o.ciclo, o.carrera_materia_id);
+  END IF;
+
+  PERFORM rrhh.fn_docente_carga_recalcular(v_docentes);
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_materia_alta_carga_ins ON planes.materia_alta;
+CREATE TRIGGER tg_materia_alta_carga_ins
+AFTER INSERT ON planes.materia_alta
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_materia_alta_carga_tg();
+
+DROP TRIGGER IF EXISTS tg_materia_alta_carga_upd ON planes.materia_alta;
+CREATE TRIGGER tg_materia_alta_carga_upd
+AFTER UPDATE ON planes.materia_alta
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_materia_alta_carga_tg();
+
+DROP TRIGGER IF EXISTS tg_materia_alta_carga_del ON planes.materia_alta;
+CREATE TRIGGER tg_materia_alta_carga_del
+AFTER DELETE ON planes.materia_alta
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_materia_alta_carga_tg();
+
+-- Reconstrucción completa (carga inicial o corrección general).
+CREATE OR REPLACE FUNCTION rrhh.fn_docente_carga_reconstruir()
+RETURNS VOID LANGUAGE sql AS $$
+  LOCK TABLE planes.materia_alta, academico.alumno_inscripcion IN SHARE MODE;
+  -- Upsert (no DELETE + INSERT) para conservar la columna version de 4.g
+  INSERT INTO planes.materia_alta_inscritos AS i (materia_alta_id, inscritos)
+  SELECT ma.materia_alta_id, COUNT(ai.inscripcion_id)
+  FROM planes.materia_alta ma
+  LEFT JOIN academico.alumno_inscripcion ai ON ai.fk_materia_alta = ma.materia_alta_id
+  GROUP BY ma.materia_alta_id
+  ON CONFLICT (materia_alta_id) DO UPDATE
+    SET inscritos = EXCLUDED.inscritos;
+  DELETE FROM rrhh.docente_carga;
+  INSERT INTO rrhh.docente_carga (fk_personal, ciclo, materias, grupos, alumnos, inscripciones)
+  SELECT fk_personal, ciclo, materias, grupos, alumnos, inscripciones
+  FROM rrhh.fn_docente_carga_recuento(NULL);
+$$;
+
+SELECT rrhh.fn_docente_carga_reconstruir();
+
+-- ======================================
+-- 4.h) VISTAS MATERIALIZADAS DEL COORDINADOR
+-- ======================================
+-- Los paneles del coordinador leen copias materializadas (indexadas por
+-- ciclo) en lugar de planes.vw_materia_alta_detalle + COUNT(DISTINCT).
+-- Los triggers de las tablas fuente solo avanzan una secuencia (sin
+-- candados de fila); la app refresca con REFRESH ... CONCURRENTLY cuando
+-- la secuencia va por delante de la última versión refrescada, como
+-- mucho una vez cada VISTAS_COORDINADOR_MIN_SEGUNDOS, y
+-- `flask coordinador-vistas` permite hacerlo desde cron.
+
+-- La vista original ya no ordena: quien la consulta pone su ORDER BY.
+CREATE OR REPLACE VIEW planes.vw_materia_alta_detalle AS
+SELECT
+  ma.materia_alta_id, ma.ciclo, ma.esta_activo, ma.creado_en, ma.actualizado_en,
+  c.clave AS carrera_clave, c.nombre AS carrera_nombre,
+  m.clave AS materia_clave, m.nombre AS materia_nombre,
+  cm.semestre,
+  p.nombre AS profesor_nombre, p.apellido_paterno AS profesor_ap,
+  cm.carrera_materia_id
+FROM planes.materia_alta ma
+JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+JOIN planes.carrera c ON c.carrera_id = cm.carrera_id
+JOIN planes.materia m ON m.materia_id = cm.materia_id
+LEFT JOIN rrhh.personal p ON p.id_personal = ma.fk_personal;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS planes.mv_materia_alta_detalle AS
+SELECT
+  ma.materia_alta_id, ma.ciclo, ma.esta_activo, ma.fk_personal,
+  c.carrera_id, c.clave AS carrera_clave, c.nombre AS carrera_nombre,
+  m.materia_id, m.clave AS materia_clave, m.nombre AS materia_nombre,
+  cm.carrera_materia_id, cm.semestre,
+  cm.horas_teoricas, cm.horas_practicas, cm.horas_totales,
+  COALESCE(p.nombre || ' ' || p.apellido_paterno, 'Sin asignar') AS docente
+FROM planes.materia_alta ma
+JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+JOIN planes.carrera c ON c.carrera_id = cm.carrera_id
+JOIN planes.materia m ON m.materia_id = cm.materia_id
+LEFT JOIN rrhh.personal p ON p.id_personal = ma.fk_personal;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_mv_materia_alta_detalle
+  ON planes.mv_materia_alta_detalle (materia_alta_id);
+CREATE INDEX IF NOT EXISTS idx_mv_materia_alta_detalle_ciclo
+  ON planes.mv_materia_alta_detalle (ciclo, semestre, materia_clave);
+
+-- Por ciclo y carrera (reportes académicos)
+CREATE MATERIALIZED VIEW IF NOT EXISTS planes.mv_resumen_ciclo_carrera AS
+SELECT
+  ma.ciclo,
+  c.clave  AS carrera_clave,
+  c.nombre AS carrera_nombre,
+  COUNT(DISTINCT cm.materia_id)  AS materias,
+  COUNT(*)                       AS grupos,
+  COUNT(DISTINCT ma.fk_personal) AS docentes
+FROM planes.materia_alta ma
+JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+JOIN planes.carrera c ON c.carrera_id = cm.carrera_id
+GROUP BY ma.ciclo, c.clave, c.nombre;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_mv_resumen_ciclo_carrera
+  ON planes.mv_resumen_ciclo_carrera (ciclo, carrera_clave);
+
+-- Por ciclo (panel del coordinador; carreras, materias y docentes de
+-- grupos activos, alumnos de cualquier grupo del ciclo)
+CREATE MATERIALIZED VIEW IF NOT EXISTS planes.mv_resumen_ciclo AS
+SELECT
+  g.ciclo,
+  g.carreras_activas,
+  g.materias_en_plan,
+  g.docentes,
+  COALESCE(a.alumnos, 0) AS alumnos
+FROM (
+  SELECT
+    ma.ciclo,
+    COUNT(DISTINCT cm.carrera_id)  FILTER (WHERE ma.esta_activo) AS carreras_activas,
+    COUNT(DISTINCT cm.materia_id)  FILTER (WHERE ma.esta_activo) AS materias_en_plan,
+    COUNT(DISTINCT ma.fk_personal) FILTER (WHERE ma.esta_activo) AS docentes
+  FROM planes.materia_alta ma
+  JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+  GROUP BY ma.ciclo
+) g
+LEFT JOIN (
+  SELECT ma.ciclo, COUNT(DISTINCT ai.fk_alumno) AS alumnos
+  FROM academico.alumno_inscripcion ai
+  JOIN planes.materia_alta ma ON ma.materia_alta_id = ai.fk_materia_alta
+  GROUP BY ma.ciclo
+) a ON a.ciclo = g.ciclo;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_mv_resumen_ciclo
+  ON planes.mv_resumen_ciclo (ciclo);
+
+-- Versión de los datos fuente / versión refrescada
+CREATE SEQUENCE IF NOT EXISTS planes.seq_vistas_coordinador;
+
+CREATE TABLE IF NOT EXISTS planes.vistas_coordinador_estado (
+  id                 BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  version_refrescada BIGINT      NOT NULL DEFAULT 0,
+  refrescado_en      TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+INSERT INTO planes.vistas_coordinador_estado (id) VALUES (TRUE)
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION planes.fn_vistas_coordinador_cambio()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  PERFORM nextval('planes.seq_vistas_coordinador');
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_vistas_coordinador ON planes.materia_alta;
+CREATE TRIGGER tg_vistas_coordinador
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON planes.materia_alta
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_vistas_coordinador_cambio();
+
+DROP TRIGGER IF EXISTS tg_vistas_coordinador ON planes.carrera_materia;
+CREATE TRIGGER tg_vistas_coordinador
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON planes.carrera_materia
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_vistas_coordinador_cambio();
+
+DROP TRIGGER IF EXISTS tg_vistas_coordinador ON planes.carrera;
+CREATE TRIGGER tg_vistas_coordinador
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON planes.carrera
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_vistas_coordinador_cambio();
+
+DROP TRIGGER IF EXISTS tg_vistas_coordinador ON planes.materia;
+CREATE TRIGGER tg_vistas_coordinador
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON planes.materia
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_vistas_coordinador_cambio();
+
+-- Del personal solo importa el nombre mostrado
+DROP TRIGGER IF EXISTS tg_vistas_coordinador ON rrhh.personal;
+CREATE TRIGGER tg_vistas_coordinador
+AFTER UPDATE OF nombre, apellido_paterno ON rrhh.personal
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_vistas_coordinador_cambio();
+
+-- De las inscripciones solo importa quién está en qué grupo (no la calificación)
+DROP TRIGGER IF EXISTS tg_vistas_coordinador ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_vistas_coordinador
+AFTER INSERT OR DELETE OR UPDATE OF fk_alumno, fk_materia_alta OR TRUNCATE
+ON academico.alumno_inscripcion
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_vistas_coordinador_cambio();
+
+-- ======================================
+-- 4.g) VERSIÓN DE CALIFICACIONES (ESTADÍSTICAS DEL COORDINADOR)
+-- ======================================
+-- Las estadísticas por grupo se calculan en la aplicación y se guardan en
+-- memoria por ciclo. planes.materia_alta_inscritos.version avanza para cada
+-- grupo tocado por una sentencia que cambia calificaciones o inscripciones;
+-- el incremento va en la transacción del cambio (una secuencia avanzaría
+-- antes del commit) y bloquea solo las filas de esos grupos, que los
+-- triggers de 4.i ya bloquean. La versión de un ciclo es SUM(version) de
+-- sus grupos; junto con planes.seq_vistas_coordinador (altas y bajas de
+-- grupos, carreras, materias) forma la llave de la caché.
+
+DROP SEQUENCE IF EXISTS academico.seq_calificaciones;
+DROP TABLE IF EXISTS academico.calificaciones_version;
+
+ALTER TABLE planes.materia_alta_inscritos
+  ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION academico.fn_calificaciones_cambio()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_grupos INT[] := '{}';
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    UPDATE planes.materia_alta_inscritos SET version = version + 1;
+    RETURN NULL;
+  ELSIF TG_OP = 'INSERT' THEN
+    SELECT COALESCE(array_agg(fk_materia_alta), '{}') INTO v_grupos FROM nuevos;
+  ELSIF TG_OP = 'DELETE' THEN
+    SELECT COALESCE(array_agg(fk_materia_alta), '{}') INTO v_grupos FROM viejos;
+  ELSE
+    -- Ambos grupos si la fila cambió de grupo
+    SELECT COALESCE(array_agg(n.fk_materia_alta), '{}') || COALESCE(array_agg(o.fk_materia_alta), '{}')
+    INTO v_grupos
+    FROM nuevos n
+    JOIN viejos o ON o.inscripcion_id = n.inscripcion_id
+    WHERE (n.calificacion, n.fk_materia_alta) IS DISTINCT FROM (o.calificacion, o.fk_materia_alta);
+  END IF;
+  IF cardinality(v_grupos) = 0 THEN
+    RETURN NULL;
+  END IF;
+
+  -- Mismo orden de bloqueo que fn_inscripcion_carga_tg
+  INSERT INTO planes.materia_alta_inscritos AS i (materia_alta_id, version)
+  SELECT DISTINCT ma.materia_alta_id, 1
+  FROM planes.materia_alta ma
+  WHERE ma.materia_alta_id = ANY (v_grupos)
+  ORDER BY ma.materia_alta_id
+  ON CONFLICT (materia_alta_id) DO UPDATE
+    SET version = i.version + 1;
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_calificaciones_version ON academico.alumno_inscripcion;
+
+DROP TRIGGER IF EXISTS tg_calificaciones_version_ins ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_calificaciones_version_ins
+AFTER INSERT ON academico.alumno_inscripcion
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_calificaciones_cambio();
+
+DROP TRIGGER IF EXISTS tg_calificaciones_version_upd ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_calificaciones_version_upd
+AFTER UPDATE ON academico.alumno_inscripcion
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_calificaciones_cambio();
+
+DROP TRIGGER IF EXISTS tg_calificaciones_version_del ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_calificaciones_version_del
+AFTER DELETE ON academico.alumno_inscripcion
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_calificaciones_cambio();
+
+DROP TRIGGER IF EXISTS tg_calificaciones_version_trunc ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_calificaciones_version_trunc
+AFTER TRUNCATE ON academico.alumno_inscripcion
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_calificaciones_cambio();
+
+INSERT INTO academico.parametros_globales (clave, valor_texto, descripcion, categoria)
+VALUES ('calificacion_aprobatoria', '70', 'Calificación mínima aprobatoria (0-100)', 'academico')
+ON CONFLICT (clave) DO NOTHING;
+
+-- ======================================
+-- 4.f) KÁRDEX Y PROMEDIO POR ALUMNO
+-- ======================================
+-- academico.alumno_kardex guarda el resumen académico de cada alumno. Solo
+-- cuentan las materias con calificación capturada; los créditos son
+-- carrera_materia.horas_totales y el promedio se pondera por créditos.
+-- Los triggers de alumno_inscripcion suman/restan el aporte de cada fila
+-- (viejo -, nuevo +) con INSERT ... ON CONFLICT DO UPDATE: la suma es
+-- conmutativa y el candado de la fila del alumno serializa ediciones
+-- concurrentes. Los cambios raros (ciclo/materia de un grupo, horas de la
+-- materia, calificación aprobatoria) recalculan a los alumnos afectados.
+CREATE TABLE IF NOT EXISTS academico.alumno_kardex (
+  fk_alumno           VARCHAR(20) PRIMARY KEY REFERENCES academico.alumnos(numero_control) ON DELETE CASCADE,
+  materias_cursadas   INT NOT NULL DEFAULT 0,      -- con calificación
+  materias_aprobadas  INT NOT NULL DEFAULT 0,
+  materias_reprobadas INT NOT NULL DEFAULT 0,
+  creditos_cursados   INT NOT NULL DEFAULT 0,
+  creditos_aprobados  INT NOT NULL DEFAULT 0,
+  suma_ponderada      NUMERIC(14,2) NOT NULL DEFAULT 0,   -- Σ calificación × créditos
+  promedio            NUMERIC(5,2) GENERATED ALWAYS AS (
+                        ROUND(suma_ponderada / NULLIF(creditos_cursados, 0), 2)
+                      ) STORED,
+  ultimo_ciclo        TEXT,
+  actualizado_en      TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION academico.fn_calificacion_aprobatoria()
+RETURNS NUMERIC
+LANGUAGE sql STABLE AS $$
+  SELECT COALESCE((
+    SELECT valor_texto::numeric
+    FROM academico.parametros_globales
+    WHERE clave = 'calificacion_aprobatoria'
+      AND valor_texto ~ '^[0-9]+(\.[0-9]+)?$'
+  ), 70);
+$$;
+
+-- Kárdex en vivo (recálculo y verificación). NULL = todos los alumnos.
+CREATE OR REPLACE FUNCTION academico.fn_alumno_kardex_recuento(p_alumnos VARCHAR[] DEFAULT NULL)
+RETURNS TABLE (
+  fk_alumno VARCHAR(20), materias_cursadas INT, materias_aprobadas INT,
+  materias_reprobadas INT, creditos_cursados INT, creditos_aprobados INT,
+  suma_ponderada NUMERIC, ultimo_ciclo TEXT
+)
+LANGUAGE sql STABLE AS $$
+  WITH minimo AS (SELECT academico.fn_calificacion_aprobatoria() AS v)
+  SELECT
+    a.numero_control,
+    COUNT(ai.calificacion)::int,
+    COUNT(*) FILTER (WHERE ai.calificacion >= minimo.v)::int,
+    COUNT(*) FILTER (WHERE ai.calificacion <  minimo.v)::int,
+    COALESCE(SUM(cm.horas_totales) FILTER (WHERE ai.calificacion IS NOT NULL), 0)::int,
+    COALESCE(SUM(cm.horas_totales) FILTER (WHERE ai.calificacion >= minimo.v), 0)::int,
+    COALESCE(SUM(ai.calificacion * cm.horas_totales), 0),
+    MAX(ma.ciclo)
+  FROM academico.alumnos a
+  CROSS JOIN minimo
+  LEFT JOIN academico.alumno_inscripcion ai ON ai.fk_alumno = a.numero_control
+  LEFT JOIN planes.materia_alta ma ON ma.materia_alta_id = ai.fk_materia_alta
+  LEFT JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+  WHERE p_alumnos IS NULL OR a.numero_control = ANY (p_alumnos)
+  GROUP BY a.numero_control;
+$$;
+
+-- Recalcula a los alumnos indicados. Primero se aseguran y bloquean sus
+-- filas; el recuento va en otra sentencia (instantánea posterior al
+-- candado), así que ve todo lo confirmado antes y los deltas que esperaban
+-- el candado se aplican encima.
+CREATE OR REPLACE FUNCTION academico.fn_alumno_kardex_recalcular(p_alumnos VARCHAR[])
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_ids VARCHAR[];
+BEGIN
+  SELECT array_agg(DISTINCT x ORDER BY x) INTO v_ids
+  FROM unnest(p_alumnos) AS x
+  WHERE x IS NOT NULL;
+  IF v_ids IS NULL THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO academico.alumno_kardex (fk_alumno)
+  SELECT a.numero_control
+  FROM academico.alumnos a
+  WHERE a.numero_control = ANY (v_ids)
+  ORDER BY a.numero_control
+  ON CONFLICT (fk_alumno) DO NOTHING;
+
+  PERFORM 1
+  FROM academico.alumno_kardex k
+  WHERE k.fk_alumno = ANY (v_ids)
+  ORDER BY k.fk_alumno
+  FOR UPDATE;
+
+  UPDATE academico.alumno_kardex k
+  SET materias_cursadas   = r.materias_cursadas,
+      materias_aprobadas  = r.materias_aprobadas,
+      materias_reprobadas = r.materias_reprobadas,
+      creditos_cursados   = r.creditos_cursados,
+      creditos_aprobados  = r.creditos_aprobados,
+      suma_ponderada      = r.suma_ponderada,
+      ultimo_ciclo        = r.ultimo_ciclo,
+      actualizado_en      = now()
+  FROM academico.fn_alumno_kardex_recuento(v_ids) r
+  WHERE k.fk_alumno = r.fk_alumno;
+END$$;
+
+-- alumno_inscripcion: aporte de cada fila vieja (-) y nueva (+). Las filas
+-- borradas en cascada de un grupo eliminado ya no tienen créditos que
+-- consultar; a esos alumnos se les recalcula.
+CREATE OR REPLACE FUNCTION academico.fn_inscripcion_kardex_tg()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_alumnos  VARCHAR[] := '{}';
+  v_grupos   INT[]     := '{}';
+  v_califs   NUMERIC[] := '{}';
+  v_signos   INT[]     := '{}';
+  v_minimo   NUMERIC   := academico.fn_calificacion_aprobatoria();
+  v_huerfanos VARCHAR[];
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT COALESCE(array_agg(fk_alumno), '{}'), COALESCE(array_agg(fk_materia_alta), '{}'),
+           COALESCE(array_agg(calificacion), '{}'), COALESCE(array_agg(1), '{}')
+    INTO v_alumnos, v_grupos, v_califs, v_signos
+    FROM nuevos;
+  ELSIF TG_OP = 'DELETE' THEN
+    SELECT COALESCE(array_agg(fk_alumno), '{}'), COALESCE(array_agg(fk_materia_alta), '{}'),
+           COALESCE(array_agg(calificacion), '{}'), COALESCE(array_agg(-1), '{}')
+    INTO v_alumnos, v_grupos, v_califs, v_signos
+    FROM viejos;
+  ELSE
+    -- Solo cambios de alumno, grupo o calificación
+    SELECT COALESCE(array_agg(d.alumno), '{}'), COALESCE(array_agg(d.grupo), '{}'),
+           COALESCE(array_agg(d.calif), '{}'), COALESCE(array_agg(d.signo), '{}')
+    INTO v_alumnos, v_grupos, v_califs, v_signos
+    FROM nuevos n
+    JOIN viejos o ON o.inscripcion_id = n.inscripcion_id
+    CROSS JOIN LATERAL (VALUES
+      (o.fk_alumno, o.fk_materia_alta, o.calificacion, -1),
+      (n.fk_alumno, n.fk_materia_alta, n.calificacion,  1)
+    ) AS d(alumno, grupo, calif, signo)
+    WHERE (n.fk_alumno, n.fk_materia_alta, n.calificacion)
+          IS DISTINCT FROM (o.fk_alumno, o.fk_materia_alta, o.calificacion);
+  END IF;
+  IF cardinality(v_alumnos) = 0 THEN
+    RETURN NULL;
+  END IF;
+
+  INSERT INTO academico.alumno_kardex AS k (
+    fk_alumno, materias_cursadas, materias_aprobadas, materias_reprobadas,
+    creditos_cursados, creditos_aprobados, suma_ponderada, ultimo_ciclo
+  )
+  SELECT
+    d.alumno,
+    COALESCE(SUM(d.signo) FILTER (WHERE d.calif IS NOT NULL), 0),
+    COALESCE(SUM(d.signo) FILTER (WHERE d.calif >= v_minimo), 0),
+    COALESCE(SUM(d.signo) FILTER (WHERE d.calif <  v_minimo), 0),
+    COALESCE(SUM(d.signo * cm.horas_totales) FILTER (WHERE d.calif IS NOT NULL), 0),
+    COALESCE(SUM(d.signo * cm.horas_totales) FILTER (WHERE d.calif >= v_minimo), 0),
+    COALESCE(SUM(d.signo * d.calif * cm.horas_totales), 0),
+    MAX(ma.ciclo) FILTER (WHERE d.signo > 0)
+  FROM unnest(v_alumnos, v_grupos, v_califs, v_signos) AS d(alumno, grupo, calif, signo)
+  JOIN academico.alumnos a ON a.numero_control = d.alumno
+  JOIN planes.materia_alta ma ON ma.materia_alta_id = d.grupo
+  JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+  GROUP BY d.alumno
+  ORDER BY d.alumno
+  ON CONFLICT (fk_alumno) DO UPDATE
+    SET materias_cursadas   = k.materias_cursadas   + EXCLUDED.materias_cursadas,
+        materias_aprobadas  = k.materias_aprobadas  + EXCLUDED.materias_aprobadas,
+        materias_reprobadas = k.materias_reprobadas + EXCLUDED.materias_reprobadas,
+        creditos_cursados   = k.creditos_cursados   + EXCLUDED.creditos_cursados,
+        creditos_aprobados  = k.creditos_aprobados  + EXCLUDED.creditos_aprobados,
+        suma_ponderada      = k.suma_ponderada      + EXCLUDED.suma_ponderada,
+        ultimo_ciclo        = GREATEST(k.ultimo_ciclo, EXCLUDED.ultimo_ciclo),
+        actualizado_en      = now();
+
+  -- Bajas cuyo grupo ya no existe: recálculo completo del alumno. En las
+  -- demás bajas (o cambios de grupo) ultimo_ciclo puede retroceder y se
+  -- recalcula ese campo; un cambio de calificación no lo mueve.
+  SELECT array_agg(DISTINCT d.alumno) INTO v_huerfanos
+  FROM unnest(v_alumnos, v_grupos, v_signos) AS d(alumno, grupo, signo)
+  WHERE d.signo < 0
+    AND NOT EXISTS (SELECT 1 FROM planes.materia_alta ma WHERE ma.materia_alta_id = d.grupo);
+  PERFORM academico.fn_alumno_kardex_recalcular(v_huerfanos);
+
+  UPDATE academico.alumno_kardex k
+  SET ultimo_ciclo = (
+    SELECT MAX(ma.ciclo)
+    FROM academico.alumno_inscripcion ai
+    JOIN planes.materia_alta ma ON ma.materia_alta_id = ai.fk_materia_alta
+    WHERE ai.fk_alumno = k.fk_alumno
+  )
+  WHERE k.fk_alumno IN (
+    SELECT e.alumno
+    FROM (
+      SELECT d.alumno, d.grupo
+      FROM unnest(v_alumnos, v_grupos, v_signos) AS d(alumno, grupo, signo)
+      WHERE d.signo < 0
+      EXCEPT
+      SELECT d.alumno, d.grupo
+      FROM unnest(v_alumnos, v_grupos, v_signos) AS d(alumno, grupo, signo)
+      WHERE d.signo > 0
+    ) e
+  )
+    AND NOT (k.fk_alumno = ANY (COALESCE(v_huerfanos, '{}')));
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_inscripcion_kardex_ins ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_inscripcion_kardex_ins
+AFTER INSERT ON academico.alumno_inscripcion
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_inscripcion_kardex_tg();
+
+DROP TRIGGER IF EXISTS tg_inscripcion_kardex_upd ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_inscripcion_kardex_upd
+AFTER UPDATE ON academico.alumno_inscripcion
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_inscripcion_kardex_tg();
+
+DROP TRIGGER IF EXISTS tg_inscripcion_kardex_del ON academico.alumno_inscripcion;
+CREATE TRIGGER tg_inscripcion_kardex_del
+AFTER DELETE ON academico.alumno_inscripcion
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION academico.fn_inscripcion_kardex_tg();
+
+-- materia_alta: cambio de ciclo o de materia de un grupo con alumnos.
+CREATE OR REPLACE FUNCTION planes.fn_materia_alta_kardex_tg()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  PERFORM academico.fn_alumno_kardex_recalcular(ARRAY(
+    SELECT ai.fk_alumno
+    FROM nuevos n
+    JOIN viejos o ON o.materia_alta_id = n.materia_alta_id
+    JOIN academico.alumno_inscripcion ai ON ai.fk_materia_alta = n.materia_alta_id
+    WHERE (n.ciclo, n.carrera_materia_id) IS DISTINCT FROM (o.ciclo, o.carrera_materia_id)
+  ));
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_materia_alta_kardex_upd ON planes.materia_alta;
+CREATE TRIGGER tg_materia_alta_kardex_upd
+AFTER UPDATE ON planes.materia_alta
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_materia_alta_kardex_tg();
+
+-- carrera_materia: cambio de horas (créditos) de una materia del plan.
+CREATE OR REPLACE FUNCTION planes.fn_carrera_materia_kardex_tg()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  PERFORM academico.fn_alumno_kardex_recalcular(ARRAY(
+    SELECT ai.fk_alumno
+    FROM nuevos n
+    JOIN viejos o ON o.carrera_materia_id = n.carrera_materia_id
+    JOIN planes.materia_alta ma ON ma.carrera_materia_id = n.carrera_materia_id
+    JOIN academico.alumno_inscripcion ai ON ai.fk_materia_alta = ma.materia_alta_id
+    WHERE n.horas_totales IS DISTINCT FROM o.horas_totales
+  ));
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_carrera_materia_kardex_upd ON planes.carrera_materia;
+CREATE TRIGGER tg_carrera_materia_kardex_upd
+AFTER UPDATE ON planes.carrera_materia
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_carrera_materia_kardex_tg();
+
+-- Reconstrucción completa (carga inicial, corrección general o cambio de
+-- la calificación aprobatoria).
+CREATE OR REPLACE FUNCTION academico.fn_alumno_kardex_reconstruir()
+RETURNS VOID LANGUAGE sql AS $$
+  LOCK TABLE academico.alumno_inscripcion IN SHARE MODE;
+  LOCK TABLE academico.alumno_kardex IN EXCLUSIVE MODE;
+  DELETE FROM academico.alumno_kardex;
+  INSERT INTO academico.alumno_kardex (
+    fk_alumno, materias_cursadas, materias_aprobadas, materias_reprobadas,
+    creditos_cursados, creditos_aprobados, suma_ponderada, ultimo_ciclo
+  )
+  SELECT fk_alumno, materias_cursadas, materias_aprobadas, materias_reprobadas,
+         creditos_cursados, creditos_aprobados, suma_ponderada, ultimo_ciclo
+  FROM academico.fn_alumno_kardex_recuento(NULL);
+$$;
+
+CREATE OR REPLACE FUNCTION academico.fn_parametros_kardex_tg()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  PERFORM academico.fn_alumno_kardex_reconstruir();
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_parametros_kardex ON academico.parametros_globales;
+CREATE TRIGGER tg_parametros_kardex
+AFTER UPDATE ON academico.parametros_globales
+FOR EACH ROW
+WHEN (NEW.clave = 'calificacion_aprobatoria' AND NEW.valor_texto IS DISTINCT FROM OLD.valor_texto)
+EXECUTE FUNCTION academico.fn_parametros_kardex_tg();
+
+SELECT academico.fn_alumno_kardex_reconstruir();
+
+-- ======================================
+-- 4.e) VERSIÓN DEL GRAFO DE PRERREQUISITOS
+-- ======================================
+-- La aplicación carga planes.materia_prerrequisito completo, calcula el
+-- cierre transitivo en memoria y lo reutiliza mientras este contador no
+-- avance (cualquier cambio en prerrequisitos o en el catálogo de materias).
+-- El contador se incrementa dentro de la transacción que hace el cambio:
+-- quien lee la versión nueva ya puede leer los datos que la produjeron.
+
+DROP SEQUENCE IF EXISTS planes.seq_prerrequisitos;
+
+CREATE TABLE IF NOT EXISTS planes.prerrequisitos_version (
+  id      BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  version BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO planes.prerrequisitos_version (id) VALUES (TRUE)
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION planes.fn_prerrequisitos_cambio()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  UPDATE planes.prerrequisitos_version SET version = version + 1;
+  RETURN NULL;
+END$$;
+
+DROP TRIGGER IF EXISTS tg_prerrequisitos_version ON planes.materia_prerrequisito;
+CREATE TRIGGER tg_prerrequisitos_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON planes.materia_prerrequisito
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_prerrequisitos_cambio();
+
+DROP TRIGGER IF EXISTS tg_prerrequisitos_version ON planes.materia;
+CREATE TRIGGER tg_prerrequisitos_version
+AFTER INSERT OR DELETE OR UPDATE OF clave OR TRUNCATE ON planes.materia
+FOR EACH STATEMENT EXECUTE FUNCTION planes.fn_prerrequisitos_cambio();
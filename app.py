@@ -1,17 +1,38 @@
 import os
+import atexit
+import base64
+import csv
+import gzip
+import io
+import ipaddress
+import json
+import multiprocessing
+import queue
+import re
 import smtplib
+import threading
+import time
 from email.message import EmailMessage
 import secrets
 import string
-from datetime import timedelta
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
 from functools import wraps
 
 from flask import (
     Flask, render_template, request,
-    redirect, url_for, session, flash, abort
+    redirect, url_for, session, flash, abort, jsonify,
+    has_request_context, Response,
 )
+from markupsafe import Markup, escape
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Json, execute_values
+import psycopg2.errors
+import bcrypt
+import click
+import numpy as np
 from dotenv import load_dotenv
 
 # =====================================
@@ -40,6 +61,22 @@ def get_connection():
     )
 
 
+def get_maintenance_connection():
+    """
+    Conexión para tareas de mantenimiento (DDL, particiones).
+    Requiere un usuario dueño de las tablas: DB_MAINT_USER / DB_MAINT_PASSWORD
+    (si no se definen, se usan las credenciales normales).
+    """
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "DB_universidad"),
+        user=os.getenv("DB_MAINT_USER", os.getenv("DB_USER", "backend_app")),
+        password=os.getenv("DB_MAINT_PASSWORD", os.getenv("DB_PASSWORD", "Backend123")),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=os.getenv("DB_PORT", "5432"),
+        cursor_factory=RealDictCursor,
+    )
+
+
 # =====================================
 # FUNCIONES AUXILIARES
 # =====================================
@@ -82,30 +119,40 @@ def role_required(*roles_permitidos):
     return decorator
 
 
-def send_email(to_email: str, subject: str, body: str):
-    """Envío de correo con smtplib."""
-    server = os.getenv("MAIL_SERVER")
-    port = int(os.getenv("MAIL_PORT", "587"))
+def _smtp_config():
+    """Lee la configuración SMTP del entorno; None si está incompleta."""
     username = os.getenv("MAIL_USERNAME")
-    password = os.getenv("MAIL_PASSWORD")
-    use_tls = os.getenv("MAIL_USE_TLS", "true").lower() == "true"
-    default_sender = os.getenv("MAIL_DEFAULT_SENDER", username)
+    cfg = {
+        "server": os.getenv("MAIL_SERVER"),
+        "port": int(os.getenv("MAIL_PORT", "587")),
+        "username": username,
+        "password": os.getenv("MAIL_PASSWORD"),
+        "use_tls": os.getenv("MAIL_USE_TLS", "true").lower() == "true",
+        "sender": os.getenv("MAIL_DEFAULT_SENDER", username),
+    }
+    # Sin usuario/contraseña se envía sin login (p.ej. servidor local de
+    # depuración: python -m aiosmtpd -n -l localhost:1025 con MAIL_USE_TLS=false)
+    if not cfg["server"] or not cfg["sender"]:
+        return None
+    return cfg
 
-    if not all([server, port, username, password]):
-        print("⚠ Configuración SMTP incompleta")
-        return
 
+def _smtp_connect(cfg):
+    smtp = smtplib.SMTP(cfg["server"], cfg["port"], timeout=30)
+    if cfg["use_tls"]:
+        smtp.starttls()
+    if cfg["username"] and cfg["password"]:
+        smtp.login(cfg["username"], cfg["password"])
+    return smtp
+
+
+def _build_email(sender, to_email, subject, body):
     msg = EmailMessage()
-    msg["From"] = default_sender
+    msg["From"] = sender
     msg["To"] = to_email
     msg["Subject"] = subject
     msg.set_content(body)
-
-    with smtplib.SMTP(server, port) as smtp:
-        if use_tls:
-            smtp.starttls()
-        smtp.login(username, password)
-        smtp.send_message(msg)
+    return msg
 
 
 def generate_random_password(length: int = 10) -> str:
@@ -113,6 +160,441 @@ def generate_random_password(length: int = 10) -> str:
     return "".join(secrets.choice(chars) for _ in range(length))
 
 
+# =====================================
+# AUDITORÍA (COLA ASÍNCRONA POR LOTES)
+# =====================================
+#
+# Las vistas solo encolan; un hilo escritor vacía la cola en lotes con
+# INSERT multi-fila hacia seguridad.intentos_login y seguridad.eventos.
+# La cola es acotada: si se llena, quien encola espera AUDIT_PUT_TIMEOUT
+# segundos (backpressure) y, si sigue llena, el registro se descarta y se
+# contabiliza en _audit_descartados.
+
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+AUDIT_PUT_TIMEOUT = float(os.getenv("AUDIT_PUT_TIMEOUT", "0.05"))
+
+_audit_queue = queue.Queue(maxsize=AUDIT_QUEUE_MAX)
+_audit_stop = threading.Event()
+_audit_lock = threading.Lock()
+_audit_thread = None
+_audit_descartados = 0
+
+
+def _audit_enqueue(kind, row):
+    global _audit_descartados
+    _ensure_audit_writer()
+    try:
+        _audit_queue.put((kind, row), timeout=AUDIT_PUT_TIMEOUT)
+    except queue.Full:
+        with _audit_lock:
+            _audit_descartados += 1
+        print(f"⚠ Cola de auditoría llena; registro '{kind}' descartado")
+
+
+def audit_login_attempt(identificador, id_usuario, exitoso):
+    """Encola un intento de inicio de sesión (con IP y agente de la petición)."""
+    ip = request.remote_addr if has_request_context() else None
+    agente = request.user_agent.string if has_request_context() else None
+    _audit_enqueue("login", (
+        id_usuario,
+        identificador[:255],
+        ip,
+        agente,
+        bool(exitoso),
+        datetime.now(timezone.utc),
+    ))
+
+
+def audit_event(tipo, descripcion=None, datos=None, usuario_id=None):
+    """
+    Encola un evento para seguridad.eventos.
+
+    usuario_id es quien realiza la acción (por defecto el usuario en sesión);
+    los datos del objeto afectado van en `datos` (JSONB).
+    """
+    if usuario_id is None and has_request_context():
+        usuario_id = session.get("user_id")
+    _audit_enqueue("evento", (
+        datetime.now(timezone.utc),
+        tipo,
+        usuario_id,
+        descripcion,
+        Json(datos or {}),
+    ))
+
+
+def _audit_drain(block_seconds):
+    """Toma hasta AUDIT_BATCH_SIZE registros de la cola."""
+    lote = []
+    try:
+        lote.append(_audit_queue.get(timeout=block_seconds))
+    except queue.Empty:
+        return lote
+    while len(lote) < AUDIT_BATCH_SIZE:
+        try:
+            lote.append(_audit_queue.get_nowait())
+        except queue.Empty:
+            break
+    return lote
+
+
+def _audit_write(conn, lote):
+    intentos = [row for kind, row in lote if kind == "login"]
+    eventos = [row for kind, row in lote if kind == "evento"]
+    accesos = {}
+    for id_usuario, _, _, _, exitoso, ts in intentos:
+        if exitoso and id_usuario is not None:
+            accesos[id_usuario] = max(ts, accesos.get(id_usuario, ts))
+
+    cur = conn.cursor()
+    # El LEFT JOIN descarta ids de usuarios borrados entre el encolado y
+    # la escritura, para no perder el lote completo por una FK.
+    if intentos:
+        execute_values(cur, """
+            INSERT INTO seguridad.intentos_login
+                (id_usuario, identificador, direccion_ip, agente_usuario, exitoso, intentado_en)
+            SELECT u.id_usuario, v.identificador, v.ip, v.agente, v.exitoso, v.ts
+            FROM (VALUES %s) AS v(id_usuario, identificador, ip, agente, exitoso, ts)
+            LEFT JOIN seguridad.usuarios u ON u.id_usuario = v.id_usuario;
+        """, intentos,
+            template="(%s::bigint, %s, %s::inet, %s, %s, %s::timestamptz)",
+            page_size=AUDIT_BATCH_SIZE)
+    if eventos:
+        execute_values(cur, """
+            INSERT INTO seguridad.eventos (fecha, tipo, usuario_id, descripcion, datos)
+            SELECT v.fecha, v.tipo, u.id_usuario, v.descripcion, v.datos
+            FROM (VALUES %s) AS v(fecha, tipo, usuario_id, descripcion, datos)
+            LEFT JOIN seguridad.usuarios u ON u.id_usuario = v.usuario_id;
+        """, eventos,
+            template="(%s::timestamptz, %s, %s::bigint, %s, %s::jsonb)",
+            page_size=AUDIT_BATCH_SIZE)
+    if accesos:
+        execute_values(cur, """
+            UPDATE seguridad.usuarios u
+            SET ultimo_acceso_en = v.ts
+            FROM (VALUES %s) AS v(id_usuario, ts)
+            WHERE u.id_usuario = v.id_usuario
+              AND (u.ultimo_acceso_en IS NULL OR u.ultimo_acceso_en < v.ts);
+        """, list(accesos.items()),
+            template="(%s::bigint, %s::timestamptz)")
+    conn.commit()
+    cur.close()
+
+
+def _audit_flush_lote(conn, lote):
+    """Escribe un lote reintentando una vez con conexión nueva."""
+    for intento in range(2):
+        try:
+            if conn is None or conn.closed:
+                conn = get_connection()
+            _audit_write(conn, lote)
+            return conn
+        except Exception as e:
+            if conn and not conn.closed:
+                conn.rollback()
+                conn.close()
+            conn = None
+            if intento:
+                print(f"Error escribiendo lote de auditoría ({len(lote)} registros): {e}")
+    return conn
+
+
+def _audit_worker():
+    conn = None
+    while True:
+        lote = _audit_drain(AUDIT_FLUSH_SECONDS)
+        if lote:
+            conn = _audit_flush_lote(conn, lote)
+            for _ in lote:
+                _audit_queue.task_done()
+        elif _audit_stop.is_set():
+            break
+    if conn and not conn.closed:
+        conn.close()
+
+
+def _ensure_audit_writer():
+    global _audit_thread
+    if _audit_thread is not None and _audit_thread.is_alive():
+        return
+    with _audit_lock:
+        if _audit_thread is None or not _audit_thread.is_alive():
+            _audit_stop.clear()
+            _audit_thread = threading.Thread(
+                target=_audit_worker, name="audit-writer", daemon=True
+            )
+            _audit_thread.start()
+
+
+@atexit.register
+def flush_audit_queue(timeout: float = 10.0):
+    """Vacía la cola pendiente antes de terminar el proceso."""
+    _audit_stop.set()
+    if _audit_thread is not None and _audit_thread.is_alive():
+        _audit_thread.join(timeout)
+    elif not _audit_queue.empty():
+        conn = None
+        while True:
+            lote = _audit_drain(0)
+            if not lote:
+                break
+            conn = _audit_flush_lote(conn, lote)
+        if conn and not conn.closed:
+            conn.close()
+
+
+# =====================================
+# COLA DE CORREO SALIENTE
+# =====================================
+#
+# Los correos se guardan en seguridad.cola_correos dentro de la misma
+# transacción que los origina (enqueue_email) y un pool de hilos los envía:
+# cada hilo reserva lotes con FOR UPDATE SKIP LOCKED, reutiliza su conexión
+# SMTP para todo el lote (y entre lotes mientras no pase MAIL_IDLE_SECONDS),
+# respeta MAIL_RATE_PER_MINUTE y reintenta con backoff exponencial.
+# Con MAIL_INPROCESS_WORKERS=0 el pool no arranca dentro de la app y se usa
+# `flask correos-worker` como proceso aparte.
+
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "2"))
+MAIL_INPROCESS_WORKERS = os.getenv("MAIL_INPROCESS_WORKERS", "true").lower() == "true"
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_RATE_PER_MINUTE = int(os.getenv("MAIL_RATE_PER_MINUTE", "60"))
+MAIL_MAX_INTENTOS = int(os.getenv("MAIL_MAX_INTENTOS", "5"))
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", "5"))
+MAIL_IDLE_SECONDS = float(os.getenv("MAIL_IDLE_SECONDS", "60"))
+MAIL_LEASE_SECONDS = 300
+MAIL_BACKOFF_BASE_SECONDS = 30
+MAIL_BACKOFF_MAX_SECONDS = 3600
+
+_mail_wakeup = threading.Event()
+_mail_stop = threading.Event()
+_mail_lock = threading.Lock()
+_mail_threads = []
+
+
+class _RateLimiter:
+    """Token bucket compartido por los hilos del proceso."""
+
+    def __init__(self, por_minuto):
+        self.capacidad = max(1, por_minuto)
+        self.tokens = float(self.capacidad)
+        self.tasa = self.capacidad / 60.0
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                ahora = time.monotonic()
+                self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+                self.ultimo = ahora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                espera = (1 - self.tokens) / self.tasa
+            time.sleep(espera)
+
+
+_mail_rate = _RateLimiter(MAIL_RATE_PER_MINUTE)
+
+
+def enqueue_email(conn, to_email: str, subject: str, body: str):
+    """
+    Encola un correo usando la transacción de `conn` (se envía solo si el
+    llamador hace commit). Después del commit llamar a wake_mail_workers().
+    """
+    enqueue_emails(conn, [(to_email, subject, body)])
+
+
+def enqueue_emails(conn, mensajes):
+    """Versión por lotes de enqueue_email: mensajes = [(destinatario, asunto, cuerpo), ...]."""
+    if not mensajes:
+        return
+    cur = conn.cursor()
+    execute_values(cur, """
+        INSERT INTO seguridad.cola_correos (destinatario, asunto, cuerpo, max_intentos)
+        VALUES %s;
+    """, [(to, subject, body, MAIL_MAX_INTENTOS) for to, subject, body in mensajes],
+        page_size=1000)
+    cur.close()
+
+
+def wake_mail_workers():
+    if MAIL_INPROCESS_WORKERS:
+        start_mail_workers()
+    _mail_wakeup.set()
+
+
+def _mail_claim(conn, limite):
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE seguridad.cola_correos c
+        SET estado = 'enviando',
+            bloqueado_hasta = NOW() + make_interval(secs => %s)
+        WHERE c.id_correo IN (
+            SELECT id_correo
+            FROM seguridad.cola_correos
+            WHERE (estado = 'pendiente' AND proximo_intento_en <= NOW())
+               OR (estado = 'enviando' AND bloqueado_hasta < NOW())
+            ORDER BY proximo_intento_en
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING c.id_correo, c.destinatario, c.asunto, c.cuerpo;
+    """, (MAIL_LEASE_SECONDS, limite))
+    lote = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return lote
+
+
+def _mail_finish(conn, enviados, fallidos):
+    cur = conn.cursor()
+    if enviados:
+        # El cuerpo puede contener contraseñas temporales: no se conserva
+        cur.execute("""
+            UPDATE seguridad.cola_correos
+            SET estado = 'enviado',
+                enviado_en = NOW(),
+                cuerpo = '',
+                bloqueado_hasta = NULL,
+                ultimo_error = NULL
+            WHERE id_correo = ANY(%s);
+        """, (enviados,))
+    if fallidos:
+        # Al agotar los intentos tampoco se conserva el cuerpo
+        execute_values(cur, """
+            UPDATE seguridad.cola_correos c
+            SET intentos = c.intentos + 1,
+                ultimo_error = v.error,
+                bloqueado_hasta = NULL,
+                estado = CASE WHEN c.intentos + 1 >= c.max_intentos
+                              THEN 'fallido' ELSE 'pendiente' END,
+                cuerpo = CASE WHEN c.intentos + 1 >= c.max_intentos
+                              THEN '' ELSE c.cuerpo END,
+                proximo_intento_en = NOW() + make_interval(
+                    secs => LEAST(%s, %s * POWER(2, c.intentos))
+                )
+            FROM (VALUES %%s) AS v(id_correo, error)
+            WHERE c.id_correo = v.id_correo;
+        """ % (MAIL_BACKOFF_MAX_SECONDS, MAIL_BACKOFF_BASE_SECONDS),
+            fallidos, template="(%s::bigint, %s)")
+    conn.commit()
+    cur.close()
+
+
+def _mail_send_batch(smtp, cfg, lote):
+    """Envía el lote por una sola sesión SMTP; reconecta una vez si se cae."""
+    enviados, fallidos = [], []
+    for job in lote:
+        _mail_rate.acquire()
+        msg = _build_email(cfg["sender"], job["destinatario"], job["asunto"], job["cuerpo"])
+        for intento in range(2):
+            try:
+                if smtp is None:
+                    smtp = _smtp_connect(cfg)
+                smtp.send_message(msg)
+                enviados.append(job["id_correo"])
+                break
+            # SMTPException hereda de OSError: primero los rechazos del
+            # mensaje (la sesión sigue sirviendo), luego los de conexión.
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                fallidos.append((job["id_correo"], str(e)[:500]))
+                break
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError) as e:
+                _mail_close(smtp)
+                smtp = None
+                if intento:
+                    fallidos.append((job["id_correo"], str(e)[:500]))
+            except smtplib.SMTPException as e:
+                fallidos.append((job["id_correo"], str(e)[:500]))
+                break
+            except OSError as e:
+                _mail_close(smtp)
+                smtp = None
+                if intento:
+                    fallidos.append((job["id_correo"], str(e)[:500]))
+    return smtp, enviados, fallidos
+
+
+def _mail_close(smtp):
+    if smtp is not None:
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+
+
+def _mail_worker():
+    conn = None
+    smtp = None
+    ultimo_envio = 0.0
+    while not _mail_stop.is_set():
+        try:
+            if conn is None or conn.closed:
+                conn = get_connection()
+            lote = _mail_claim(conn, MAIL_BATCH_SIZE)
+        except Exception as e:
+            print(f"Error leyendo cola de correos: {e}")
+            if conn and not conn.closed:
+                conn.close()
+            conn = None
+            _mail_stop.wait(MAIL_POLL_SECONDS)
+            continue
+
+        if not lote:
+            if smtp is not None and time.monotonic() - ultimo_envio > MAIL_IDLE_SECONDS:
+                _mail_close(smtp)
+                smtp = None
+            _mail_wakeup.wait(MAIL_POLL_SECONDS)
+            _mail_wakeup.clear()
+            continue
+
+        cfg = _smtp_config()
+        if cfg:
+            smtp, enviados, fallidos = _mail_send_batch(smtp, cfg, lote)
+        else:
+            enviados = []
+            fallidos = [(job["id_correo"], "Configuración SMTP incompleta") for job in lote]
+        ultimo_envio = time.monotonic()
+
+        try:
+            _mail_finish(conn, enviados, fallidos)
+        except Exception as e:
+            # Las reservas vencen en MAIL_LEASE_SECONDS y se reintentan
+            print(f"Error actualizando cola de correos: {e}")
+            if conn and not conn.closed:
+                conn.close()
+            conn = None
+
+    _mail_close(smtp)
+    if conn and not conn.closed:
+        conn.close()
+
+
+def start_mail_workers(hilos: int = MAIL_WORKERS):
+    with _mail_lock:
+        vivos = [t for t in _mail_threads if t.is_alive()]
+        _mail_threads[:] = vivos
+        if vivos:
+            return
+        _mail_stop.clear()
+        for i in range(hilos):
+            t = threading.Thread(target=_mail_worker, name=f"mail-worker-{i}", daemon=True)
+            t.start()
+            _mail_threads.append(t)
+
+
+@atexit.register
+def stop_mail_workers(timeout: float = 5.0):
+    _mail_stop.set()
+    _mail_wakeup.set()
+    for t in list(_mail_threads):
+        t.join(timeout)
+
+
 # =====================================
 # MAPEO DE ROLES
 # =====================================
@@ -157,6 +639,7 @@ def login():
                 u.id_usuario,
                 u.nombre_usuario,
                 u.correo_electronico,
+                (u.contrasena_hash = crypt(%s, u.contrasena_hash)) AS contrasena_ok,
                 ARRAY_AGG(r.nombre_rol) AS roles
             FROM seguridad.usuarios u
             LEFT JOIN seguridad.usuario_rol ur ON ur.id_usuario = u.id_usuario
@@ -166,18 +649,24 @@ def login():
                 LOWER(u.nombre_usuario) = LOWER(%s)
                 OR LOWER(u.correo_electronico) = LOWER(%s)
               )
-              AND u.contrasena_hash = crypt(%s, u.contrasena_hash)
-            GROUP BY u.id_usuario;
-        """, (identificador, identificador, contrasena))
+            GROUP BY u.id_usuario
+            -- Si el identificador es el usuario de uno y el correo de otro,
+            -- gana la coincidencia por nombre de usuario.
+            ORDER BY (LOWER(u.nombre_usuario) = LOWER(%s)) DESC
+            LIMIT 1;
+        """, (contrasena, identificador, identificador, identificador))
 
         user = cur.fetchone()
         cur.close()
         conn.close()
 
-        if not user:
+        if not user or not user["contrasena_ok"]:
+            audit_login_attempt(identificador, user["id_usuario"] if user else None, False)
             flash("Credenciales incorrectas.", "danger")
             return render_template("login.html")
 
+        audit_login_attempt(identificador, user["id_usuario"], True)
+
         if selected_role not in user["roles"]:
             flash("El rol no pertenece a tu cuenta.", "danger")
             return render_template("login.html")
@@ -258,21 +747,25 @@ def forgot_password():
             """,
             (temp_password, user["id_usuario"]),
         )
+        # El correo se encola en la misma transacción y se envía en segundo plano
+        enqueue_email(
+            conn,
+            user["correo_electronico"],
+            "Recuperación de contraseña - Sistema Universitario",
+            f"Tu nueva contraseña temporal es: {temp_password}\n\n"
+            "Por seguridad, cambia la contraseña después de iniciar sesión.",
+        )
         conn.commit()
         cur.close()
         conn.close()
+        wake_mail_workers()
 
-        # Enviar correo (si SMTP está configurado)
-        try:
-            send_email(
-                user["correo_electronico"],
-                "Recuperación de contraseña - Sistema Universitario",
-                f"Tu nueva contraseña temporal es: {temp_password}\n\n"
-                "Por seguridad, cambia la contraseña después de iniciar sesión.",
-            )
-        except Exception as e:
-            # Si el correo falla, al menos avisamos
-            print(f"Error enviando correo de recuperación: {e}")
+        audit_event(
+            "recuperacion_contrasena",
+            "Contraseña temporal generada por recuperación",
+            {"id_usuario": user["id_usuario"]},
+            usuario_id=user["id_usuario"],
+        )
 
         flash(
             "Se ha enviado una contraseña temporal a tu correo (si está configurado el servidor de correo).",
@@ -510,16 +1003,30 @@ def est_perfil_materias_horario():
                     COALESCE(p.apellido_paterno,'') || ' ' ||
                     COALESCE(p.apellido_materno,'')
                 ) AS docente,
-                cm.horas_totales AS creditos
+                cm.horas_totales AS creditos,
+                asis.sesiones,
+                asis.asistencias
             FROM academico.alumno_inscripcion ai
             JOIN planes.materia_alta ma ON ma.materia_alta_id = ai.fk_materia_alta
             JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
             JOIN planes.materia m ON m.materia_id = cm.materia_id
             LEFT JOIN rrhh.personal p ON p.id_personal = ma.fk_personal
+            LEFT JOIN LATERAL (
+                SELECT
+                    COUNT(*) AS sesiones,
+                    COUNT(*) FILTER (
+                        WHERE academico.fn_bit_lista(s.presentes, ai.posicion_lista)
+                    ) AS asistencias
+                FROM academico.asistencia_sesiones s
+                WHERE s.fk_materia_alta = ai.fk_materia_alta
+                  AND academico.fn_bit_lista(s.inscritos, ai.posicion_lista)
+            ) asis ON TRUE
             WHERE ai.fk_alumno = %s
             ORDER BY m.clave;
         """, (nc,))
         materias = cur.fetchall()
+        for m in materias:
+            m["porcentaje_asistencia"] = _porcentaje(m["asistencias"], m["sesiones"])
 
         # ---- Horario ----
         cur.execute("""
@@ -568,17 +1075,149 @@ def est_perfil_materias_horario():
 
 
 # =====================================
-# ESTUDIANTE – BIBLIOTECA
+# PLANES – GRAFO DE PRERREQUISITOS
 # =====================================
+#
+# planes.materia_prerrequisito se carga completo una vez y se guarda en
+# memoria como máscaras de bits (un bit por materia): directos[i] y
+# cierre[i] = todos los prerrequisitos transitivos de la materia i. La
+# elegibilidad de un alumno es `cierre & ~aprobadas == 0`. La caché se
+# invalida cuando avanza planes.prerrequisitos_version (ver 4.e en el SQL).
+# Para validar ciclos al agregar un prerrequisito no se usa la caché: el
+# grafo se carga de nuevo con la tabla bloqueada.
+
+_prerrequisitos_lock = threading.Lock()
+_prerrequisitos_cache = None
+
+
+def _indices_bits(mascara):
+    while mascara:
+        bajo = mascara & -mascara
+        yield bajo.bit_length() - 1
+        mascara ^= bajo
+
+
+class _GrafoPrerrequisitos:
+    """Cierre transitivo de prerrequisitos; inmutable una vez construido."""
+
+    def __init__(self, materias, aristas):
+        self.ids = [m["materia_id"] for m in materias]
+        self.claves = {m["materia_id"]: m["clave"] for m in materias}
+        self.bit = {materia_id: i for i, materia_id in enumerate(self.ids)}
+        self.directos = [0] * len(self.ids)
+        for materia_id, prerequisito_id in aristas:
+            self.directos[self.bit[materia_id]] |= 1 << self.bit[prerequisito_id]
+        self.cierre = self._cerrar(self.directos)
+
+    @staticmethod
+    def _cerrar(directos):
+        # Orden topológico (Kahn): cada materia se cierra después de sus prerrequisitos
+        n = len(directos)
+        prereqs = [list(_indices_bits(d)) for d in directos]
+        dependientes = [[] for _ in range(n)]
+        for i, ps in enumerate(prereqs):
+            for p in ps:
+                dependientes[p].append(i)
+        pendientes = [len(ps) for ps in prereqs]
+        cola = [i for i in range(n) if not pendientes[i]]
+        cierre = list(directos)
+        for i in cola:
+            for p in prereqs[i]:
+                cierre[i] |= cierre[p]
+            for d in dependientes[i]:
+                pendientes[d] -= 1
+                if not pendientes[d]:
+                    cola.append(d)
+
+        # Lo que quede está en (o depende de) un ciclo cargado por fuera de la
+        # app: punto fijo para que al menos el cierre sea correcto.
+        resto = [i for i in range(n) if pendientes[i]]
+        cambio = bool(resto)
+        while cambio:
+            cambio = False
+            for i in resto:
+                nuevo = cierre[i]
+                for p in prereqs[i]:
+                    nuevo |= cierre[p]
+                if nuevo != cierre[i]:
+                    cierre[i] = nuevo
+                    cambio = True
+        return cierre
+
+    def mascara(self, materia_ids):
+        m = 0
+        for materia_id in materia_ids:
+            if materia_id in self.bit:
+                m |= 1 << self.bit[materia_id]
+        return m
+
+    def crearia_ciclo(self, materia_id, prerequisito_id):
+        """True si `materia_id` ya es prerrequisito (transitivo) de `prerequisito_id`."""
+        if materia_id == prerequisito_id:
+            return True
+        return bool(self.cierre[self.bit[prerequisito_id]] >> self.bit[materia_id] & 1)
+
+    def faltantes(self, materia_id, aprobadas):
+        """Claves de los prerrequisitos (transitivos) que no están en la máscara `aprobadas`."""
+        i = self.bit.get(materia_id)
+        if i is None:
+            return []
+        return sorted(self.claves[self.ids[j]] for j in _indices_bits(self.cierre[i] & ~aprobadas))
+
+    def elegibles(self, aprobadas, candidatas):
+        """Materias de `candidatas` no aprobadas cuyos prerrequisitos están todos aprobados."""
+        resultado = []
+        for materia_id in candidatas:
+            i = self.bit.get(materia_id)
+            if i is not None and not (aprobadas >> i & 1) and not (self.cierre[i] & ~aprobadas):
+                resultado.append(materia_id)
+        return resultado
+
+
+def cargar_grafo_prerrequisitos(cur):
+    """Construye el grafo con lo que ve la sentencia actual, sin caché."""
+    cur.execute("SELECT materia_id, clave FROM planes.materia ORDER BY materia_id;")
+    materias = cur.fetchall()
+    cur.execute("SELECT materia_id, prerequisito_id FROM planes.materia_prerrequisito;")
+    aristas = [(r["materia_id"], r["prerequisito_id"]) for r in cur.fetchall()]
+    return _GrafoPrerrequisitos(materias, aristas)
+
+
+def grafo_prerrequisitos(cur):
+    """Grafo de prerrequisitos vigente; se recarga solo si cambió la versión."""
+    global _prerrequisitos_cache
+    cur.execute("SELECT version FROM planes.prerrequisitos_version;")
+    version = cur.fetchone()["version"]
+    with _prerrequisitos_lock:
+        guardado = _prerrequisitos_cache
+    if guardado and guardado[0] == version:
+        return guardado[1]
+
+    grafo = cargar_grafo_prerrequisitos(cur)
+    with _prerrequisitos_lock:
+        _prerrequisitos_cache = (version, grafo)
+    return grafo
 
-@app.route("/estudiante/biblioteca")
+
+# =====================================
+# ESTUDIANTE – KÁRDEX
+# =====================================
+#
+# El resumen (créditos, promedio, reprobadas, último ciclo) sale de
+# academico.alumno_kardex, que los triggers mantienen con deltas (4.f en el
+# SQL); aquí se listan las materias del alumno por ciclo y, con el grafo de
+# prerrequisitos, las materias del plan que ya puede cursar.
+
+@app.route("/estudiante/kardex")
 @login_required
 @role_required("Estudiante")
-def est_perfil_biblioteca():
+def est_perfil_kardex():
     user = current_user()
-    prestamos_activos = []
-    historial_prestamos = []
     info_estudiante = None
+    kardex = None
+    materias = []
+    pendientes = []
+    aprobatoria = None
 
     conn = None
     try:
@@ -589,81 +1228,84 @@ def est_perfil_biblioteca():
 
         cur = conn.cursor()
 
-        # ---- Info estudiante para el encabezado ----
+        # ---- Semestre para el encabezado ----
         cur.execute("""
-            SELECT
-                a.numero_control AS matricula,
-                TRIM(
-                    a.nombre || ' ' ||
-                    a.apellido_paterno || ' ' ||
-                    COALESCE(a.apellido_materno, '')
-                ) AS nombre_completo,
-                a.curp,
-                COALESCE(cto.correo_institucional, cto.correo_personal) AS correo,
-                cto.telefono,
-                plan_info.carrera_nombre,
-                plan_info.semestre,
-                plan_info.tutor_nombre,
-                plan_info.tutor_correo
-            FROM academico.alumnos a
-            LEFT JOIN academico.vw_contacto_actual cto
-              ON cto.numero_control = a.numero_control
-            LEFT JOIN LATERAL (
-                SELECT
-                    c.nombre AS carrera_nombre,
-                    cm.semestre,
-                    TRIM(
-                        COALESCE(p.nombre,'') || ' ' ||
-                        COALESCE(p.apellido_paterno,'') || ' ' ||
-                        COALESCE(p.apellido_materno,'')
-                    ) AS tutor_nombre,
-                    p.correo_institucional AS tutor_correo
-                FROM academico.alumno_inscripcion ai
-                JOIN planes.materia_alta ma ON ma.materia_alta_id = ai.fk_materia_alta
-                JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
-                JOIN planes.carrera c ON c.carrera_id = cm.carrera_id
-                LEFT JOIN rrhh.personal p ON p.id_personal = ma.fk_personal
-                WHERE ai.fk_alumno = a.numero_control
-                ORDER BY cm.semestre DESC, ma.materia_alta_id DESC
-                LIMIT 1
-            ) AS plan_info ON TRUE
-            WHERE a.numero_control = %s
-            LIMIT 1;
+            SELECT MAX(cm.semestre) AS semestre
+            FROM academico.alumno_inscripcion ai
+            JOIN planes.materia_alta ma ON ma.materia_alta_id = ai.fk_materia_alta
+            JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+            WHERE ai.fk_alumno = %s;
         """, (nc,))
         info_estudiante = cur.fetchone()
 
-        # ---- Préstamos activos ----
+        # ---- Resumen ----
         cur.execute("""
             SELECT
-                p.id_prestamo,
-                l.titulo_libro                 AS titulo_libro,
-                p.fecha_prestamo,
-                p.fecha_devolucion_estimada    AS fecha_limite,
-                p.fecha_devolucion_real,
-                p.estado
-            FROM biblioteca.prestamos p
-            JOIN biblioteca.libros l ON l.id_libro = p.id_libro
-            WHERE p.fk_alumno = %s
-              AND p.estado <> 'Devuelto'
-            ORDER BY p.fecha_prestamo DESC;
+                materias_cursadas,
+                materias_aprobadas,
+                materias_reprobadas,
+                creditos_cursados,
+                creditos_aprobados,
+                promedio,
+                ultimo_ciclo,
+                actualizado_en
+            FROM academico.alumno_kardex
+            WHERE fk_alumno = %s;
         """, (nc,))
-        prestamos_activos = cur.fetchall()
+        kardex = cur.fetchone()
 
-        # ---- Historial (devueltos) ----
+        # ---- Materias por ciclo ----
+        cur.execute("SELECT academico.fn_calificacion_aprobatoria() AS minimo;")
+        aprobatoria = cur.fetchone()["minimo"]
         cur.execute("""
             SELECT
-                p.id_prestamo,
-                l.titulo_libro                 AS titulo_libro,
-                p.fecha_prestamo,
-                p.fecha_devolucion_real        AS fecha_devolucion,
-                p.estado
-            FROM biblioteca.prestamos p
-            JOIN biblioteca.libros l ON l.id_libro = p.id_libro
-            WHERE p.fk_alumno = %s
-              AND p.estado = 'Devuelto'
-            ORDER BY p.fecha_devolucion_real DESC NULLS LAST;
+                ma.ciclo,
+                cm.semestre,
+                m.materia_id,
+                m.clave,
+                m.nombre AS nombre_materia,
+                cm.horas_totales AS creditos,
+                ai.calificacion
+            FROM academico.alumno_inscripcion ai
+            JOIN planes.materia_alta ma ON ma.materia_alta_id = ai.fk_materia_alta
+            JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+            JOIN planes.materia m ON m.materia_id = cm.materia_id
+            WHERE ai.fk_alumno = %s
+            ORDER BY ma.ciclo DESC, cm.semestre, m.clave;
         """, (nc,))
-        historial_prestamos = cur.fetchall()
+        materias = cur.fetchall()
+
+        # ---- Materias del plan aún no cursadas: disponibles o bloqueadas ----
+        aprobadas = {m["materia_id"] for m in materias
+                     if m["calificacion"] is not None and m["calificacion"] >= aprobatoria}
+        en_curso = {m["materia_id"] for m in materias if m["calificacion"] is None}
+        cur.execute("""
+            SELECT DISTINCT ON (m.materia_id)
+                m.materia_id,
+                m.clave,
+                m.nombre AS nombre_materia,
+                cm.semestre
+            FROM planes.carrera_materia cm
+            JOIN planes.materia m ON m.materia_id = cm.materia_id
+            WHERE cm.carrera_id IN (
+                SELECT cm2.carrera_id
+                FROM academico.alumno_inscripcion ai
+                JOIN planes.materia_alta ma ON ma.materia_alta_id = ai.fk_materia_alta
+                JOIN planes.carrera_materia cm2 ON cm2.carrera_materia_id = ma.carrera_materia_id
+                WHERE ai.fk_alumno = %s
+            )
+            ORDER BY m.materia_id, cm.semestre;
+        """, (nc,))
+        plan = [p for p in cur.fetchall()
+                if p["materia_id"] not in aprobadas and p["materia_id"] not in en_curso]
+
+        grafo = grafo_prerrequisitos(cur)
+        mascara = grafo.mascara(aprobadas)
+        elegibles = set(grafo.elegibles(mascara, [p["materia_id"] for p in plan]))
+        for p in plan:
+            p["elegible"] = p["materia_id"] in elegibles
+            p["faltantes"] = [] if p["elegible"] else grafo.faltantes(p["materia_id"], mascara)
+        pendientes = sorted(plan, key=lambda p: (not p["elegible"], p["semestre"], p["clave"]))
 
         cur.close()
         if conn and not conn.closed:
@@ -672,75 +1314,838 @@ def est_perfil_biblioteca():
     except Exception as e:
         if conn and not conn.closed:
             conn.close()
-        flash(f"Error al cargar información de biblioteca: {e}", "danger")
+        flash(f"Error al cargar el kárdex: {e}", "danger")
 
     return render_template(
-        "estudiante/perfil_biblioteca.html",
+        "estudiante/perfil_kardex.html",
         user=user,
-        info_estudiante=info_estudiante,
-        prestamos_activos=prestamos_activos,
-        historial_prestamos=historial_prestamos,
+        info_estudiante=info_estudiante or {},
+        kardex=kardex,
+        materias=materias,
+        pendientes=pendientes,
+        aprobatoria=aprobatoria,
     )
 
 
-@app.route("/estudiante/solicitar-libro", methods=["GET", "POST"])
-@login_required
-@role_required("Estudiante")
-def est_solicitar_libro_modal():
-    user = current_user()
-    resultados = []
-    conn = None
+# =====================================
+# BIBLIOTECA – BÚSQUEDA EN CATÁLOGO
+# =====================================
+#
+# Sobre biblioteca.libros_busqueda (un documento por libro mantenido por
+# triggers): texto completo en español con pesos título > autores > temas >
+# editorial, más similitud trigram para errores de dedo y el ISBN exacto.
+# Los resultados se ordenan por relevancia y se pagina con LIMIT/OFFSET
+# acotado a BUSQUEDA_LIBROS_MAX_PAGINAS.
+
+BUSQUEDA_LIBROS_POR_PAGINA = 20
+BUSQUEDA_LIBROS_MAX_PAGINAS = 25
+_RESALTE_INI, _RESALTE_FIN = "⟦", "⟧"  # ⟦ ⟧: se escapa todo y luego se vuelve <mark>
+
+
+def _resaltar(texto):
+    """Escapa el texto de ts_headline y convierte los delimitadores en <mark>."""
+    if not texto:
+        return texto
+    return Markup(
+        str(escape(texto))
+        .replace(_RESALTE_INI, "<mark>")
+        .replace(_RESALTE_FIN, "</mark>")
+    )
 
-    try:
-        conn = get_connection()
-        nc = _get_numero_control(conn, user["id_usuario"])
-        if not nc:
-            raise Exception("No hay número de control asociado a este usuario.")
 
-        cur = conn.cursor()
+def buscar_libros(cur, q, pagina=1, por_pagina=BUSQUEDA_LIBROS_POR_PAGINA):
+    """
+    Busca en el catálogo. Devuelve (libros, hay_mas); cada libro trae
+    titulo_resaltado / autores_resaltado listos para la plantilla.
+    """
+    q = q.strip()[:200]
+    pagina = max(1, min(pagina, BUSQUEDA_LIBROS_MAX_PAGINAS))
+    digitos = re.sub(r"[\s-]", "", q)
+    isbn = int(digitos) if digitos.isdigit() and len(digitos) <= 13 else None
 
-        if request.method == "POST":
-            id_libro = request.form.get("id_libro")
-            if not id_libro:
-                flash("No se seleccionó un libro válido.", "danger")
-            else:
-                cur.execute("""
-                    INSERT INTO biblioteca.prestamos
-                        (fk_alumno, fk_personal, id_libro,
-                         fecha_prestamo, fecha_devolucion_estimada, estado)
-                    VALUES
-                        (%s, NULL, %s,
-                         NOW(), NOW() + INTERVAL '7 days', 'Activo');
-                """, (nc, int(id_libro)))
-                conn.commit()
-                flash("Solicitud de préstamo registrada correctamente.", "success")
-                cur.close()
-                if conn and not conn.closed:
-                    conn.close()
-                return redirect(url_for("est_perfil_biblioteca"))
+    cur.execute("""
+        WITH consulta AS (
+            SELECT websearch_to_tsquery('spanish', %(q)s) AS tq
+        ),
+        candidatos AS (
+            SELECT
+                b.id_libro,
+                ts_rank_cd(b.documento, c.tq, 32) * 2
+                  + word_similarity(%(q)s, b.texto)
+                  + CASE WHEN b.isbn = %(isbn)s THEN 10 ELSE 0 END AS relevancia
+            FROM biblioteca.libros_busqueda b, consulta c
+            WHERE b.documento @@ c.tq
+               OR %(q)s <%% b.texto
+               OR b.isbn = %(isbn)s
+            ORDER BY relevancia DESC, b.id_libro
+            LIMIT %(limite)s OFFSET %(offset)s
+        )
+        SELECT
+            l.id_libro,
+            l.titulo_libro,
+            b.autores,
+            b.temas,
+            b.editorial                          AS nombre_editorial,
+            b.clasificacion                      AS codigo_clasificacion,
+            l.anio_edicion,
+            l.isbn,
+            COALESCE(inv.cantidad, 0)            AS cantidad,
+            COALESCE(inv.cantidad_disponible, 0) AS cantidad_disponible,
+            ts_headline('spanish', l.titulo_libro, c.tq, %(opciones)s) AS titulo_hl,
+            ts_headline('spanish', COALESCE(b.autores, ''), c.tq, %(opciones)s) AS autores_hl,
+            k.relevancia
+        FROM candidatos k
+        CROSS JOIN consulta c
+        JOIN biblioteca.libros l          ON l.id_libro = k.id_libro
+        JOIN biblioteca.libros_busqueda b ON b.id_libro = k.id_libro
+        LEFT JOIN biblioteca.inventario inv ON inv.id_libro = k.id_libro
+        ORDER BY k.relevancia DESC, k.id_libro;
+    """, {
+        "q": q,
+        "isbn": isbn,
+        "limite": por_pagina + 1,
+        "offset": (pagina - 1) * por_pagina,
+        "opciones": f"StartSel={_RESALTE_INI}, StopSel={_RESALTE_FIN}, HighlightAll=TRUE",
+    })
+    libros = cur.fetchall()
+
+    hay_mas = len(libros) > por_pagina and pagina < BUSQUEDA_LIBROS_MAX_PAGINAS
+    libros = libros[:por_pagina]
+    for l in libros:
+        l["titulo_resaltado"] = _resaltar(l.pop("titulo_hl"))
+        l["autores_resaltado"] = _resaltar(l.pop("autores_hl"))
+    return libros, hay_mas
+
+
+def _pagina_busqueda():
+    try:
+        return max(1, int(request.args.get("p", 1)))
+    except ValueError:
+        return 1
 
-        # GET: búsqueda de libros
-        q = request.args.get("q", "").strip()
-        if q:
-            cur.execute("""
-                SELECT
-                    l.id_libro,
-                    l.titulo_libro                AS titulo,
-                    COALESCE(inv.cantidad_disponible, 0) AS ejemplares_disponibles
-                FROM biblioteca.libros l
-                LEFT JOIN biblioteca.inventario inv
-                  ON inv.id_libro = l.id_libro
-                WHERE LOWER(l.titulo_libro) LIKE LOWER(%s)
-                ORDER BY l.titulo_libro
-                LIMIT 50;
-            """, (f"%{q}%",))
-            resultados = cur.fetchall()
 
+# =====================================
+# BIBLIOTECA – PRÉSTAMOS (CHECKOUT / DEVOLUCIÓN)
+# =====================================
+#
+# El checkout es una sola sentencia: el UPDATE condicional sobre
+# biblioteca.inventario (o sobre la reserva apartada del alumno) y el
+# INSERT del préstamo van en la misma consulta, así que no hace falta
+# ningún candado en la aplicación. El límite de préstamos abiertos por
+# alumno lo aplica el trigger fn_prestamos_activos_alumno (SQLSTATE
+# check_violation). En la devolución el ejemplar pasa primero a la lista
+# de espera (biblioteca.fn_reserva_asignar_ejemplar).
+
+def prestar_libro(conn, id_libro, fk_alumno=None, fk_personal=None, solo_apartado=False):
+    """
+    Registra un préstamo y descuenta un ejemplar; hace commit. Si el alumno
+    tiene el libro apartado se usa ese ejemplar y la reserva queda cumplida.
+    Con solo_apartado no se toma ejemplar del inventario: devuelve None si
+    el apartado ya no existe (p. ej. lo expiró el barrido).
+    Devuelve id_prestamo o lanza ValueError (sin ejemplares / límite).
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            WITH apartado AS (
+                UPDATE biblioteca.reservas
+                SET estado = 'Cumplida',
+                    cerrada_en = NOW()
+                WHERE id_libro = %(id_libro)s
+                  AND fk_alumno = %(fk_alumno)s
+                  AND estado = 'Apartada'
+                RETURNING id_libro
+            ),
+            stock AS (
+                UPDATE biblioteca.inventario
+                SET cantidad_disponible = cantidad_disponible - 1
+                WHERE id_libro = %(id_libro)s
+                  AND cantidad_disponible > 0
+                  AND NOT %(solo_apartado)s
+                  AND NOT EXISTS (SELECT 1 FROM apartado)
+                RETURNING id_libro
+            )
+            INSERT INTO biblioteca.prestamos
+                (fk_alumno, fk_personal, id_libro,
+                 fecha_prestamo, fecha_devolucion_estimada, estado)
+            SELECT
+                %(fk_alumno)s, %(fk_personal)s, s.id_libro,
+                NOW(),
+                NOW() + make_interval(days => COALESCE((
+                    SELECT valor_texto::int
+                    FROM academico.parametros_globales
+                    WHERE clave = 'biblioteca_dias_prestamo'), 7)),
+                'Activo'
+            FROM (SELECT id_libro FROM apartado
+                  UNION ALL
+                  SELECT id_libro FROM stock) s
+            RETURNING id_prestamo;
+        """, {"id_libro": id_libro, "fk_alumno": fk_alumno, "fk_personal": fk_personal,
+              "solo_apartado": solo_apartado})
+        row = cur.fetchone()
+        if not row:
+            conn.rollback()
+            if solo_apartado:
+                return None
+            raise ValueError("No hay ejemplares disponibles de este libro.")
+        conn.commit()
+        return row["id_prestamo"]
+    except psycopg2.errors.CheckViolation as e:
+        conn.rollback()
+        raise ValueError(e.diag.message_primary) from None
+    finally:
         cur.close()
-        if conn and not conn.closed:
-            conn.close()
 
-    except Exception as e:
+
+def devolver_prestamo(conn, id_prestamo):
+    """
+    Marca el préstamo como devuelto y entrega el ejemplar a la siguiente
+    reserva en espera (o lo repone en inventario); hace commit.
+    Devuelve False si el préstamo no existía o ya estaba devuelto.
+    """
+    cur = conn.cursor()
+    try:
+        # Inventario primero, como prestar_libro: los triggers del UPDATE
+        # bloquean los contadores de 4.q y tomar el inventario después
+        # (en fn_reserva_asignar_ejemplar) invertiría el orden de bloqueo.
+        cur.execute("""
+            SELECT i.id_libro
+            FROM biblioteca.prestamos p
+            JOIN biblioteca.inventario i ON i.id_libro = p.id_libro
+            WHERE p.id_prestamo = %s
+              AND p.estado IN ('Activo', 'Vencido')
+            FOR UPDATE OF i;
+        """, (id_prestamo,))
+        cur.execute("""
+            UPDATE biblioteca.prestamos
+            SET estado = 'Devuelto',
+                fecha_devolucion_real = NOW()
+            WHERE id_prestamo = %s
+              AND estado IN ('Activo', 'Vencido')
+            RETURNING id_libro;
+        """, (id_prestamo,))
+        dev = cur.fetchone()
+        if dev:
+            cur.execute("SELECT biblioteca.fn_reserva_asignar_ejemplar(%s);",
+                        (dev["id_libro"],))
+        conn.commit()
+        return dev is not None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+# =====================================
+# BIBLIOTECA – RESERVAS (LISTA DE ESPERA)
+# =====================================
+#
+# Solo se reserva un libro sin ejemplares libres. La asignación del
+# ejemplar devuelto y la liberación de apartados vencidos viven en SQL
+# (fn_reserva_asignar_ejemplar / fn_reservas_liberar) para que todas las
+# rutas tomen la cabeza de la cola igual: FOR UPDATE sobre la primera en
+# espera (sin SKIP LOCKED, para no saltarse a nadie). El alumno recoge su
+# apartado con recoger_reserva, que lo convierte en préstamo.
+
+RESERVAS_LOTE = int(os.getenv("RESERVAS_LOTE", "500"))
+
+
+def reservar_libro(conn, id_libro, fk_alumno):
+    """Forma al alumno en la cola del libro; hace commit. Lanza ValueError."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO biblioteca.reservas (id_libro, fk_alumno)
+            SELECT i.id_libro, %(fk_alumno)s
+            FROM biblioteca.inventario i
+            WHERE i.id_libro = %(id_libro)s
+              AND i.cantidad_disponible = 0
+            ON CONFLICT (id_libro, fk_alumno) WHERE estado IN ('En espera', 'Apartada')
+            DO NOTHING
+            RETURNING id_reserva;
+        """, {"id_libro": id_libro, "fk_alumno": fk_alumno})
+        row = cur.fetchone()
+        if not row:
+            conn.rollback()
+            raise ValueError("Ya tienes una reserva de este libro o hay ejemplares "
+                             "disponibles para préstamo.")
+        conn.commit()
+        return row["id_reserva"]
+    finally:
+        cur.close()
+
+
+def cancelar_reserva(conn, id_reserva, fk_alumno):
+    """
+    Cancela una reserva abierta del alumno; si ya estaba apartada el
+    ejemplar pasa al siguiente de la cola. Hace commit; devuelve bool.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            WITH actual AS (
+                SELECT id_reserva, id_libro, estado
+                FROM biblioteca.reservas
+                WHERE id_reserva = %s
+                  AND fk_alumno = %s
+                  AND estado IN ('En espera', 'Apartada')
+                FOR UPDATE
+            )
+            UPDATE biblioteca.reservas r
+            SET estado = 'Cancelada',
+                cerrada_en = NOW()
+            FROM actual a
+            WHERE r.id_reserva = a.id_reserva
+            RETURNING a.id_libro, a.estado AS estado_anterior;
+        """, (id_reserva, fk_alumno))
+        row = cur.fetchone()
+        if row and row["estado_anterior"] == "Apartada":
+            cur.execute("SELECT biblioteca.fn_reserva_asignar_ejemplar(%s);",
+                        (row["id_libro"],))
+        conn.commit()
+        return row is not None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def recoger_reserva(conn, id_reserva, fk_alumno):
+    """
+    Convierte la reserva apartada del alumno en préstamo: prestar_libro usa
+    el ejemplar apartado y marca la reserva 'Cumplida' en la misma sentencia.
+    Devuelve id_prestamo, o None si la reserva ya no está apartada.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id_libro
+            FROM biblioteca.reservas
+            WHERE id_reserva = %s
+              AND fk_alumno = %s
+              AND estado = 'Apartada';
+        """, (id_reserva, fk_alumno))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    conn.rollback()
+    if not row:
+        return None
+    return prestar_libro(conn, row["id_libro"], fk_alumno=fk_alumno, solo_apartado=True)
+
+
+def liberar_reservas(conn, lote=RESERVAS_LOTE):
+    """Expira apartados vencidos en lotes (cada uno en su transacción)."""
+    total = 0
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute("SELECT biblioteca.fn_reservas_liberar(%s) AS n;", (lote,))
+            n = cur.fetchone()["n"]
+            conn.commit()
+            total += n
+            if n < lote:
+                return total
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _reservas_alumno(cur, fk_alumno):
+    """
+    Reservas abiertas del alumno con su lugar en la cola. La posición sale
+    de un rango sobre idx_reservas_cola (id_libro, id_reserva) limitado a
+    las reservas en espera delante de la suya.
+    """
+    cur.execute("""
+        SELECT
+            r.id_reserva,
+            r.id_libro,
+            l.titulo_libro,
+            r.estado,
+            r.creada_en,
+            r.expira_en,
+            pos.posicion
+        FROM biblioteca.reservas r
+        JOIN biblioteca.libros l ON l.id_libro = r.id_libro
+        LEFT JOIN LATERAL (
+            SELECT COUNT(*) AS posicion
+            FROM biblioteca.reservas q
+            WHERE q.id_libro = r.id_libro
+              AND q.estado = 'En espera'
+              AND q.id_reserva <= r.id_reserva
+        ) pos ON r.estado = 'En espera'
+        WHERE r.fk_alumno = %s
+          AND r.estado IN ('En espera', 'Apartada')
+        ORDER BY r.estado = 'Apartada' DESC, r.id_reserva;
+    """, (fk_alumno,))
+    return cur.fetchall()
+
+
+# =====================================
+# BIBLIOTECA – RECOMENDACIONES
+# =====================================
+#
+# "Quienes pidieron este libro también pidieron". La matriz alumno x libro
+# y el top-K por libro se calculan fuera de línea en SQL (ver
+# fn_recomendaciones_*); aquí solo se lee biblioteca.recomendaciones por
+# su llave primaria (id_libro, rango).
+
+RECOMENDACIONES_K = 10
+RECOMENDACIONES_ALUMNO = 6
+
+
+def recomendaciones_libro(cur, id_libro, limite=RECOMENDACIONES_K):
+    cur.execute("""
+        SELECT
+            l.id_libro,
+            l.titulo_libro,
+            r.puntaje,
+            r.alumnos_en_comun,
+            r.temas_en_comun,
+            i.cantidad_disponible
+        FROM biblioteca.recomendaciones r
+        JOIN biblioteca.libros l ON l.id_libro = r.id_recomendado
+        LEFT JOIN biblioteca.inventario i ON i.id_libro = r.id_recomendado
+        WHERE r.id_libro = %s
+          AND r.rango <= %s
+        ORDER BY r.rango;
+    """, (id_libro, limite))
+    return cur.fetchall()
+
+
+def recomendaciones_alumno(cur, fk_alumno, limite=RECOMENDACIONES_ALUMNO):
+    """Vecinos de los últimos libros que pidió el alumno, sin los ya leídos."""
+    cur.execute("""
+        SELECT
+            l.id_libro,
+            l.titulo_libro,
+            i.cantidad_disponible,
+            MAX(r.puntaje) AS puntaje
+        FROM (
+            SELECT id_libro
+            FROM biblioteca.prestamos
+            WHERE fk_alumno = %(alumno)s
+            ORDER BY fecha_prestamo DESC
+            LIMIT 3
+        ) ult
+        JOIN biblioteca.recomendaciones r ON r.id_libro = ult.id_libro
+        JOIN biblioteca.libros l ON l.id_libro = r.id_recomendado
+        LEFT JOIN biblioteca.inventario i ON i.id_libro = r.id_recomendado
+        WHERE NOT EXISTS (
+            SELECT 1 FROM biblioteca.alumno_libro al
+            WHERE al.fk_alumno = %(alumno)s
+              AND al.id_libro = r.id_recomendado
+        )
+        GROUP BY l.id_libro, l.titulo_libro, i.cantidad_disponible
+        ORDER BY puntaje DESC
+        LIMIT %(limite)s;
+    """, {"alumno": fk_alumno, "limite": limite})
+    return cur.fetchall()
+
+
+def actualizar_recomendaciones(conn, completo=False, k=RECOMENDACIONES_K):
+    """Incorpora préstamos nuevos (o reconstruye todo); devuelve libros recalculados."""
+    funcion = ("biblioteca.fn_recomendaciones_reconstruir" if completo
+               else "biblioteca.fn_recomendaciones_actualizar")
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT {funcion}(%s) AS libros;", (k,))
+        libros = cur.fetchone()["libros"]
+        conn.commit()
+        return libros
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+# =====================================
+# BIBLIOTECA – BARRIDO DE PRÉSTAMOS VENCIDOS
+# =====================================
+#
+# Dos fases, cada una en lotes acotados y con FOR UPDATE SKIP LOCKED para
+# que varios workers (cron en más de un servidor) no se pisen:
+#   1. Marca 'Activo' -> 'Vencido' usando idx_prestamos_estado_fecha_estimada
+#      y, en la misma transacción, crea/reabre un resumen por alumno y día
+#      en academico.notificaciones_alumno (UNIQUE fk_alumno, clave).
+#   2. Toma los resúmenes con pendiente_envio, arma el mensaje con TODOS
+#      los préstamos vencidos del alumno y lo encola en la cola de correos.
+# Repetir el barrido no duplica nada: un préstamo solo se marca una vez y
+# un resumen ya enviado solo se reenvía si ese día se vencieron más libros.
+
+VENCIDOS_LOTE = int(os.getenv("VENCIDOS_LOTE", "500"))
+VENCIDOS_AVISOS_LOTE = 200
+
+
+def marcar_prestamos_vencidos(conn, lote=VENCIDOS_LOTE):
+    """Marca como 'Vencido' los préstamos activos fuera de plazo. Devuelve cuántos."""
+    total = 0
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute("""
+                WITH lote AS (
+                    SELECT id_prestamo
+                    FROM biblioteca.prestamos
+                    WHERE estado = 'Activo'
+                      AND fecha_devolucion_estimada < NOW()
+                    ORDER BY fecha_devolucion_estimada
+                    LIMIT %(lote)s
+                    FOR UPDATE SKIP LOCKED
+                ),
+                marcados AS (
+                    UPDATE biblioteca.prestamos p
+                    SET estado = 'Vencido'
+                    FROM lote
+                    WHERE p.id_prestamo = lote.id_prestamo
+                    RETURNING p.fk_alumno
+                ),
+                resumenes AS (
+                    INSERT INTO academico.notificaciones_alumno AS n
+                        (fk_alumno, origen, clave, titulo, pendiente_envio)
+                    SELECT DISTINCT fk_alumno, 'biblioteca',
+                           'biblioteca-vencidos:' || CURRENT_DATE,
+                           'Préstamos vencidos en biblioteca', TRUE
+                    FROM marcados
+                    WHERE fk_alumno IS NOT NULL
+                    ORDER BY 1
+                    ON CONFLICT (fk_alumno, clave) DO UPDATE
+                    SET pendiente_envio = TRUE
+                )
+                SELECT COUNT(*) AS marcados FROM marcados;
+            """, {"lote": lote})
+            n = cur.fetchone()["marcados"]
+            conn.commit()
+            total += n
+            if n < lote:
+                return total
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def enviar_avisos_vencidos(conn, lote=VENCIDOS_AVISOS_LOTE):
+    """
+    Completa y encola los resúmenes pendientes (un correo por alumno).
+    Devuelve cuántas notificaciones se procesaron.
+    """
+    total = 0
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute("""
+                WITH pendientes AS (
+                    SELECT id_notificacion, fk_alumno
+                    FROM academico.notificaciones_alumno
+                    WHERE pendiente_envio
+                      AND origen = 'biblioteca'
+                    ORDER BY id_notificacion
+                    LIMIT %(lote)s
+                    FOR UPDATE SKIP LOCKED
+                ),
+                detalle AS (
+                    SELECT
+                        pe.id_notificacion,
+                        COUNT(p.id_prestamo) AS vencidos,
+                        string_agg(
+                            '- ' || l.titulo_libro || ' (vencía el '
+                                 || to_char(p.fecha_devolucion_estimada, 'DD/MM/YYYY') || ')',
+                            E'\\n' ORDER BY p.fecha_devolucion_estimada
+                        ) AS lista,
+                        COALESCE(MAX(cto.correo_institucional), MAX(cto.correo_personal),
+                                 MAX(u.correo_electronico)) AS correo
+                    FROM pendientes pe
+                    LEFT JOIN biblioteca.prestamos p
+                           ON p.fk_alumno = pe.fk_alumno AND p.estado = 'Vencido'
+                    LEFT JOIN biblioteca.libros l ON l.id_libro = p.id_libro
+                    LEFT JOIN academico.vw_contacto_actual cto
+                           ON cto.numero_control = pe.fk_alumno
+                    LEFT JOIN seguridad.auth_user_alumno aua
+                           ON aua.numero_control = pe.fk_alumno
+                    LEFT JOIN seguridad.usuarios u ON u.id_usuario = aua.user_id
+                    GROUP BY pe.id_notificacion
+                )
+                UPDATE academico.notificaciones_alumno n
+                SET mensaje = CASE
+                        WHEN d.vencidos = 0 THEN 'Tus préstamos vencidos ya fueron devueltos.'
+                        ELSE 'Tienes ' || d.vencidos || ' préstamo(s) vencido(s):' || E'\\n'
+                             || d.lista || E'\\n\\n'
+                             || 'Devuélvelos en la biblioteca lo antes posible.'
+                    END,
+                    pendiente_envio = FALSE,
+                    leida = FALSE,
+                    enviada_en = CASE WHEN d.vencidos > 0 THEN NOW() ELSE n.enviada_en END
+                FROM detalle d
+                WHERE n.id_notificacion = d.id_notificacion
+                RETURNING n.titulo, n.mensaje, d.vencidos, d.correo;
+            """, {"lote": lote})
+            avisos = cur.fetchall()
+            enqueue_emails(conn, [
+                (a["correo"], a["titulo"], a["mensaje"])
+                for a in avisos
+                if a["vencidos"] > 0 and a["correo"]
+            ])
+            conn.commit()
+            total += len(avisos)
+            if len(avisos) < lote:
+                break
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    if total:
+        wake_mail_workers()
+    return total
+
+
+def barrer_prestamos_vencidos(conn, lote=VENCIDOS_LOTE):
+    """Barrido completo: marca, avisa y recalcula el contador de retrasados."""
+    marcados = marcar_prestamos_vencidos(conn, lote)
+    avisos = enviar_avisos_vencidos(conn)
+    cur = conn.cursor()
+    cur.execute("SELECT biblioteca.fn_resumen_biblioteca_retrasados() AS retrasados;")
+    retrasados = cur.fetchone()["retrasados"]
+    conn.commit()
+    cur.close()
+    return {"marcados": marcados, "avisos": avisos, "retrasados": retrasados}
+
+
+# =====================================
+# ESTUDIANTE – BIBLIOTECA
+# =====================================
+
+@app.route("/estudiante/biblioteca")
+@login_required
+@role_required("Estudiante")
+def est_perfil_biblioteca():
+    user = current_user()
+    prestamos_activos = []
+    historial_prestamos = []
+    reservas = []
+    recomendaciones = []
+    info_estudiante = None
+
+    conn = None
+    try:
+        conn = get_connection()
+        nc = _get_numero_control(conn, user["id_usuario"])
+        if not nc:
+            raise Exception("No hay número de control asociado a este usuario.")
+
+        cur = conn.cursor()
+
+        # ---- Info estudiante para el encabezado ----
+        cur.execute("""
+            SELECT
+                a.numero_control AS matricula,
+                TRIM(
+                    a.nombre || ' ' ||
+                    a.apellido_paterno || ' ' ||
+                    COALESCE(a.apellido_materno, '')
+                ) AS nombre_completo,
+                a.curp,
+                COALESCE(cto.correo_institucional, cto.correo_personal) AS correo,
+                cto.telefono,
+                plan_info.carrera_nombre,
+                plan_info.semestre,
+                plan_info.tutor_nombre,
+                plan_info.tutor_correo
+            FROM academico.alumnos a
+            LEFT JOIN academico.vw_contacto_actual cto
+              ON cto.numero_control = a.numero_control
+            LEFT JOIN LATERAL (
+                SELECT
+                    c.nombre AS carrera_nombre,
+                    cm.semestre,
+                    TRIM(
+                        COALESCE(p.nombre,'') || ' ' ||
+                        COALESCE(p.apellido_paterno,'') || ' ' ||
+                        COALESCE(p.apellido_materno,'')
+                    ) AS tutor_nombre,
+                    p.correo_institucional AS tutor_correo
+                FROM academico.alumno_inscripcion ai
+                JOIN planes.materia_alta ma ON ma.materia_alta_id = ai.fk_materia_alta
+                JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+                JOIN planes.carrera c ON c.carrera_id = cm.carrera_id
+                LEFT JOIN rrhh.personal p ON p.id_personal = ma.fk_personal
+                WHERE ai.fk_alumno = a.numero_control
+                ORDER BY cm.semestre DESC, ma.materia_alta_id DESC
+                LIMIT 1
+            ) AS plan_info ON TRUE
+            WHERE a.numero_control = %s
+            LIMIT 1;
+        """, (nc,))
+        info_estudiante = cur.fetchone()
+
+        # ---- Préstamos activos ----
+        cur.execute("""
+            SELECT
+                p.id_prestamo,
+                l.titulo_libro                 AS titulo_libro,
+                p.fecha_prestamo,
+                p.fecha_devolucion_estimada    AS fecha_limite,
+                p.fecha_devolucion_real,
+                p.estado
+            FROM biblioteca.prestamos p
+            JOIN biblioteca.libros l ON l.id_libro = p.id_libro
+            WHERE p.fk_alumno = %s
+              AND p.estado <> 'Devuelto'
+            ORDER BY p.fecha_prestamo DESC;
+        """, (nc,))
+        prestamos_activos = cur.fetchall()
+
+        # ---- Historial (devueltos) ----
+        cur.execute("""
+            SELECT
+                p.id_prestamo,
+                l.titulo_libro                 AS titulo_libro,
+                p.fecha_prestamo,
+                p.fecha_devolucion_real        AS fecha_devolucion,
+                p.estado
+            FROM biblioteca.prestamos p
+            JOIN biblioteca.libros l ON l.id_libro = p.id_libro
+            WHERE p.fk_alumno = %s
+              AND p.estado = 'Devuelto'
+            ORDER BY p.fecha_devolucion_real DESC NULLS LAST;
+        """, (nc,))
+        historial_prestamos = cur.fetchall()
+
+        # ---- Reservas abiertas (lista de espera) ----
+        reservas = _reservas_alumno(cur, nc)
+        recomendaciones = recomendaciones_alumno(cur, nc)
+
+        cur.close()
+        if conn and not conn.closed:
+            conn.close()
+
+    except Exception as e:
+        if conn and not conn.closed:
+            conn.close()
+        flash(f"Error al cargar información de biblioteca: {e}", "danger")
+
+    return render_template(
+        "estudiante/perfil_biblioteca.html",
+        user=user,
+        info_estudiante=info_estudiante,
+        prestamos_activos=prestamos_activos,
+        historial_prestamos=historial_prestamos,
+        reservas=reservas,
+        recomendaciones=recomendaciones,
+    )
+
+
+@app.route("/estudiante/biblioteca/reserva/<int:id_reserva>/cancelar", methods=["POST"])
+@login_required
+@role_required("Estudiante")
+def est_cancelar_reserva(id_reserva):
+    user = current_user()
+    conn = None
+    try:
+        conn = get_connection()
+        nc = _get_numero_control(conn, user["id_usuario"])
+        if nc and cancelar_reserva(conn, id_reserva, nc):
+            flash("Reserva cancelada.", "success")
+        else:
+            flash("La reserva no existe o ya fue cerrada.", "warning")
+    except Exception as e:
+        flash(f"Error al cancelar la reserva: {e}", "danger")
+    finally:
+        if conn:
+            conn.close()
+    return redirect(url_for("est_perfil_biblioteca"))
+
+
+@app.route("/estudiante/biblioteca/reserva/<int:id_reserva>/recoger", methods=["POST"])
+@login_required
+@role_required("Estudiante")
+def est_recoger_reserva(id_reserva):
+    user = current_user()
+    conn = None
+    try:
+        conn = get_connection()
+        nc = _get_numero_control(conn, user["id_usuario"])
+        if nc and recoger_reserva(conn, id_reserva, nc):
+            flash("Préstamo registrado con el ejemplar apartado.", "success")
+        else:
+            flash("La reserva ya no está apartada a tu nombre.", "warning")
+    except ValueError as e:
+        flash(str(e), "warning")
+    except Exception as e:
+        flash(f"Error al recoger la reserva: {e}", "danger")
+    finally:
+        if conn:
+            conn.close()
+    return redirect(url_for("est_perfil_biblioteca"))
+
+
+@app.route("/estudiante/solicitar-libro", methods=["GET", "POST"])
+@login_required
+@role_required("Estudiante")
+def est_solicitar_libro_modal():
+    user = current_user()
+    resultados = []
+    pagina = _pagina_busqueda()
+    hay_mas = False
+    conn = None
+
+    try:
+        conn = get_connection()
+        nc = _get_numero_control(conn, user["id_usuario"])
+        if not nc:
+            raise Exception("No hay número de control asociado a este usuario.")
+
+        cur = conn.cursor()
+
+        if request.method == "POST":
+            id_libro = request.form.get("id_libro")
+            reservar = request.form.get("accion") == "reservar"
+            if not id_libro:
+                flash("No se seleccionó un libro válido.", "danger")
+            else:
+                try:
+                    if reservar:
+                        reservar_libro(conn, int(id_libro), nc)
+                    else:
+                        prestar_libro(conn, int(id_libro), fk_alumno=nc)
+                except ValueError as e_prest:
+                    flash(str(e_prest), "warning")
+                else:
+                    if reservar:
+                        flash("Reserva registrada. Te avisaremos cuando el libro "
+                              "esté apartado para ti.", "success")
+                    else:
+                        flash("Solicitud de préstamo registrada correctamente.", "success")
+                    cur.close()
+                    if conn and not conn.closed:
+                        conn.close()
+                    return redirect(url_for("est_perfil_biblioteca"))
+
+        # GET: búsqueda de libros
+        q = request.args.get("q", "").strip()
+        if q:
+            resultados, hay_mas = buscar_libros(cur, q, pagina)
+            apartados = {a["id_libro"]: a["id_reserva"]
+                         for a in _reservas_alumno(cur, nc) if a["estado"] == "Apartada"}
+            for r in resultados:
+                r["id_reserva_apartada"] = apartados.get(r["id_libro"])
+                r["titulo"] = r["titulo_resaltado"]
+                r["autor"] = r["autores_resaltado"]
+                r["ejemplares_disponibles"] = r["cantidad_disponible"]
+
+        cur.close()
+        if conn and not conn.closed:
+            conn.close()
+
+    except Exception as e:
         if conn and not conn.closed:
             conn.close()
         flash(f"Error al procesar solicitud de libro: {e}", "danger")
@@ -749,6 +2154,8 @@ def est_solicitar_libro_modal():
         "estudiante/solicitar_libro_modal.html",
         user=user,
         resultados=resultados,
+        pagina=pagina,
+        hay_mas=hay_mas,
     )
 
 
@@ -897,7 +2304,48 @@ def est_perfil_administrativo():
 @login_required
 @role_required("Estudiante")
 def est_notificaciones_all():
-    return render_template("estudiante/notificaciones_all.html", user=current_user())
+    user = current_user()
+    notificaciones = []
+
+    conn = None
+    try:
+        conn = get_connection()
+        nc = _get_numero_control(conn, user["id_usuario"])
+        if not nc:
+            raise Exception("No hay número de control asociado a este usuario.")
+
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id_notificacion, titulo, mensaje, leida, fecha_creacion
+            FROM academico.notificaciones_alumno
+            WHERE fk_alumno = %s
+              AND NOT pendiente_envio
+            ORDER BY fecha_creacion DESC
+            LIMIT 100;
+        """, (nc,))
+        notificaciones = cur.fetchall()
+
+        # Se muestran como "Nueva" esta vez y quedan leídas para la siguiente.
+        no_leidas = [n["id_notificacion"] for n in notificaciones if not n["leida"]]
+        if no_leidas:
+            cur.execute("""
+                UPDATE academico.notificaciones_alumno
+                SET leida = TRUE
+                WHERE id_notificacion = ANY(%s);
+            """, (no_leidas,))
+            conn.commit()
+        cur.close()
+    except Exception as e:
+        flash(f"Error cargando notificaciones: {e}", "danger")
+    finally:
+        if conn:
+            conn.close()
+
+    return render_template(
+        "estudiante/notificaciones_all.html",
+        user=user,
+        notificaciones=notificaciones
+    )
 
 
 # =====================================
@@ -955,46 +2403,21 @@ def perfil_docente():
 
         cur = conn.cursor()
 
-        # --------- Resumen global ----------
+        # --------- Resumen global y por ciclo ----------
+        # Precalculado por triggers en rrhh.docente_carga (ciclo '*' = total)
         cur.execute("""
-            SELECT
-                COUNT(DISTINCT m.materia_id)       AS total_materias,
-                COUNT(DISTINCT ma.materia_alta_id) AS total_grupos,
-                COUNT(DISTINCT ai.fk_alumno)       AS total_alumnos
-            FROM planes.materia_alta ma
-            JOIN planes.carrera_materia cm
-              ON cm.carrera_materia_id = ma.carrera_materia_id
-            JOIN planes.materia m
-              ON m.materia_id = cm.materia_id
-            LEFT JOIN academico.alumno_inscripcion ai
-              ON ai.fk_materia_alta = ma.materia_alta_id
-            WHERE ma.fk_personal = %s;
+            SELECT ciclo, materias, grupos, alumnos, inscripciones
+            FROM rrhh.docente_carga
+            WHERE fk_personal = %s
+            ORDER BY ciclo DESC;
         """, (personal_id,))
-        row = cur.fetchone()
-        if row:
-            resumen["total_materias"] = row["total_materias"] or 0
-            resumen["total_grupos"] = row["total_grupos"] or 0
-            resumen["total_alumnos"] = row["total_alumnos"] or 0
-
-        # --------- Resumen por ciclo ----------
-        cur.execute("""
-            SELECT
-                ma.ciclo,
-                COUNT(DISTINCT m.materia_id)       AS materias,
-                COUNT(DISTINCT ma.materia_alta_id) AS grupos,
-                COUNT(DISTINCT ai.fk_alumno)       AS alumnos
-            FROM planes.materia_alta ma
-            JOIN planes.carrera_materia cm
-              ON cm.carrera_materia_id = ma.carrera_materia_id
-            JOIN planes.materia m
-              ON m.materia_id = cm.materia_id
-            LEFT JOIN academico.alumno_inscripcion ai
-              ON ai.fk_materia_alta = ma.materia_alta_id
-            WHERE ma.fk_personal = %s
-            GROUP BY ma.ciclo
-            ORDER BY ma.ciclo DESC;
-        """, (personal_id,))
-        resumen_ciclo = cur.fetchall()
+        for row in cur.fetchall():
+            if row["ciclo"] == "*":
+                resumen["total_materias"] = row["materias"]
+                resumen["total_grupos"] = row["grupos"]
+                resumen["total_alumnos"] = row["alumnos"]
+            else:
+                resumen_ciclo.append(row)
 
         cur.close()
         conn.close()
@@ -1039,7 +2462,7 @@ def docente_grupos_materias():
                 m.clave  AS materia_clave,
                 m.nombre AS materia_nombre,
                 cm.semestre,
-                COUNT(ai.inscripcion_id) AS num_alumnos
+                COALESCE(i.inscritos, 0) AS num_alumnos
             FROM planes.materia_alta ma
             JOIN planes.carrera_materia cm
               ON cm.carrera_materia_id = ma.carrera_materia_id
@@ -1047,14 +2470,9 @@ def docente_grupos_materias():
               ON c.carrera_id = cm.carrera_id
             JOIN planes.materia m
               ON m.materia_id = cm.materia_id
-            LEFT JOIN academico.alumno_inscripcion ai
-              ON ai.fk_materia_alta = ma.materia_alta_id
+            LEFT JOIN planes.materia_alta_inscritos i
+              ON i.materia_alta_id = ma.materia_alta_id
             WHERE ma.fk_personal = %s
-            GROUP BY
-                ma.materia_alta_id, ma.ciclo,
-                c.clave, c.nombre,
-                m.clave, m.nombre,
-                cm.semestre
             ORDER BY ma.ciclo, cm.semestre, m.clave;
         """, (personal_id,))
         grupos = cur.fetchall()
@@ -1075,6 +2493,111 @@ def docente_grupos_materias():
 # =====================================
 # DOCENTE – EVALUACIONES
 # =====================================
+#
+# La hoja de calificaciones envía el grupo completo en un solo POST: se
+# validan solo las filas que cambiaron, la pertenencia de la materia al
+# docente se revisa una vez y todo se escribe con un UPDATE ... FROM
+# unnest(). Las filas con error se regresan con lo que se capturó.
+
+def _leer_calificacion(texto):
+    """Texto del formulario -> Decimal con 2 decimales o None (vacío)."""
+    texto = (texto or "").strip().replace(",", ".")
+    if texto == "":
+        return None
+    try:
+        valor = Decimal(texto)
+        if valor.is_finite():
+            valor = valor.quantize(Decimal("0.01"))
+    except InvalidOperation:
+        raise ValueError("no es un número")
+    if not valor.is_finite() or valor < 0 or valor > 100:
+        raise ValueError("debe estar entre 0 y 100")
+    return valor
+
+
+def guardar_calificaciones(conn, personal_id, materia_alta_id, filas):
+    """
+    Guarda las calificaciones de la hoja de un grupo.
+
+    `filas` son tuplas (inscripcion_id, original, capturada) con los textos
+    del formulario. Solo se escriben las que cambiaron y únicamente si la
+    calificación en BD sigue siendo la que vio el docente (otra sesión
+    pudo modificarla). Devuelve (guardadas, errores) con
+    errores = {inscripcion_id: mensaje}.
+    """
+    errores = {}
+    ids, valores, originales = [], [], []
+    for inscripcion_id, original, capturada in filas:
+        try:
+            valor = _leer_calificacion(capturada)
+            anterior = _leer_calificacion(original)
+        except ValueError as e:
+            errores[inscripcion_id] = f"Calificación inválida: {e}."
+            continue
+        if valor != anterior:
+            ids.append(inscripcion_id)
+            valores.append(valor)
+            originales.append(anterior)
+
+    if not ids:
+        return [], errores
+
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT 1
+            FROM planes.materia_alta
+            WHERE materia_alta_id = %s
+              AND fk_personal = %s
+            FOR SHARE;
+        """, (materia_alta_id, personal_id))
+        if cur.fetchone() is None:
+            raise ValueError("La materia no está asignada a este docente.")
+
+        cur.execute("""
+            UPDATE academico.alumno_inscripcion ai
+            SET calificacion = v.calificacion
+            FROM unnest(%s::bigint[], %s::numeric[], %s::numeric[])
+                 AS v(inscripcion_id, calificacion, original)
+            WHERE ai.inscripcion_id = v.inscripcion_id
+              AND ai.fk_materia_alta = %s
+              AND ai.calificacion IS NOT DISTINCT FROM v.original
+            RETURNING ai.inscripcion_id, ai.fk_alumno, ai.calificacion;
+        """, (ids, valores, originales, materia_alta_id))
+        guardadas = cur.fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    escritas = {g["inscripcion_id"] for g in guardadas}
+    for inscripcion_id in ids:
+        if inscripcion_id not in escritas:
+            errores[inscripcion_id] = (
+                "No se guardó: la calificación cambió mientras editabas "
+                "o la inscripción no pertenece a este grupo."
+            )
+
+    if guardadas:
+        audit_event(
+            "calificacion",
+            "Calificaciones modificadas por docente",
+            {
+                "materia_alta_id": int(materia_alta_id),
+                "calificaciones": [
+                    {
+                        "inscripcion_id": g["inscripcion_id"],
+                        "alumno": g["fk_alumno"],
+                        "calificacion": None if g["calificacion"] is None else float(g["calificacion"]),
+                    }
+                    for g in guardadas
+                ],
+            },
+        )
+    return guardadas, errores
+
 
 @app.route("/docente/evaluaciones", methods=["GET", "POST"])
 @login_required
@@ -1083,6 +2606,8 @@ def docente_evaluaciones():
     user = current_user()
     calificaciones = []
     materia_alta_id = request.args.get("materia_alta_id")
+    errores = {}
+    capturadas = {}
 
     try:
         conn = get_connection()
@@ -1092,28 +2617,31 @@ def docente_evaluaciones():
 
         cur = conn.cursor()
 
-        # --- Si POST: actualizar calificación ---
+        # --- Si POST: guardar la hoja completa del grupo ---
         if request.method == "POST":
-            inscripcion_id = request.form.get("inscripcion_id")
-            nueva_calif = request.form.get("calificacion")
-
+            materia_alta_id = request.form.get("materia_alta_id") or materia_alta_id
             try:
-                nueva_val = None if nueva_calif == "" else float(nueva_calif)
-                cur.execute("""
-                    UPDATE academico.alumno_inscripcion ai
-                    SET calificacion = %s
-                    WHERE ai.inscripcion_id = %s
-                      AND ai.fk_materia_alta IN (
-                          SELECT ma.materia_alta_id
-                          FROM planes.materia_alta ma
-                          WHERE ma.fk_personal = %s
-                      );
-                """, (nueva_val, inscripcion_id, personal_id))
-                conn.commit()
-                flash("Calificación actualizada.", "success")
+                ids = [int(i) for i in request.form.getlist("inscripcion_id")]
+                originales = request.form.getlist("original")
+                valores = request.form.getlist("calificacion")
+                if not (len(ids) == len(originales) == len(valores)):
+                    raise ValueError("El formulario llegó incompleto.")
+                capturadas = dict(zip(ids, valores))
+
+                guardadas, errores = guardar_calificaciones(
+                    conn, personal_id, int(materia_alta_id), list(zip(ids, originales, valores))
+                )
+                if not errores:
+                    flash(f"Calificaciones guardadas: {len(guardadas)}.", "success")
+                    conn.close()
+                    return redirect(url_for("docente_evaluaciones", materia_alta_id=materia_alta_id))
+                flash(
+                    f"Se guardaron {len(guardadas)} calificaciones; "
+                    f"{len(errores)} filas tienen errores y no se guardaron.",
+                    "warning",
+                )
             except Exception as e_upd:
-                conn.rollback()
-                flash(f"Error al actualizar calificación: {e_upd}", "danger")
+                flash(f"Error al guardar calificaciones: {e_upd}", "danger")
 
         # --- Materia seleccionada (o primera del docente) ---
         if not materia_alta_id:
@@ -1181,21 +2709,402 @@ def docente_evaluaciones():
         user=user,
         calificaciones=calificaciones,
         materias_docente=materias_docente,
-        materia_alta_id=materia_alta_id
+        materia_alta_id=materia_alta_id,
+        errores=errores,
+        capturadas=capturadas,
     )
 
 
-# =====================================
-# DOCENTE – ASISTENCIAS (VISTA SIMPLE)
-# =====================================
+# =====================================
+# DOCENTE – IMPORTACIÓN DE CALIFICACIONES (CSV)
+# =====================================
+#
+# Columnas: numero_control y calificacion, para una materia_alta del
+# docente. Las filas con calificación vacía se ignoran. El archivo se lee
+# en streaming y se carga con COPY por bloques de IMPORT_CHUNK filas a una
+# tabla temporal; el cruce con las inscripciones del grupo, la detección
+# de repetidos y la escritura son consultas set-based. La simulación
+# muestra el diff (anterior -> nueva) y hace rollback.
+
+CALIFICACIONES_COLUMNAS_REQUERIDAS = ("numero_control", "calificacion")
+
+
+def _cargar_bloque_calificaciones(cur, bloque):
+    buf = io.StringIO()
+    escritor = csv.writer(buf)
+    for linea, numero_control, calificacion in bloque:
+        escritor.writerow([linea, numero_control, calificacion])
+    buf.seek(0)
+    cur.copy_expert("""
+        COPY stg_calificaciones (linea, numero_control, calificacion)
+        FROM STDIN WITH (FORMAT csv)
+    """, buf)
+
+
+def importar_calificaciones_csv(stream, personal_id, materia_alta_id, dry_run=False, actor_id=None):
+    """
+    Importa calificaciones de un grupo desde un CSV (objeto de texto).
+    Devuelve {total, actualizadas, sin_cambio, cambios, total_errores,
+    errores}; `cambios` es el diff de las calificaciones que cambian.
+    """
+    errores = []
+    total_errores = 0
+    total = 0
+
+    def error(linea, mensaje):
+        nonlocal total_errores
+        total_errores += 1
+        if len(errores) < IMPORT_MAX_ERRORES:
+            errores.append({"linea": linea, "error": mensaje})
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT 1
+            FROM planes.materia_alta
+            WHERE materia_alta_id = %s
+              AND fk_personal = %s
+            FOR SHARE;
+        """, (materia_alta_id, personal_id))
+        if cur.fetchone() is None:
+            raise ValueError("La materia no está asignada a este docente.")
+
+        cur.execute("""
+            CREATE TEMP TABLE stg_calificaciones (
+                linea          INT PRIMARY KEY,
+                numero_control VARCHAR(20)  NOT NULL,
+                calificacion   NUMERIC(5,2) NOT NULL,
+                inscripcion_id BIGINT,
+                anterior       NUMERIC(5,2),
+                error          TEXT
+            ) ON COMMIT DROP;
+        """)
+
+        lector = csv.DictReader(stream)
+        faltantes = [c for c in CALIFICACIONES_COLUMNAS_REQUERIDAS if c not in (lector.fieldnames or [])]
+        if faltantes:
+            raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltantes)}")
+
+        bloque = []
+        for linea, fila in enumerate(lector, start=2):
+            total += 1
+            numero_control = (fila.get("numero_control") or "").strip()
+            if not numero_control or len(numero_control) > 20:
+                error(linea, "numero_control vacío o de más de 20 caracteres")
+                continue
+            try:
+                calificacion = _leer_calificacion(fila.get("calificacion"))
+            except ValueError as e:
+                error(linea, f"calificacion inválida: {e}")
+                continue
+            if calificacion is None:
+                continue
+            bloque.append((linea, numero_control, calificacion))
+            if len(bloque) >= IMPORT_CHUNK:
+                _cargar_bloque_calificaciones(cur, bloque)
+                bloque = []
+        if bloque:
+            _cargar_bloque_calificaciones(cur, bloque)
+        cur.execute("ANALYZE stg_calificaciones;")
+
+        # ---- Cruce con las inscripciones del grupo ----
+        cur.execute("""
+            UPDATE stg_calificaciones s
+            SET inscripcion_id = ai.inscripcion_id,
+                anterior       = ai.calificacion
+            FROM academico.alumno_inscripcion ai
+            WHERE ai.fk_alumno = s.numero_control
+              AND ai.fk_materia_alta = %s;
+        """, (materia_alta_id,))
+        cur.execute("""
+            UPDATE stg_calificaciones s
+            SET error = 'numero_control repetido en el archivo'
+            FROM (
+                SELECT linea,
+                       row_number() OVER (PARTITION BY numero_control ORDER BY linea) AS n
+                FROM stg_calificaciones
+            ) d
+            WHERE d.linea = s.linea
+              AND d.n > 1;
+        """)
+        cur.execute("""
+            UPDATE stg_calificaciones
+            SET error = 'el alumno no está inscrito en esta materia'
+            WHERE inscripcion_id IS NULL
+              AND error IS NULL;
+        """)
+
+        cur.execute("""
+            SELECT
+                COUNT(*) FILTER (WHERE error IS NOT NULL) AS con_error,
+                COUNT(*) FILTER (WHERE error IS NULL
+                                   AND anterior IS NOT DISTINCT FROM calificacion) AS sin_cambio
+            FROM stg_calificaciones;
+        """)
+        conteo = cur.fetchone()
+        total_errores += conteo["con_error"]
+        cur.execute("""
+            SELECT linea, error || ': ' || numero_control AS error
+            FROM stg_calificaciones
+            WHERE error IS NOT NULL
+            ORDER BY linea
+            LIMIT %s;
+        """, (max(IMPORT_MAX_ERRORES - len(errores), 0),))
+        errores.extend(cur.fetchall())
+
+        # Diff: como mucho una fila por alumno inscrito
+        cur.execute("""
+            SELECT
+                s.linea,
+                s.numero_control,
+                TRIM(a.nombre || ' ' || a.apellido_paterno || ' ' ||
+                     COALESCE(a.apellido_materno,'')) AS alumno,
+                s.anterior,
+                s.calificacion AS nueva
+            FROM stg_calificaciones s
+            JOIN academico.alumnos a ON a.numero_control = s.numero_control
+            WHERE s.error IS NULL
+              AND s.anterior IS DISTINCT FROM s.calificacion
+            ORDER BY a.apellido_paterno, a.apellido_materno, a.nombre;
+        """)
+        cambios = cur.fetchall()
+
+        # ---- Escritura en una sola transacción ----
+        cur.execute("""
+            UPDATE academico.alumno_inscripcion ai
+            SET calificacion = s.calificacion
+            FROM stg_calificaciones s
+            WHERE ai.inscripcion_id = s.inscripcion_id
+              AND s.error IS NULL
+              AND ai.calificacion IS DISTINCT FROM s.calificacion;
+        """)
+        actualizadas = cur.rowcount
+
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+            if actualizadas:
+                audit_event(
+                    "calificacion",
+                    f"Importación CSV de calificaciones: {actualizadas} modificadas",
+                    {
+                        "materia_alta_id": int(materia_alta_id),
+                        "filas": total,
+                        "errores": total_errores,
+                        "calificaciones": [
+                            {"alumno": c["numero_control"],
+                             "anterior": None if c["anterior"] is None else float(c["anterior"]),
+                             "calificacion": float(c["nueva"])}
+                            for c in cambios
+                        ],
+                    },
+                    usuario_id=actor_id,
+                )
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    errores.sort(key=lambda e: e["linea"])
+    return {
+        "total": total,
+        "actualizadas": actualizadas,
+        "sin_cambio": conteo["sin_cambio"],
+        "cambios": cambios,
+        "total_errores": total_errores,
+        "errores": errores,
+    }
+
+
+@app.route("/docente/evaluaciones/importar", methods=["GET", "POST"])
+@login_required
+@role_required("Docente")
+def docente_evaluaciones_importar():
+    user = current_user()
+    materia_alta_id = request.values.get("materia_alta_id", type=int)
+    materias_docente = []
+    resumen = None
+    dry_run = True
+
+    try:
+        conn = get_connection()
+        personal_id = _get_personal_id(conn, user["id_usuario"])
+        if not personal_id:
+            raise Exception("No se encontró registro de docente.")
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT
+                ma.materia_alta_id,
+                ma.ciclo,
+                m.clave || ' - ' || m.nombre AS etiqueta
+            FROM planes.materia_alta ma
+            JOIN planes.carrera_materia cm
+              ON cm.carrera_materia_id = ma.carrera_materia_id
+            JOIN planes.materia m
+              ON m.materia_id = cm.materia_id
+            WHERE ma.fk_personal = %s
+            ORDER BY ma.ciclo, m.clave;
+        """, (personal_id,))
+        materias_docente = cur.fetchall()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        flash(f"Error cargando materias: {e}", "danger")
+        personal_id = None
+
+    if request.method == "POST" and personal_id:
+        archivo = request.files.get("archivo")
+        dry_run = request.form.get("dry_run") == "on"
+        if not archivo or not archivo.filename or not materia_alta_id:
+            flash("Selecciona la materia y un archivo CSV.", "warning")
+            return redirect(url_for("docente_evaluaciones_importar", materia_alta_id=materia_alta_id))
+        try:
+            stream = io.TextIOWrapper(archivo.stream, encoding="utf-8-sig", newline="")
+            resumen = importar_calificaciones_csv(
+                stream, personal_id, materia_alta_id,
+                dry_run=dry_run, actor_id=user["id_usuario"],
+            )
+        except Exception as e:
+            flash(f"Error al importar calificaciones: {e}", "danger")
+
+    return render_template(
+        "docente/evaluaciones_importar.html",
+        user=user,
+        materias_docente=materias_docente,
+        materia_alta_id=materia_alta_id,
+        resumen=resumen,
+        dry_run=dry_run,
+    )
+
+
+# =====================================
+# DOCENTE – ASISTENCIAS
+# =====================================
+#
+# Una fila por sesión de clase (materia_alta, fecha) con dos mapas de
+# bits alineados a alumno_inscripcion.posicion_lista: inscritos y
+# presentes (ver 4.j en el SQL). Guardar la sesión completa es un solo
+# upsert; los porcentajes salen de contar bits.
+
+ASISTENCIA_SESIONES_RECIENTES = 10
+
+
+def _mapa_bits(posiciones, longitud):
+    """Cadena '0101…' con las posiciones (1..longitud) encendidas."""
+    bits = ["0"] * longitud
+    for p in posiciones:
+        bits[p - 1] = "1"
+    return "".join(bits)
+
+
+def _fecha_sesion(texto):
+    """Fecha de la sesión (YYYY-MM-DD); hoy si no viene. ValueError si es futura."""
+    if not texto:
+        return datetime.now().date()
+    fecha = datetime.strptime(texto, "%Y-%m-%d").date()
+    if fecha > datetime.now().date():
+        raise ValueError("No se puede registrar asistencia de una fecha futura.")
+    return fecha
+
+
+def guardar_asistencia(conn, personal_id, materia_alta_id, fecha, presentes_ids, usuario_id=None):
+    """
+    Guarda (o reemplaza) la asistencia de una sesión del grupo con un solo
+    upsert. `presentes_ids` son los inscripcion_id marcados; los que no
+    pertenezcan al grupo se ignoran. Devuelve (presentes, inscritos).
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT 1
+            FROM planes.materia_alta
+            WHERE materia_alta_id = %s
+              AND fk_personal = %s
+            FOR SHARE;
+        """, (materia_alta_id, personal_id))
+        if cur.fetchone() is None:
+            raise ValueError("La materia no está asignada a este docente.")
+
+        cur.execute("""
+            SELECT inscripcion_id, posicion_lista
+            FROM academico.alumno_inscripcion
+            WHERE fk_materia_alta = %s;
+        """, (materia_alta_id,))
+        lista = cur.fetchall()
+        if not lista:
+            raise ValueError("No hay alumnos inscritos en esta materia.")
+
+        marcados = set(presentes_ids)
+        longitud = max(r["posicion_lista"] for r in lista)
+        inscritos = _mapa_bits((r["posicion_lista"] for r in lista), longitud)
+        presentes = _mapa_bits(
+            (r["posicion_lista"] for r in lista if r["inscripcion_id"] in marcados), longitud
+        )
+        cur.execute("""
+            INSERT INTO academico.asistencia_sesiones
+                (fk_materia_alta, fecha, inscritos, presentes, registrada_por)
+            VALUES (%s, %s, %s::varbit, %s::varbit, %s)
+            ON CONFLICT (fk_materia_alta, fecha) DO UPDATE
+            SET inscritos      = EXCLUDED.inscritos,
+                presentes      = EXCLUDED.presentes,
+                registrada_por = EXCLUDED.registrada_por,
+                actualizado_en = now();
+        """, (materia_alta_id, fecha, inscritos, presentes, usuario_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return presentes.count("1"), len(lista)
+
+
+def _porcentaje(parte, total):
+    return round(100.0 * parte / total, 1) if total else None
 
-@app.route("/docente/asistencias")
+
+@app.route("/docente/asistencias", methods=["GET", "POST"])
 @login_required
 @role_required("Docente")
 def docente_asistencias():
     user = current_user()
     lista = []
-    materia_alta_id = request.args.get("materia_alta_id")
+    sesiones = []
+    resumen_grupo = None
+    materia_alta_id = request.values.get("materia_alta_id")
+
+    if request.method == "POST":
+        conn = None
+        try:
+            fecha = _fecha_sesion(request.form.get("fecha"))
+            conn = get_connection()
+            personal_id = _get_personal_id(conn, user["id_usuario"])
+            if not personal_id:
+                raise Exception("No se encontró registro de docente.")
+            presentes, inscritos = guardar_asistencia(
+                conn, personal_id, int(materia_alta_id), fecha,
+                [int(i) for i in request.form.getlist("presente")],
+                usuario_id=user["id_usuario"],
+            )
+            flash(f"Asistencia del {fecha.strftime('%d/%m/%Y')} guardada: "
+                  f"{presentes} de {inscritos} presentes.", "success")
+        except Exception as e:
+            fecha = request.form.get("fecha")
+            flash(f"Error al guardar asistencia: {e}", "danger")
+        finally:
+            if conn:
+                conn.close()
+        return redirect(url_for("docente_asistencias", materia_alta_id=materia_alta_id, fecha=fecha))
+
+    try:
+        fecha = _fecha_sesion(request.args.get("fecha"))
+    except ValueError:
+        flash("Fecha no válida; se muestra la de hoy.", "warning")
+        fecha = datetime.now().date()
 
     try:
         conn = get_connection()
@@ -1217,23 +3126,66 @@ def docente_asistencias():
             row = cur.fetchone()
             materia_alta_id = row["materia_alta_id"] if row else None
 
-        # Lista de alumnos
         if materia_alta_id:
+            # Lista con la marca de la sesión elegida y el acumulado por alumno
             cur.execute("""
                 SELECT
+                    ai.inscripcion_id,
                     a.numero_control,
                     TRIM(a.nombre || ' ' || a.apellido_paterno || ' ' ||
-                         COALESCE(a.apellido_materno,'')) AS alumno
+                         COALESCE(a.apellido_materno,'')) AS alumno,
+                    hoy.sesion_id IS NULL
+                        OR academico.fn_bit_lista(hoy.presentes, ai.posicion_lista) AS presente,
+                    acum.sesiones,
+                    acum.asistencias
                 FROM academico.alumno_inscripcion ai
                 JOIN academico.alumnos a
                   ON a.numero_control = ai.fk_alumno
                 JOIN planes.materia_alta ma
                   ON ma.materia_alta_id = ai.fk_materia_alta
+                LEFT JOIN academico.asistencia_sesiones hoy
+                  ON hoy.fk_materia_alta = ai.fk_materia_alta
+                 AND hoy.fecha = %s
+                LEFT JOIN LATERAL (
+                    SELECT
+                        COUNT(*) AS sesiones,
+                        COUNT(*) FILTER (
+                            WHERE academico.fn_bit_lista(s.presentes, ai.posicion_lista)
+                        ) AS asistencias
+                    FROM academico.asistencia_sesiones s
+                    WHERE s.fk_materia_alta = ai.fk_materia_alta
+                      AND academico.fn_bit_lista(s.inscritos, ai.posicion_lista)
+                ) acum ON TRUE
                 WHERE ai.fk_materia_alta = %s
                   AND ma.fk_personal = %s
                 ORDER BY a.apellido_paterno, a.apellido_materno, a.nombre;
-            """, (materia_alta_id, personal_id))
+            """, (fecha, materia_alta_id, personal_id))
             lista = cur.fetchall()
+            for r in lista:
+                r["porcentaje"] = _porcentaje(r["asistencias"], r["sesiones"])
+
+            cur.execute("""
+                SELECT
+                    COUNT(*)                            AS sesiones,
+                    COALESCE(SUM(bit_count(presentes)), 0) AS presentes,
+                    COALESCE(SUM(bit_count(inscritos)), 0) AS inscritos
+                FROM academico.asistencia_sesiones
+                WHERE fk_materia_alta = %s;
+            """, (materia_alta_id,))
+            resumen_grupo = cur.fetchone()
+            resumen_grupo["porcentaje"] = _porcentaje(resumen_grupo["presentes"], resumen_grupo["inscritos"])
+
+            cur.execute("""
+                SELECT
+                    fecha,
+                    bit_count(presentes) AS presentes,
+                    bit_count(inscritos) AS inscritos
+                FROM academico.asistencia_sesiones
+                WHERE fk_materia_alta = %s
+                ORDER BY fecha DESC
+                LIMIT %s;
+            """, (materia_alta_id, ASISTENCIA_SESIONES_RECIENTES))
+            sesiones = cur.fetchall()
 
         # Materias del docente para el <select>
         cur.execute("""
@@ -1263,7 +3215,10 @@ def docente_asistencias():
         user=user,
         lista_alumnos=lista,
         materias_docente=materias_docente,
-        materia_alta_id=materia_alta_id
+        materia_alta_id=materia_alta_id,
+        fecha=fecha,
+        sesiones=sesiones,
+        resumen_grupo=resumen_grupo,
     )
 
 
@@ -1309,6 +3264,145 @@ def docente_comunicacion():
     )
 
 
+# =====================================
+# BIBLIOTECARIO – LISTADOS PAGINADOS
+# =====================================
+#
+# Catálogo, préstamos e historial se sirven por páginas ordenadas por una
+# llave indexada (columna de orden + id como desempate). La página HTML es
+# solo el esqueleto; las filas llegan como fragmentos (?fragmento=1) que
+# static/js/tabla_diferida.js va pidiendo al hacer scroll. El cursor
+# (?despues) es la llave de la última fila, codificada en base64.
+
+BIB_PAGE_SIZE = 50
+BIB_PAGE_MAX = 200
+
+# orden -> (llave [(expresión SQL, columna del resultado)], descendente)
+_ORDENES_CATALOGO = {
+    "titulo": ((("l.titulo_libro", "titulo_libro"), ("l.id_libro", "id_libro")), False),
+    "-titulo": ((("l.titulo_libro", "titulo_libro"), ("l.id_libro", "id_libro")), True),
+    "id": ((("l.id_libro", "id_libro"),), False),
+    "-id": ((("l.id_libro", "id_libro"),), True),
+}
+_ORDENES_PRESTAMOS = {
+    "fecha": ((("p.fecha_prestamo", "fecha_prestamo"), ("p.id_prestamo", "id_prestamo")), False),
+    "-fecha": ((("p.fecha_prestamo", "fecha_prestamo"), ("p.id_prestamo", "id_prestamo")), True),
+    "limite": ((("p.fecha_devolucion_estimada", "fecha_devolucion_estimada"),
+                ("p.id_prestamo", "id_prestamo")), False),
+    "-limite": ((("p.fecha_devolucion_estimada", "fecha_devolucion_estimada"),
+                 ("p.id_prestamo", "id_prestamo")), True),
+    "id": ((("p.id_prestamo", "id_prestamo"),), False),
+    "-id": ((("p.id_prestamo", "id_prestamo"),), True),
+}
+_ORDENES_HISTORIAL = {k: v for k, v in _ORDENES_PRESTAMOS.items() if "limite" not in k}
+
+
+def _codificar_cursor(valores):
+    texto = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in valores])
+    return base64.urlsafe_b64encode(texto.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decodificar_cursor(token, n):
+    """Devuelve la lista de valores del cursor, o None si falta o no es válido."""
+    if not token:
+        return None
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        return None
+    return valores if isinstance(valores, list) and len(valores) == n else None
+
+
+def _args_tabla(ordenes, defecto):
+    """Lee orden, tamaño de página y cursor de la query string."""
+    orden = request.args.get("orden", defecto)
+    if orden not in ordenes:
+        orden = defecto
+    try:
+        page_size = int(request.args.get("n", BIB_PAGE_SIZE))
+    except ValueError:
+        page_size = BIB_PAGE_SIZE
+    page_size = max(1, min(page_size, BIB_PAGE_MAX))
+    despues = _decodificar_cursor(request.args.get("despues"), len(ordenes[orden][0]))
+    return orden, page_size, despues
+
+
+def _pagina_por_llave(cur, consulta, params, llave, descendente, despues, page_size):
+    """
+    Ejecuta `consulta` (con un marcador {despues} dentro de su WHERE) por
+    páginas. Devuelve (filas, siguiente) con `siguiente` = cursor o None.
+    """
+    expresiones = ", ".join(expr for expr, _ in llave)
+    condicion = ""
+    params = list(params)
+    if despues is not None:
+        marcadores = ", ".join(["%s"] * len(llave))
+        condicion = f"AND ({expresiones}) {'<' if descendente else '>'} ({marcadores})"
+        params.extend(despues)
+    sentido = " DESC" if descendente else ""
+    cur.execute(
+        consulta.format(despues=condicion)
+        + f" ORDER BY {', '.join(expr + sentido for expr, _ in llave)} LIMIT %s;",
+        params + [page_size + 1],
+    )
+    filas = cur.fetchall()
+
+    siguiente = None
+    if len(filas) > page_size:
+        filas = filas[:page_size]
+        siguiente = _codificar_cursor([filas[-1][col] for _, col in llave])
+    return filas, siguiente
+
+
+def _fragmento_tabla(plantilla, endpoint, filas, siguiente, orden, page_size, es_primera):
+    """Filas <tr> de una página más la fila que pide la siguiente."""
+    siguiente_url = None
+    if siguiente:
+        siguiente_url = url_for(endpoint, fragmento=1, orden=orden, n=page_size, despues=siguiente)
+    return render_template(
+        plantilla,
+        filas=filas,
+        siguiente_url=siguiente_url,
+        es_primera=es_primera,
+    )
+
+
+_CONSULTA_CATALOGO = """
+    SELECT
+        l.id_libro,
+        l.titulo_libro,
+        c.codigo_clasificacion,
+        c.descripcion AS clasificacion_desc,
+        e.nombre_editorial,
+        l.anio_edicion,
+        l.isbn,
+        COALESCE(inv.cantidad, 0)            AS cantidad,
+        COALESCE(inv.cantidad_disponible, 0) AS cantidad_disponible
+    FROM biblioteca.libros l
+    LEFT JOIN biblioteca.clasificaciones c ON c.id_clasificacion = l.id_clasificacion
+    LEFT JOIN biblioteca.editoriales     e ON e.id_editorial     = l.id_editorial
+    LEFT JOIN biblioteca.inventario     inv ON inv.id_libro      = l.id_libro
+    WHERE TRUE {despues}
+"""
+
+
+def _fragmento_catalogo(endpoint, plantilla):
+    """Respuesta ?fragmento=1 del catálogo (bib_catalogo y el panel)."""
+    orden, page_size, despues = _args_tabla(_ORDENES_CATALOGO, "titulo")
+    llave, descendente = _ORDENES_CATALOGO[orden]
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        filas, siguiente = _pagina_por_llave(
+            cur, _CONSULTA_CATALOGO, [], llave, descendente, despues, page_size
+        )
+        cur.close()
+    finally:
+        conn.close()
+    return _fragmento_tabla(plantilla, endpoint, filas, siguiente, orden, page_size,
+                            despues is None)
+
+
 # =====================================
 # PERFIL – BIBLIOTECARIO
 # =====================================
@@ -1317,8 +3411,14 @@ def docente_comunicacion():
 @login_required
 @role_required("Bibliotecario")
 def perfil_bibliotecario():
+    if request.args.get("fragmento"):
+        return _fragmento_catalogo("perfil_bibliotecario", "biblioteca/_filas_panel.html")
+
     user = current_user()
     q = request.args.get("q", "").strip()   # texto de búsqueda
+    orden, page_size, _ = _args_tabla(_ORDENES_CATALOGO, "titulo")
+    pagina = _pagina_busqueda()
+    hay_mas = False
 
     # Estructura base del resumen para la tarjeta superior
     resumen = {
@@ -1335,83 +3435,23 @@ def perfil_bibliotecario():
         cur = conn.cursor()
 
         # --------------------- RESUMEN DE LA BIBLIOTECA ----------------------
-        # 1) Libros en catálogo
-        cur.execute("SELECT COUNT(*) AS total FROM biblioteca.libros;")
-        resumen["total_libros"] = cur.fetchone()["total"]
-
-        # 2) Préstamos activos
-        cur.execute("""
-            SELECT COUNT(*) AS total
-            FROM biblioteca.prestamos
-            WHERE estado = 'Activo';
-        """)
-        resumen["prestamos_activos"] = cur.fetchone()["total"]
-
-        # 3) Estudiantes con préstamo (distintos)
-        cur.execute("""
-            SELECT COUNT(DISTINCT fk_alumno) AS total
-            FROM biblioteca.prestamos
-            WHERE estado = 'Activo' AND fk_alumno IS NOT NULL;
-        """)
-        resumen["estudiantes_con_prestamo"] = cur.fetchone()["total"]
-
-        # 4) Préstamos retrasados
+        # Contadores mantenidos por triggers (biblioteca.resumen_biblioteca);
+        # los retrasados vienen del último barrido programado.
         cur.execute("""
-            SELECT COUNT(*) AS total
-            FROM biblioteca.prestamos
-            WHERE estado = 'Vencido'
-               OR (estado = 'Activo' AND fecha_devolucion_estimada < NOW());
+            SELECT
+                total_libros,
+                prestamos_activos,
+                estudiantes_con_prestamo,
+                prestamos_retrasados,
+                retrasados_calculado_en
+            FROM biblioteca.resumen_biblioteca;
         """)
-        resumen["prestamos_retrasados"] = cur.fetchone()["total"]
+        resumen.update(cur.fetchone() or {})
 
         # --------------------- LISTA / BÚSQUEDA DE LIBROS --------------------
+        # Sin búsqueda el catálogo llega por fragmentos (ver _fragmento_catalogo)
         if q:
-            patron = f"%{q}%"
-            cur.execute("""
-                SELECT
-                    l.id_libro,
-                    l.titulo_libro,
-                    c.codigo_clasificacion,
-                    e.nombre_editorial,
-                    l.anio_edicion,
-                    l.isbn,
-                    COALESCE(inv.cantidad, 0)            AS cantidad,
-                    COALESCE(inv.cantidad_disponible, 0) AS cantidad_disponible
-                FROM biblioteca.libros l
-                LEFT JOIN biblioteca.clasificaciones c
-                       ON c.id_clasificacion = l.id_clasificacion
-                LEFT JOIN biblioteca.editoriales e
-                       ON e.id_editorial = l.id_editorial
-                LEFT JOIN biblioteca.inventario inv
-                       ON inv.id_libro = l.id_libro
-                WHERE l.titulo_libro ILIKE %s
-                   OR e.nombre_editorial ILIKE %s
-                   OR c.codigo_clasificacion ILIKE %s
-                ORDER BY l.titulo_libro;
-            """, (patron, patron, patron))
-        else:
-            # Sin búsqueda: mostrar todo el catálogo
-            cur.execute("""
-                SELECT
-                    l.id_libro,
-                    l.titulo_libro,
-                    c.codigo_clasificacion,
-                    e.nombre_editorial,
-                    l.anio_edicion,
-                    l.isbn,
-                    COALESCE(inv.cantidad, 0)            AS cantidad,
-                    COALESCE(inv.cantidad_disponible, 0) AS cantidad_disponible
-                FROM biblioteca.libros l
-                LEFT JOIN biblioteca.clasificaciones c
-                       ON c.id_clasificacion = l.id_clasificacion
-                LEFT JOIN biblioteca.editoriales e
-                       ON e.id_editorial = l.id_editorial
-                LEFT JOIN biblioteca.inventario inv
-                       ON inv.id_libro = l.id_libro
-                ORDER BY l.titulo_libro;
-            """)
-
-        libros = cur.fetchall()
+            libros, hay_mas = buscar_libros(cur, q, pagina)
 
         cur.close()
         conn.close()
@@ -1426,7 +3466,11 @@ def perfil_bibliotecario():
         user=user,
         resumen=resumen,   # si en tu template usas otro nombre, cámbialo aquí
         libros=libros,
-        q=q
+        q=q,
+        pagina=pagina,
+        hay_mas=hay_mas,
+        orden=orden,
+        page_size=page_size,
     )
 
 
@@ -1438,38 +3482,363 @@ def perfil_bibliotecario():
 @login_required
 @role_required("Bibliotecario")
 def bib_catalogo():
-    user = current_user()
-    libros = []
+    if request.args.get("fragmento"):
+        return _fragmento_catalogo("bib_catalogo", "biblioteca/_filas_catalogo.html")
+
+    orden, page_size, _ = _args_tabla(_ORDENES_CATALOGO, "titulo")
+    return render_template(
+        "biblioteca/catalogo.html",
+        user=current_user(),
+        orden=orden,
+        page_size=page_size,
+    )
+
+
+# =====================================
+# BIBLIOTECARIO – IMPORTACIÓN DE CATÁLOGO (CSV)
+# =====================================
+#
+# Columnas: isbn, titulo, editorial, clasificacion y opcionales autores y
+# temas (separados por ';'), edicion, anio_edicion, cantidad, ubicacion,
+# fuente_recurso, incluye_cd. El ISBN es la llave de idempotencia: un
+# libro cuyo ISBN ya existe se omite, así que reimportar el mismo archivo
+# no duplica títulos ni ejemplares.
+#
+# 1. Lectura y validación en streaming, por bloques de IMPORT_CHUNK filas.
+# 2. Autores, editoriales, temas y clasificaciones se resuelven contra
+#    diccionarios en memoria (una consulta por catálogo al inicio); los
+#    nombres nuevos de cada bloque se dan de alta en un solo INSERT.
+# 3. COPY del bloque (ya con ids) a una tabla temporal de staging.
+# 4. Merge set-based a Libros, Autores_Libros, Libros_Temas e Inventario.
+
+CATALOGO_COLUMNAS_REQUERIDAS = ("isbn", "titulo", "editorial", "clasificacion")
+
+# clave -> (tabla, columna id, columna nombre, longitud máxima)
+_CATALOGO_DIMENSIONES = {
+    "autor": ("biblioteca.Autores", "id_autor", "nombre_autor", 150),
+    "editorial": ("biblioteca.Editoriales", "id_editorial", "nombre_editorial", 150),
+    "tema": ("biblioteca.Temas", "id_tema", "nombre_tema", 100),
+    "clasificacion": ("biblioteca.Clasificaciones", "id_clasificacion", "codigo_clasificacion", 20),
+}
+
+
+def _normalizar_isbn(texto):
+    """ISBN-10 o ISBN-13 (con o sin guiones) -> ISBN-13 como entero, o None."""
+    isbn = re.sub(r"[\s-]", "", texto or "").upper()
+    if re.fullmatch(r"\d{9}[\dX]", isbn):
+        base = "978" + isbn[:9]
+        suma = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(base))
+        return int(base + str((10 - suma % 10) % 10))
+    if re.fullmatch(r"\d{13}", isbn):
+        return int(isbn)
+    return None
+
+
+def _nombre_catalogo(texto):
+    return " ".join((texto or "").split())
+
+
+def _validar_fila_libro(fila, vistos):
+    """Devuelve (registro, None) si la fila es válida o (None, mensaje)."""
+    isbn = _normalizar_isbn(fila.get("isbn"))
+    titulo = _nombre_catalogo(fila.get("titulo"))
+    if isbn is None:
+        return None, "isbn inválido (se esperan 10 o 13 dígitos)"
+    if isbn in vistos:
+        return None, f"isbn repetido en el archivo: {isbn}"
+    if not titulo or len(titulo) > 255:
+        return None, "titulo vacío o de más de 255 caracteres"
+
+    registro = {"isbn": isbn, "titulo": titulo}
+    for campo in ("editorial", "clasificacion"):
+        valor = _nombre_catalogo(fila.get(campo))
+        if not valor or len(valor) > _CATALOGO_DIMENSIONES[campo][3]:
+            return None, f"{campo} vacío o demasiado largo"
+        registro[campo] = valor
+    for campo, dimension in (("autores", "autor"), ("temas", "tema")):
+        nombres = [_nombre_catalogo(x) for x in (fila.get(campo) or "").split(";")]
+        unicos = {}
+        for n in nombres:
+            if n:
+                unicos.setdefault(n.lower(), n)
+        nombres = list(unicos.values())
+        if any(len(n) > _CATALOGO_DIMENSIONES[dimension][3] for n in nombres):
+            return None, f"{campo}: nombre demasiado largo"
+        registro[campo] = nombres
 
     try:
-        conn = get_connection()
+        for campo in ("edicion", "anio_edicion", "cantidad"):
+            valor = (fila.get(campo) or "").strip()
+            registro[campo] = int(valor) if valor else None
+    except ValueError:
+        return None, "edicion, anio_edicion y cantidad deben ser numéricos"
+    if registro["cantidad"] is not None and registro["cantidad"] < 0:
+        return None, "cantidad no puede ser negativa"
+
+    registro["ubicacion"] = (fila.get("ubicacion") or "").strip()[:50] or None
+    registro["fuente_recurso"] = (fila.get("fuente_recurso") or "").strip()[:100] or None
+    registro["incluye_cd"] = (fila.get("incluye_cd") or "").strip().lower() in ("1", "si", "sí", "true", "x")
+
+    vistos.add(isbn)
+    return registro, None
+
+
+def _cargar_mapas_catalogo(cur):
+    """Un diccionario nombre.lower() -> id por catálogo, en una consulta cada uno."""
+    mapas = {}
+    for clave, (tabla, col_id, col_nombre, _) in _CATALOGO_DIMENSIONES.items():
+        cur.execute(f"SELECT {col_id} AS id, {col_nombre} AS nombre FROM {tabla};")
+        mapas[clave] = {r["nombre"].lower(): r["id"] for r in cur.fetchall()}
+    return mapas
+
+
+def _resolver_nombres(cur, mapas, clave, nombres, nuevos):
+    """Da de alta (en un INSERT) los nombres que no estén en el mapa."""
+    faltan = {}
+    for n in nombres:
+        if n.lower() not in mapas[clave]:
+            faltan.setdefault(n.lower(), n)
+    if not faltan:
+        return
+    tabla, col_id, col_nombre, _ = _CATALOGO_DIMENSIONES[clave]
+    filas = execute_values(cur, f"""
+        INSERT INTO {tabla} ({col_nombre})
+        VALUES %s
+        ON CONFLICT ({col_nombre}) DO UPDATE SET {col_nombre} = EXCLUDED.{col_nombre}
+        RETURNING {col_id} AS id, {col_nombre} AS nombre;
+    """, [(n,) for n in sorted(faltan.values())], fetch=True)
+    for r in filas:
+        mapas[clave][r["nombre"].lower()] = r["id"]
+    nuevos[clave] += len(filas)
+
+
+def _cargar_bloque_libros(cur, mapas, bloque, nuevos):
+    """Resuelve los nombres del bloque y lo carga con COPY a stg_libros."""
+    for clave, campo in (("editorial", "editorial"), ("clasificacion", "clasificacion")):
+        _resolver_nombres(cur, mapas, clave, (r[campo] for r in bloque), nuevos)
+    for clave, campo in (("autor", "autores"), ("tema", "temas")):
+        _resolver_nombres(cur, mapas, clave, (n for r in bloque for n in r[campo]), nuevos)
+
+    def arreglo(clave, nombres):
+        return "{" + ",".join(str(mapas[clave][n.lower()]) for n in nombres) + "}"
+
+    buf = io.StringIO()
+    escritor = csv.writer(buf)
+    for r in bloque:
+        escritor.writerow([
+            r["linea"], r["isbn"], r["titulo"],
+            mapas["editorial"][r["editorial"].lower()],
+            mapas["clasificacion"][r["clasificacion"].lower()],
+            "" if r["edicion"] is None else r["edicion"],
+            "" if r["anio_edicion"] is None else r["anio_edicion"],
+            r["fuente_recurso"] or "", "t" if r["incluye_cd"] else "f",
+            r["cantidad"] or 0, r["ubicacion"] or "",
+            arreglo("autor", r["autores"]), arreglo("tema", r["temas"]),
+        ])
+    buf.seek(0)
+    cur.copy_expert("""
+        COPY stg_libros (linea, isbn, titulo, id_editorial, id_clasificacion, edicion,
+                         anio_edicion, fuente_recurso, incluye_cd, cantidad, ubicacion,
+                         autores, temas)
+        FROM STDIN WITH (FORMAT csv)
+    """, buf)
+
+
+def importar_catalogo_csv(stream, dry_run=False, progreso=None, actor_id=None):
+    """
+    Importa libros desde un CSV (objeto de texto). Devuelve un resumen
+    {total, insertadas, existentes, total_errores, errores, nuevos}.
+    Con dry_run se valida todo y se hace rollback.
+    """
+    errores = []
+    total_errores = 0
+    total = 0
+    nuevos = dict.fromkeys(_CATALOGO_DIMENSIONES, 0)
+
+    def error(linea, mensaje):
+        nonlocal total_errores
+        total_errores += 1
+        if len(errores) < IMPORT_MAX_ERRORES:
+            errores.append({"linea": linea, "error": mensaje})
+
+    conn = get_connection()
+    try:
         cur = conn.cursor()
+        mapas = _cargar_mapas_catalogo(cur)
+
         cur.execute("""
-            SELECT
-                l.id_libro,
-                l.titulo_libro,
-                c.codigo_clasificacion,
-                e.nombre_editorial,
-                l.anio_edicion,
-                l.isbn,
-                COALESCE(inv.cantidad, 0)            AS cantidad,
-                COALESCE(inv.cantidad_disponible, 0) AS cantidad_disponible
-            FROM biblioteca.libros l
-            LEFT JOIN biblioteca.clasificaciones c ON c.id_clasificacion = l.id_clasificacion
-            LEFT JOIN biblioteca.editoriales     e ON e.id_editorial     = l.id_editorial
-            LEFT JOIN biblioteca.inventario     inv ON inv.id_libro      = l.id_libro
-            ORDER BY l.titulo_libro;
+            CREATE TEMP TABLE stg_libros (
+                linea            INT PRIMARY KEY,
+                isbn             BIGINT       NOT NULL,
+                titulo           VARCHAR(255) NOT NULL,
+                id_editorial     INT          NOT NULL,
+                id_clasificacion INT          NOT NULL,
+                edicion          INT,
+                anio_edicion     INT,
+                fuente_recurso   VARCHAR(100),
+                incluye_cd       BOOLEAN      NOT NULL,
+                cantidad         INT          NOT NULL,
+                ubicacion        VARCHAR(50),
+                autores          INT[]        NOT NULL,
+                temas            INT[]        NOT NULL,
+                id_libro         INT
+            ) ON COMMIT DROP;
+        """)
+
+        lector = csv.DictReader(stream)
+        faltantes = [c for c in CATALOGO_COLUMNAS_REQUERIDAS if c not in (lector.fieldnames or [])]
+        if faltantes:
+            raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltantes)}")
+
+        vistos = set()
+        bloque = []
+        for linea, fila in enumerate(lector, start=2):
+            total += 1
+            registro, msg = _validar_fila_libro(fila, vistos)
+            if msg:
+                error(linea, msg)
+                continue
+            registro["linea"] = linea
+            bloque.append(registro)
+            if len(bloque) >= IMPORT_CHUNK:
+                _cargar_bloque_libros(cur, mapas, bloque, nuevos)
+                bloque = []
+                if progreso:
+                    progreso(total, total_errores)
+        if bloque:
+            _cargar_bloque_libros(cur, mapas, bloque, nuevos)
+        vistos.clear()
+        mapas.clear()
+        cur.execute("ANALYZE stg_libros;")
+
+        # ---- Merge en una sola transacción ----
+        cur.execute("""
+            WITH nuevos AS (
+                INSERT INTO biblioteca.Libros
+                    (id_clasificacion, titulo_libro, id_editorial, edicion,
+                     anio_edicion, isbn, fuente_recurso, incluye_cd)
+                SELECT id_clasificacion, titulo, id_editorial, edicion,
+                       anio_edicion, isbn, fuente_recurso, incluye_cd
+                FROM stg_libros
+                ORDER BY linea
+                ON CONFLICT (isbn) DO NOTHING
+                RETURNING id_libro, isbn
+            )
+            UPDATE stg_libros s
+            SET id_libro = n.id_libro
+            FROM nuevos n
+            WHERE n.isbn = s.isbn;
+        """)
+        cur.execute("""
+            INSERT INTO biblioteca.Autores_Libros (id_libro, id_autor, tipo_autor)
+            SELECT s.id_libro, a.id_autor,
+                   CASE WHEN a.orden = 1 THEN 'Principal' ELSE 'Coautor' END
+            FROM stg_libros s
+            CROSS JOIN LATERAL unnest(s.autores) WITH ORDINALITY AS a(id_autor, orden)
+            WHERE s.id_libro IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        """)
+        cur.execute("""
+            INSERT INTO biblioteca.Libros_Temas (id_libro, id_tema)
+            SELECT s.id_libro, t.id_tema
+            FROM stg_libros s
+            CROSS JOIN LATERAL unnest(s.temas) AS t(id_tema)
+            WHERE s.id_libro IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        """)
+        cur.execute("""
+            INSERT INTO biblioteca.Inventario (id_libro, cantidad, cantidad_disponible, ubicacion)
+            SELECT id_libro, cantidad, cantidad, ubicacion
+            FROM stg_libros
+            WHERE id_libro IS NOT NULL
+            ON CONFLICT (id_libro) DO NOTHING;
+        """)
+        cur.execute("""
+            SELECT COUNT(id_libro) AS insertadas,
+                   COUNT(*) - COUNT(id_libro) AS existentes
+            FROM stg_libros;
         """)
-        libros = cur.fetchall()
+        conteo = cur.fetchone()
+
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+            audit_event(
+                "importacion_catalogo",
+                f"Importación CSV de catálogo: {conteo['insertadas']} libros nuevos",
+                {"insertadas": conteo["insertadas"], "existentes": conteo["existentes"],
+                 "errores": total_errores, "filas": total, "nuevos": nuevos},
+                usuario_id=actor_id,
+            )
         cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-    except Exception as e:
-        flash(f"Error cargando catálogo de libros: {e}", "danger")
+
+    errores.sort(key=lambda e: e["linea"])
+    return {
+        "total": total,
+        "insertadas": conteo["insertadas"],
+        "existentes": conteo["existentes"],
+        "total_errores": total_errores,
+        "errores": errores,
+        "nuevos": nuevos,
+    }
+
+
+@app.route("/biblioteca/catalogo/importar", methods=["GET", "POST"])
+@login_required
+@role_required("Bibliotecario")
+def bib_catalogo_importar():
+    user = current_user()
+    resumen = None
+    dry_run = False
+
+    if request.method == "POST":
+        archivo = request.files.get("archivo")
+        dry_run = request.form.get("dry_run") == "on"
+        if not archivo or not archivo.filename:
+            flash("Selecciona un archivo CSV.", "warning")
+            return redirect(url_for("bib_catalogo_importar"))
+        try:
+            stream = io.TextIOWrapper(archivo.stream, encoding="utf-8-sig", newline="")
+            resumen = importar_catalogo_csv(stream, dry_run=dry_run,
+                                            actor_id=user["id_usuario"])
+        except Exception as e:
+            flash(f"Error al importar el catálogo: {e}", "danger")
 
     return render_template(
-        "biblioteca/catalogo.html",
+        "biblioteca/catalogo_importar.html",
         user=user,
-        libros=libros
+        resumen=resumen,
+        dry_run=dry_run,
+    )
+
+
+@app.cli.command("biblioteca-importar")
+@click.argument("archivo", type=click.Path(exists=True, dir_okay=False))
+@click.option("--dry-run", is_flag=True, help="Solo validar; no guarda nada.")
+def cli_biblioteca_importar(archivo, dry_run):
+    """Importa libros al catálogo desde un CSV."""
+    with open(archivo, newline="", encoding="utf-8-sig") as fh:
+        resumen = importar_catalogo_csv(
+            fh, dry_run=dry_run,
+            progreso=lambda leidas, errs: click.echo(
+                f"  {leidas} filas leídas, {errs} con error", err=True
+            ),
+        )
+    for e in resumen["errores"]:
+        click.echo(f"Línea {e['linea']}: {e['error']}")
+    n = resumen["nuevos"]
+    click.echo(
+        f"{'[simulación] ' if dry_run else ''}"
+        f"Filas: {resumen['total']}  Libros nuevos: {resumen['insertadas']}  "
+        f"Ya existían: {resumen['existentes']}  Errores: {resumen['total_errores']}\n"
+        f"Altas en catálogos: {n['autor']} autores, {n['editorial']} editoriales, "
+        f"{n['tema']} temas, {n['clasificacion']} clasificaciones"
     )
 
 
@@ -1481,33 +3850,36 @@ def bib_catalogo():
 @login_required
 @role_required("Bibliotecario")
 def bib_prestamos():
-    user = current_user()
-    prestamos = []
+    # Si viene POST, marcar un préstamo como devuelto
+    if request.method == "POST":
+        conn = None
+        try:
+            conn = get_connection()
+            if devolver_prestamo(conn, int(request.form.get("id_prestamo"))):
+                flash("Préstamo marcado como devuelto.", "success")
+            else:
+                flash("El préstamo ya estaba devuelto o no existe.", "warning")
+        except Exception as e_upd:
+            flash(f"Error al marcar devolución: {e_upd}", "danger")
+        finally:
+            if conn:
+                conn.close()
+        return redirect(url_for("bib_prestamos", orden=request.args.get("orden")))
+
+    orden, page_size, despues = _args_tabla(_ORDENES_PRESTAMOS, "-fecha")
+    if not request.args.get("fragmento"):
+        return render_template(
+            "biblioteca/prestamos.html",
+            user=current_user(),
+            orden=orden,
+            page_size=page_size,
+        )
 
-    conn = None
+    llave, descendente = _ORDENES_PRESTAMOS[orden]
+    conn = get_connection()
     try:
-        conn = get_connection()
         cur = conn.cursor()
-
-        # Si viene POST, marcar un préstamo como devuelto
-        if request.method == "POST":
-            prestamo_id = request.form.get("id_prestamo")
-            try:
-                cur.execute("""
-                    UPDATE biblioteca.prestamos
-                    SET estado = 'Devuelto',
-                        fecha_devolucion_real = NOW()
-                    WHERE id_prestamo = %s
-                      AND estado = 'Activo';
-                """, (prestamo_id,))
-                conn.commit()
-                flash("Préstamo marcado como devuelto.", "success")
-            except Exception as e_upd:
-                conn.rollback()
-                flash(f"Error al marcar devolución: {e_upd}", "danger")
-
-        # Listar préstamos activos
-        cur.execute("""
+        filas, siguiente = _pagina_por_llave(cur, """
             SELECT
                 p.id_prestamo,
                 l.titulo_libro,
@@ -1518,23 +3890,13 @@ def bib_prestamos():
                 p.estado
             FROM biblioteca.prestamos p
             JOIN biblioteca.libros l ON l.id_libro = p.id_libro
-            WHERE p.estado = 'Activo'
-            ORDER BY p.fecha_prestamo DESC;
-        """)
-        prestamos = cur.fetchall()
-
+            WHERE p.estado IN ('Activo', 'Vencido') {despues}
+        """, [], llave, descendente, despues, page_size)
         cur.close()
+    finally:
         conn.close()
-    except Exception as e:
-        if conn and not conn.closed:
-            conn.close()
-        flash(f"Error cargando préstamos: {e}", "danger")
-
-    return render_template(
-        "biblioteca/prestamos.html",
-        user=user,
-        prestamos=prestamos
-    )
+    return _fragmento_tabla("biblioteca/_filas_prestamos.html", "bib_prestamos",
+                            filas, siguiente, orden, page_size, despues is None)
 
 
 # =====================================
@@ -1545,13 +3907,20 @@ def bib_prestamos():
 @login_required
 @role_required("Bibliotecario")
 def bib_historial():
-    user = current_user()
-    historial = []
+    orden, page_size, despues = _args_tabla(_ORDENES_HISTORIAL, "-fecha")
+    if not request.args.get("fragmento"):
+        return render_template(
+            "biblioteca/historial.html",
+            user=current_user(),
+            orden=orden,
+            page_size=page_size,
+        )
 
+    llave, descendente = _ORDENES_HISTORIAL[orden]
+    conn = get_connection()
     try:
-        conn = get_connection()
         cur = conn.cursor()
-        cur.execute("""
+        filas, siguiente = _pagina_por_llave(cur, """
             SELECT
                 p.id_prestamo,
                 l.titulo_libro,
@@ -1562,42 +3931,216 @@ def bib_historial():
                 p.estado
             FROM biblioteca.prestamos p
             JOIN biblioteca.libros l ON l.id_libro = p.id_libro
-            WHERE p.estado IN ('Devuelto', 'Vencido')
-            ORDER BY p.fecha_prestamo DESC;
-        """)
-        historial = cur.fetchall()
+            WHERE p.estado IN ('Devuelto', 'Vencido') {despues}
+        """, [], llave, descendente, despues, page_size)
         cur.close()
+    finally:
         conn.close()
-    except Exception as e:
-        flash(f"Error cargando historial de préstamos: {e}", "danger")
-
-    return render_template(
-        "biblioteca/historial.html",
-        user=user,
-        historial=historial
-    )
+    return _fragmento_tabla("biblioteca/_filas_historial.html", "bib_historial",
+                            filas, siguiente, orden, page_size, despues is None)
 
 
 # =====================================
-# BIBLIOTECARIO – NOTIFICACIONES (DEMO)
+# BIBLIOTECARIO – NOTIFICACIONES
 # =====================================
 
+NOTIFICACIONES_BIB_LIMITE = 200
+
+
 @app.route("/biblioteca/notificaciones")
 @login_required
 @role_required("Bibliotecario")
 def bib_notificaciones():
+    """Últimos resúmenes generados por el barrido de préstamos vencidos."""
     user = current_user()
-    # Por ahora solo demo estático; luego se puede ligar a una tabla
-    notificaciones = [
-        {"destinatario": "2501E0001", "mensaje": "Tu préstamo está por vencer."},
-        {"destinatario": "2501E0002", "mensaje": "Por favor devuelve el libro pendiente."},
-    ]
+    notificaciones = []
+
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT
+                n.fk_alumno AS destinatario,
+                a.nombre || ' ' || a.apellido_paterno AS nombre_alumno,
+                n.titulo,
+                n.mensaje,
+                n.leida,
+                n.pendiente_envio,
+                n.enviada_en,
+                n.fecha_creacion
+            FROM academico.notificaciones_alumno n
+            JOIN academico.alumnos a ON a.numero_control = n.fk_alumno
+            WHERE n.origen = 'biblioteca'
+            ORDER BY n.fecha_creacion DESC
+            LIMIT %s;
+        """, (NOTIFICACIONES_BIB_LIMITE,))
+        notificaciones = cur.fetchall()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        flash(f"Error cargando notificaciones: {e}", "danger")
+
     return render_template(
         "biblioteca/notificaciones.html",
         user=user,
         notificaciones=notificaciones
     )
 
+# =====================================
+# BIBLIOTECARIO – ESTADÍSTICAS DE CIRCULACIÓN
+# =====================================
+#
+# Todo sale de biblioteca.circulacion_diaria (acumulados por día y libro,
+# ver fn_circulacion_actualizar); nunca se recorre biblioteca.prestamos.
+# El rango se elige por mes (?desde=AAAA-MM&hasta=AAAA-MM).
+
+ESTADISTICAS_MESES_DEFECTO = 12
+ESTADISTICAS_TOP_TITULOS = 20
+ESTADISTICAS_REPORTES = ("mensual", "titulos", "clasificaciones")
+
+
+def _rango_estadisticas():
+    """Devuelve (desde, hasta) como fechas: primer día del mes inicial y del siguiente al final."""
+    hoy = datetime.now().date().replace(day=1)
+
+    def mes(param, defecto):
+        try:
+            return datetime.strptime(request.args.get(param, ""), "%Y-%m").date()
+        except ValueError:
+            return defecto
+
+    hasta = mes("hasta", hoy)
+    atras = hoy.year * 12 + hoy.month - ESTADISTICAS_MESES_DEFECTO
+    desde = mes("desde", hoy.replace(year=atras // 12, month=atras % 12 + 1))
+    if desde > hasta:
+        desde, hasta = hasta, desde
+    siguiente = hasta.year * 12 + hasta.month
+    return desde, hasta.replace(year=siguiente // 12, month=siguiente % 12 + 1)
+
+
+def estadisticas_circulacion(cur, reporte, desde, hasta):
+    """Filas de un reporte ("mensual", "titulos" o "clasificaciones") en [desde, hasta)."""
+    if reporte == "mensual":
+        cur.execute("""
+            SELECT
+                to_char(date_trunc('month', dia), 'YYYY-MM') AS mes,
+                SUM(prestamos)   AS prestamos,
+                SUM(devueltos)   AS devueltos,
+                ROUND(SUM(dias_prestamo) / NULLIF(SUM(devueltos), 0), 1) AS dias_promedio,
+                SUM(con_retraso) AS con_retraso
+            FROM biblioteca.circulacion_diaria
+            WHERE dia >= %s AND dia < %s
+            GROUP BY 1
+            ORDER BY 1;
+        """, (desde, hasta))
+    elif reporte == "titulos":
+        cur.execute("""
+            SELECT
+                l.id_libro,
+                l.titulo_libro,
+                t.prestamos,
+                ROUND(t.dias_prestamo / NULLIF(t.devueltos, 0), 1) AS dias_promedio
+            FROM (
+                SELECT id_libro,
+                       SUM(prestamos) AS prestamos,
+                       SUM(devueltos) AS devueltos,
+                       SUM(dias_prestamo) AS dias_prestamo
+                FROM biblioteca.circulacion_diaria
+                WHERE dia >= %s AND dia < %s
+                GROUP BY id_libro
+                ORDER BY prestamos DESC, id_libro
+                LIMIT %s
+            ) t
+            JOIN biblioteca.libros l ON l.id_libro = t.id_libro
+            ORDER BY t.prestamos DESC, l.id_libro;
+        """, (desde, hasta, ESTADISTICAS_TOP_TITULOS))
+    elif reporte == "clasificaciones":
+        cur.execute("""
+            SELECT
+                c.codigo_clasificacion,
+                c.descripcion,
+                t.prestamos,
+                t.con_retraso,
+                ROUND(100.0 * t.con_retraso / NULLIF(t.prestamos, 0), 1) AS pct_retraso
+            FROM (
+                SELECT id_clasificacion,
+                       SUM(prestamos) AS prestamos,
+                       SUM(con_retraso) AS con_retraso
+                FROM biblioteca.circulacion_diaria
+                WHERE dia >= %s AND dia < %s
+                GROUP BY id_clasificacion
+            ) t
+            JOIN biblioteca.clasificaciones c ON c.id_clasificacion = t.id_clasificacion
+            ORDER BY pct_retraso DESC NULLS LAST, c.codigo_clasificacion;
+        """, (desde, hasta))
+    else:
+        raise ValueError(f"Reporte desconocido: {reporte}")
+    return cur.fetchall()
+
+
+@app.route("/biblioteca/estadisticas")
+@login_required
+@role_required("Bibliotecario")
+def bib_estadisticas():
+    user = current_user()
+    desde, hasta = _rango_estadisticas()
+    reportes = dict.fromkeys(ESTADISTICAS_REPORTES, [])
+    actualizado_en = None
+
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        for reporte in ESTADISTICAS_REPORTES:
+            reportes[reporte] = estadisticas_circulacion(cur, reporte, desde, hasta)
+        cur.execute("SELECT actualizado_en FROM biblioteca.circulacion_estado;")
+        fila = cur.fetchone()
+        actualizado_en = fila["actualizado_en"] if fila else None
+        cur.close()
+        conn.close()
+    except Exception as e:
+        flash(f"Error cargando estadísticas: {e}", "danger")
+
+    return render_template(
+        "biblioteca/estadisticas.html",
+        user=user,
+        desde=desde.strftime("%Y-%m"),
+        hasta=(hasta - timedelta(days=1)).strftime("%Y-%m"),
+        actualizado_en=actualizado_en,
+        **reportes,
+    )
+
+
+@app.route("/biblioteca/estadisticas/<reporte>.csv")
+@login_required
+@role_required("Bibliotecario")
+def bib_estadisticas_csv(reporte):
+    if reporte not in ESTADISTICAS_REPORTES:
+        abort(404)
+    desde, hasta = _rango_estadisticas()
+
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        filas = estadisticas_circulacion(cur, reporte, desde, hasta)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        flash(f"Error exportando estadísticas: {e}", "danger")
+        return redirect(url_for("bib_estadisticas", **request.args))
+
+    buf = io.StringIO()
+    if filas:
+        escritor = csv.DictWriter(buf, fieldnames=list(filas[0].keys()))
+        escritor.writeheader()
+        escritor.writerows(filas)
+    nombre = f"circulacion_{reporte}_{desde:%Y%m}_{hasta - timedelta(days=1):%Y%m}.csv"
+    return Response(
+        "\ufeff" + buf.getvalue(),  # BOM: Excel respeta los acentos
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={nombre}"},
+    )
+
+
 # =====================================
 # BIBLIOTECARIO – DETALLE DE LIBRO
 # =====================================
@@ -1613,6 +4156,7 @@ def biblioteca_libro_detalle(id_libro):
     conn = None
     libro = None
     historial_prestamos = []
+    recomendaciones = []
 
     try:
         conn = get_connection()
@@ -1667,6 +4211,8 @@ def biblioteca_libro_detalle(id_libro):
         """, (id_libro,))
         historial_prestamos = cur.fetchall()
 
+        recomendaciones = recomendaciones_libro(cur, id_libro)
+
         cur.close()
         conn.close()
 
@@ -1679,13 +4225,94 @@ def biblioteca_libro_detalle(id_libro):
         "biblioteca/libro_detalle.html",
         user=user,
         libro=libro,
-        historial_prestamos=historial_prestamos
+        historial_prestamos=historial_prestamos,
+        recomendaciones=recomendaciones
     )
 
 
 # =====================================
 # ADMIN – LISTA DE USUARIOS (con modos)
 # =====================================
+#
+# Directorio paginado por llave (id_usuario), compartido con "Datos y
+# seguridad". La búsqueda por subcadena usa los índices trigram de
+# nombre_usuario / correo_electronico y el filtro de rol el índice
+# (id_rol, id_usuario) de usuario_rol; los roles se agregan solo para
+# las filas de la página.
+
+USUARIOS_PAGE_SIZE = 50
+USUARIOS_PAGE_MAX = 500
+
+
+def _pagina_directorio_usuarios(cur, q="", rol="", estado="", despues=None,
+                                page_size=USUARIOS_PAGE_SIZE):
+    """Devuelve (usuarios, siguiente) con `siguiente` = id para la próxima página."""
+    joins, condiciones, params = [], [], []
+    if rol:
+        joins.append("""
+            JOIN seguridad.usuario_rol fr
+              ON fr.id_usuario = u.id_usuario
+             AND fr.id_rol = (SELECT id_rol FROM seguridad.roles WHERE nombre_rol = %s)
+        """)
+        params.append(rol)
+    if q:
+        condiciones.append("(u.nombre_usuario ILIKE %s OR u.correo_electronico ILIKE %s)")
+        like_q = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        params.extend([like_q, like_q])
+    if estado in ("activo", "bloqueado"):
+        condiciones.append("u.activo = %s")
+        params.append(estado == "activo")
+    if despues is not None:
+        condiciones.append("u.id_usuario > %s")
+        params.append(despues)
+
+    where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+    cur.execute(f"""
+        SELECT
+            u.id_usuario,
+            u.nombre_usuario,
+            u.correo_electronico,
+            u.activo,
+            COALESCE(rs.roles, '{{}}') AS roles
+        FROM seguridad.usuarios u
+        {"".join(joins)}
+        LEFT JOIN LATERAL (
+            SELECT ARRAY_AGG(r.nombre_rol ORDER BY r.nombre_rol) AS roles
+            FROM seguridad.usuario_rol ur
+            JOIN seguridad.roles r ON r.id_rol = ur.id_rol
+            WHERE ur.id_usuario = u.id_usuario
+        ) rs ON TRUE
+        {where}
+        ORDER BY u.id_usuario
+        LIMIT %s;
+    """, params + [page_size + 1])
+    usuarios = cur.fetchall()
+
+    siguiente = None
+    if len(usuarios) > page_size:
+        usuarios = usuarios[:page_size]
+        siguiente = usuarios[-1]["id_usuario"]
+    return usuarios, siguiente
+
+
+def _args_directorio_usuarios():
+    """Lee filtros, cursor y tamaño de página de la query string."""
+    filtros = {
+        "q": request.args.get("q", "").strip(),
+        "rol": request.args.get("rol", "").strip(),
+        "estado": request.args.get("estado", "").strip(),
+    }
+    try:
+        page_size = int(request.args.get("n", USUARIOS_PAGE_SIZE))
+    except ValueError:
+        page_size = USUARIOS_PAGE_SIZE
+    page_size = max(1, min(page_size, USUARIOS_PAGE_MAX))
+    try:
+        despues = int(request.args["despues"]) if request.args.get("despues") else None
+    except ValueError:
+        despues = None
+    return filtros, despues, page_size
+
 
 @app.route("/admin/usuarios")
 @login_required
@@ -1693,56 +4320,22 @@ def biblioteca_libro_detalle(id_libro):
 def admin_usuarios_list():
     user = current_user()
     modo = request.args.get("modo", "todos")  # todos, edit, baja, block, reset, buscar
-    q = request.args.get("q", "").strip()
-
-    usuarios = []
-
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        base_sql = """
-            SELECT
-                u.id_usuario,
-                u.nombre_usuario,
-                u.correo_electronico,
-                u.activo,
-                COALESCE(
-                    ARRAY_AGG(r.nombre_rol ORDER BY r.nombre_rol)
-                    FILTER (WHERE r.nombre_rol IS NOT NULL),
-                    '{}'
-                ) AS roles
-            FROM seguridad.usuarios u
-            LEFT JOIN seguridad.usuario_rol ur ON ur.id_usuario = u.id_usuario
-            LEFT JOIN seguridad.roles r ON r.id_rol = ur.id_rol
-            WHERE 1=1
-        """
+    filtros, despues, page_size = _args_directorio_usuarios()
 
-        params = []
-        if q:
-            base_sql += """
-                AND (
-                    u.nombre_usuario ILIKE %s
-                    OR u.correo_electronico ILIKE %s
-                    OR EXISTS (
-                        SELECT 1
-                        FROM seguridad.usuario_rol ur2
-                        JOIN seguridad.roles r2 ON r2.id_rol = ur2.id_rol
-                        WHERE ur2.id_usuario = u.id_usuario
-                          AND r2.nombre_rol ILIKE %s
-                    )
-                )
-            """
-            like_q = f"%{q}%"
-            params.extend([like_q, like_q, like_q])
+    usuarios = []
+    roles = []
+    siguiente = None
 
-        base_sql += """
-            GROUP BY u.id_usuario, u.nombre_usuario, u.correo_electronico, u.activo
-            ORDER BY u.id_usuario;
-        """
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
 
-        cur.execute(base_sql, params)
-        usuarios = cur.fetchall()
+        usuarios, siguiente = _pagina_directorio_usuarios(
+            cur, despues=despues, page_size=page_size, **filtros
+        )
+
+        cur.execute("SELECT nombre_rol FROM seguridad.roles ORDER BY nombre_rol;")
+        roles = [r["nombre_rol"] for r in cur.fetchall()]
 
         cur.close()
         conn.close()
@@ -1753,8 +4346,13 @@ def admin_usuarios_list():
         "admin/usuarios_list.html",
         user=user,
         usuarios=usuarios,
+        roles=roles,
         modo=modo,
-        q=q
+        q=filtros["q"],
+        filtros=filtros,
+        page_size=page_size,
+        siguiente=siguiente,
+        es_primera=despues is None,
     )
 
 
@@ -1811,6 +4409,11 @@ def admin_usuario_nuevo():
                         )
 
                     conn.commit()
+                    audit_event(
+                        "alta_usuario",
+                        f"Alta del usuario {nombre_usuario}",
+                        {"id_usuario": nuevo_id, "id_rol": int(id_rol)},
+                    )
                     flash("Usuario creado correctamente.", "success")
                     return redirect(url_for("admin_usuarios_list", modo="edit"))
                 except Exception as e_ins:
@@ -1835,6 +4438,53 @@ def admin_usuario_nuevo():
 # ADMIN – EDITAR USUARIO
 # =====================================
 
+def sincronizar_roles(cur, roles_por_usuario, modo="reemplazar"):
+    """
+    Ajusta seguridad.usuario_rol a partir de {id_usuario: [id_rol, ...]}
+    tocando solo lo que cambia, con una sentencia por tipo de cambio.
+
+    modo: "reemplazar" (los roles quedan exactamente así), "agregar" o
+    "quitar" (solo los roles indicados). Devuelve (agregados, quitados)
+    como listas de (id_usuario, id_rol).
+    """
+    pares = sorted({(int(u), int(r)) for u, rs in roles_por_usuario.items() for r in rs})
+    ids_usuario = [u for u, _ in pares]
+    ids_rol = [r for _, r in pares]
+    agregados, quitados = [], []
+
+    if modo == "reemplazar" and roles_por_usuario:
+        cur.execute("""
+            DELETE FROM seguridad.usuario_rol ur
+            WHERE ur.id_usuario = ANY(%s::bigint[])
+              AND NOT EXISTS (
+                  SELECT 1
+                  FROM unnest(%s::bigint[], %s::smallint[]) AS d(id_usuario, id_rol)
+                  WHERE d.id_usuario = ur.id_usuario AND d.id_rol = ur.id_rol
+              )
+            RETURNING ur.id_usuario, ur.id_rol;
+        """, (sorted(int(u) for u in roles_por_usuario), ids_usuario, ids_rol))
+        quitados = [(r["id_usuario"], r["id_rol"]) for r in cur.fetchall()]
+    elif modo == "quitar" and pares:
+        cur.execute("""
+            DELETE FROM seguridad.usuario_rol ur
+            USING unnest(%s::bigint[], %s::smallint[]) AS d(id_usuario, id_rol)
+            WHERE d.id_usuario = ur.id_usuario AND d.id_rol = ur.id_rol
+            RETURNING ur.id_usuario, ur.id_rol;
+        """, (ids_usuario, ids_rol))
+        quitados = [(r["id_usuario"], r["id_rol"]) for r in cur.fetchall()]
+
+    if modo in ("reemplazar", "agregar") and pares:
+        cur.execute("""
+            INSERT INTO seguridad.usuario_rol (id_usuario, id_rol)
+            SELECT * FROM unnest(%s::bigint[], %s::smallint[])
+            ON CONFLICT DO NOTHING
+            RETURNING id_usuario, id_rol;
+        """, (ids_usuario, ids_rol))
+        agregados = [(r["id_usuario"], r["id_rol"]) for r in cur.fetchall()]
+
+    return agregados, quitados
+
+
 @app.route("/admin/usuarios/<int:id_usuario>/editar", methods=["GET", "POST"])
 @login_required
 @role_required("Administrador")
@@ -1884,34 +4534,35 @@ def admin_usuario_editar(id_usuario):
             nuevos_roles = request.form.getlist("roles")  # lista de id_rol (str)
 
             try:
-                # Actualizar usuario
+                # Actualizar usuario (solo si algo cambió)
                 cur.execute(
                     """
                     UPDATE seguridad.usuarios
                     SET correo_electronico = %s,
                         activo = %s
-                    WHERE id_usuario = %s;
+                    WHERE id_usuario = %s
+                      AND (correo_electronico IS DISTINCT FROM %s
+                           OR activo IS DISTINCT FROM %s);
                     """,
-                    (correo, activo, id_usuario),
+                    (correo, activo, id_usuario, correo, activo),
                 )
 
-                # Limpiar roles previos
-                cur.execute(
-                    "DELETE FROM seguridad.usuario_rol WHERE id_usuario = %s;",
-                    (id_usuario,),
+                # Roles: solo se insertan / borran las diferencias
+                agregados, quitados = sincronizar_roles(
+                    cur, {id_usuario: [int(rid) for rid in nuevos_roles]}
                 )
 
-                # Insertar nuevos roles
-                for rid in nuevos_roles:
-                    cur.execute(
-                        """
-                        INSERT INTO seguridad.usuario_rol(id_usuario, id_rol)
-                        VALUES (%s, %s);
-                        """,
-                        (id_usuario, int(rid)),
-                    )
-
                 conn.commit()
+                if agregados or quitados:
+                    audit_event(
+                        "cambio_roles",
+                        "Roles del usuario actualizados",
+                        {
+                            "id_usuario": id_usuario,
+                            "agregados": [r for _, r in agregados],
+                            "quitados": [r for _, r in quitados],
+                        },
+                    )
                 flash("Usuario actualizado.", "success")
                 return redirect(url_for("admin_usuarios_list", modo="edit"))
 
@@ -1942,112 +4593,946 @@ def admin_usuario_editar(id_usuario):
 @role_required("Administrador")
 def admin_usuario_baja(id_usuario):
     try:
-        conn = get_connection()
+        conn = get_connection()
+        cur = conn.cursor()
+
+        # Primero borrar sus roles
+        cur.execute(
+            "DELETE FROM seguridad.usuario_rol WHERE id_usuario = %s;",
+            (id_usuario,),
+        )
+        # Luego borrar usuario
+        cur.execute(
+            "DELETE FROM seguridad.usuarios WHERE id_usuario = %s;",
+            (id_usuario,),
+        )
+
+        conn.commit()
+        cur.close()
+        conn.close()
+        audit_event("baja_usuario", "Usuario eliminado", {"id_usuario": id_usuario})
+        flash("Usuario dado de baja (eliminado).", "info")
+    except Exception as e:
+        flash(f"Error al dar de baja al usuario: {e}", "danger")
+
+    return redirect(url_for("admin_usuarios_list", modo="baja"))
+
+
+# =====================================
+# ADMIN – BLOCK / UNBLOCK
+# =====================================
+
+@app.route("/admin/usuarios/<int:id_usuario>/block", methods=["POST"])
+@login_required
+@role_required("Administrador")
+def admin_usuario_block(id_usuario):
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+
+        # Alternar activo
+        cur.execute(
+            """
+            UPDATE seguridad.usuarios
+            SET activo = NOT activo
+            WHERE id_usuario = %s
+            RETURNING activo;
+            """,
+            (id_usuario,),
+        )
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        if row:
+            audit_event(
+                "desbloqueo" if row["activo"] else "bloqueo",
+                "Cambio de estado de la cuenta",
+                {"id_usuario": id_usuario, "activo": row["activo"]},
+            )
+
+        if row and row["activo"]:
+            flash("Usuario desbloqueado.", "success")
+        else:
+            flash("Usuario bloqueado.", "warning")
+
+    except Exception as e:
+        flash(f"Error al bloquear/desbloquear usuario: {e}", "danger")
+
+    return redirect(url_for("admin_usuarios_list", modo="block"))
+
+
+# =====================================
+# ADMIN – RESET PASSWORD
+# =====================================
+
+@app.route("/admin/usuarios/<int:id_usuario>/reset", methods=["POST"])
+@login_required
+@role_required("Administrador")
+def admin_usuario_reset(id_usuario):
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        nueva_pwd = generate_random_password(10)
+
+        # Actualizar contrasena_hash (trigger hará el hash)
+        cur.execute(
+            """
+            UPDATE seguridad.usuarios
+            SET contrasena_hash = %s
+            WHERE id_usuario = %s
+            RETURNING correo_electronico;
+            """,
+            (nueva_pwd, id_usuario),
+        )
+        row = cur.fetchone()
+        if row and row["correo_electronico"]:
+            enqueue_email(
+                conn,
+                row["correo_electronico"],
+                "Restablecimiento de contraseña",
+                f"Tu nueva contraseña temporal es: {nueva_pwd}",
+            )
+        conn.commit()
+        cur.close()
+        conn.close()
+        wake_mail_workers()
+
+        if row:
+            audit_event(
+                "reset_contrasena",
+                "Contraseña restablecida por administrador",
+                {"id_usuario": id_usuario},
+            )
+
+        flash(
+            "Contraseña restablecida y enviada por correo (si SMTP está configurado).",
+            "success",
+        )
+    except Exception as e:
+        flash(f"Error al restablecer contraseña: {e}", "danger")
+
+    return redirect(url_for("admin_usuarios_list", modo="reset"))
+
+
+# =====================================
+# ADMIN – IMPORTACIÓN MASIVA DE USUARIOS (CSV)
+# =====================================
+#
+# Columnas: nombre_usuario, correo_electronico, roles (separados por ';')
+# y opcionales contrasena, numero_control, id_personal. Si no se da
+# contraseña se genera una y se envía por la cola de correo.
+#
+# 1. Lectura y validación en streaming, por bloques de IMPORT_CHUNK filas.
+# 2. bcrypt de cada bloque en un pool de procesos (todos los núcleos);
+#    el trigger fn_hashear_contrasena respeta hashes ya calculados.
+# 3. COPY del bloque a una tabla temporal de staging.
+# 4. Validación contra la BD y merge a usuarios, usuario_rol,
+#    auth_user_alumno y rrhh.personal en una sola transacción.
+
+IMPORT_COLUMNAS_REQUERIDAS = ("nombre_usuario", "correo_electronico", "roles")
+IMPORT_CHUNK = int(os.getenv("IMPORT_CHUNK", "1000"))
+IMPORT_MAX_ERRORES = 5000
+BCRYPT_COST = 12  # mismo costo que seguridad.fn_hashear_contrasena
+_RE_CORREO = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def _hash_password(contrasena: str) -> str:
+    """bcrypt con prefijo $2a$ (el que entiende crypt() de pgcrypto)."""
+    salt = bcrypt.gensalt(BCRYPT_COST, prefix=b"2a")
+    return bcrypt.hashpw(contrasena.encode("utf-8"), salt).decode("ascii")
+
+
+def _validar_fila_usuario(fila, roles_validos, vistos):
+    """Devuelve (registro, None) si la fila es válida o (None, mensaje)."""
+    nombre = (fila.get("nombre_usuario") or "").strip()
+    correo = (fila.get("correo_electronico") or "").strip()
+    roles_txt = (fila.get("roles") or "").strip()
+    numero_control = (fila.get("numero_control") or "").strip() or None
+    id_personal = (fila.get("id_personal") or "").strip() or None
+    contrasena = (fila.get("contrasena") or "").strip()
+
+    if not nombre or len(nombre) > 50 or any(c.isspace() for c in nombre):
+        return None, "nombre_usuario vacío, con espacios o de más de 50 caracteres"
+    if len(correo) > 255 or not _RE_CORREO.match(correo):
+        return None, "correo_electronico inválido"
+    roles = []
+    for r in filter(None, (x.strip() for x in roles_txt.split(";"))):
+        if r.lower() not in roles_validos:
+            return None, f"Rol desconocido: {r}"
+        roles.append(roles_validos[r.lower()])
+    if not roles:
+        return None, "Debe indicar al menos un rol"
+    if numero_control and len(numero_control) > 20:
+        return None, "numero_control de más de 20 caracteres"
+    if id_personal is not None:
+        try:
+            id_personal = int(id_personal)
+        except ValueError:
+            return None, "id_personal debe ser numérico"
+    # bcrypt rechaza (ValueError) contraseñas de más de 72 bytes
+    if len(contrasena.encode("utf-8")) > 72:
+        return None, "contrasena de más de 72 bytes"
+
+    claves = [("usuario", nombre.lower()), ("correo", correo.lower())]
+    if numero_control:
+        claves.append(("numero_control", numero_control))
+    if id_personal is not None:
+        claves.append(("id_personal", id_personal))
+    for clave in claves:
+        if clave in vistos:
+            return None, f"{clave[0]} repetido en el archivo: {clave[1]}"
+    vistos.update(claves)
+
+    return {
+        "nombre_usuario": nombre,
+        "correo_electronico": correo,
+        "contrasena": contrasena,
+        "roles": roles,
+        "numero_control": numero_control,
+        "id_personal": id_personal,
+    }, None
+
+
+def _cargar_bloque_usuarios(cur, pool, bloque, generadas):
+    """Hashea el bloque en paralelo y lo carga con COPY a stg_usuarios."""
+    for r in bloque:
+        if not r["contrasena"]:
+            r["contrasena"] = generate_random_password(12)
+            generadas[r["linea"]] = r["contrasena"]
+    chunksize = max(1, len(bloque) // ((os.cpu_count() or 1) * 4))
+    hashes = pool.map(_hash_password, [r["contrasena"] for r in bloque], chunksize=chunksize)
+
+    buf = io.StringIO()
+    escritor = csv.writer(buf)
+    for r, h in zip(bloque, hashes):
+        escritor.writerow([
+            r["linea"], r["nombre_usuario"], r["correo_electronico"], h,
+            ";".join(r["roles"]), r["numero_control"] or "",
+            "" if r["id_personal"] is None else r["id_personal"],
+        ])
+    buf.seek(0)
+    cur.copy_expert("""
+        COPY stg_usuarios (linea, nombre_usuario, correo_electronico, contrasena_hash,
+                           roles, numero_control, id_personal)
+        FROM STDIN WITH (FORMAT csv)
+    """, buf)
+
+
+def importar_usuarios_csv(stream, dry_run=False, procesos=None, progreso=None, actor_id=None):
+    """
+    Importa usuarios desde un CSV (objeto de texto). Devuelve un resumen
+    {total, insertadas, total_errores, errores=[{linea, error}]}.
+    `progreso(filas_leidas, total_errores)` se llama tras cada bloque.
+    Con dry_run se valida todo y se hace rollback.
+    """
+    errores = []
+    total_errores = 0
+    total = 0
+    generadas = {}
+
+    def error(linea, mensaje):
+        nonlocal total_errores
+        total_errores += 1
+        if len(errores) < IMPORT_MAX_ERRORES:
+            errores.append({"linea": linea, "error": mensaje})
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT nombre_rol FROM seguridad.roles;")
+        roles_validos = {r["nombre_rol"].lower(): r["nombre_rol"] for r in cur.fetchall()}
+
+        cur.execute("""
+            CREATE TEMP TABLE stg_usuarios (
+                linea              INT PRIMARY KEY,
+                nombre_usuario     VARCHAR(50)  NOT NULL,
+                correo_electronico VARCHAR(255) NOT NULL,
+                contrasena_hash    TEXT         NOT NULL,
+                roles              TEXT         NOT NULL,
+                numero_control     VARCHAR(20),
+                id_personal        BIGINT,
+                id_usuario         BIGINT
+            ) ON COMMIT DROP;
+        """)
+
+        lector = csv.DictReader(stream)
+        faltantes = [c for c in IMPORT_COLUMNAS_REQUERIDAS if c not in (lector.fieldnames or [])]
+        if faltantes:
+            raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltantes)}")
+
+        vistos = set()
+        bloque = []
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+            for linea, fila in enumerate(lector, start=2):
+                total += 1
+                registro, msg = _validar_fila_usuario(fila, roles_validos, vistos)
+                if msg:
+                    error(linea, msg)
+                    continue
+                registro["linea"] = linea
+                bloque.append(registro)
+                if len(bloque) >= IMPORT_CHUNK:
+                    _cargar_bloque_usuarios(cur, pool, bloque, generadas)
+                    bloque = []
+                    if progreso:
+                        progreso(total, total_errores)
+            if bloque:
+                _cargar_bloque_usuarios(cur, pool, bloque, generadas)
+        vistos.clear()
+        cur.execute("ANALYZE stg_usuarios;")
+
+        # ---- Validación contra la BD (set-based) ----
+        cur.execute("""
+            SELECT linea, error FROM (
+                SELECT DISTINCT ON (s.linea)
+                    s.linea,
+                    CASE
+                        WHEN u1.id_usuario IS NOT NULL THEN 'El nombre de usuario ya existe'
+                        WHEN u2.id_usuario IS NOT NULL THEN 'El correo ya está registrado'
+                        WHEN s.numero_control IS NOT NULL AND a.numero_control IS NULL
+                            THEN 'numero_control no existe en academico.alumnos'
+                        WHEN aua.user_id IS NOT NULL
+                            THEN 'numero_control ya está vinculado a otro usuario'
+                        WHEN s.id_personal IS NOT NULL AND p.id_personal IS NULL
+                            THEN 'id_personal no existe en rrhh.personal'
+                        WHEN p.fk_id_usuario IS NOT NULL
+                            THEN 'id_personal ya tiene un usuario vinculado'
+                    END AS error
+                FROM stg_usuarios s
+                LEFT JOIN seguridad.usuarios u1
+                       ON LOWER(u1.nombre_usuario) = LOWER(s.nombre_usuario)
+                LEFT JOIN seguridad.usuarios u2
+                       ON LOWER(u2.correo_electronico) = LOWER(s.correo_electronico)
+                LEFT JOIN academico.alumnos a
+                       ON a.numero_control = s.numero_control
+                LEFT JOIN seguridad.auth_user_alumno aua
+                       ON aua.numero_control = s.numero_control
+                LEFT JOIN rrhh.personal p
+                       ON p.id_personal = s.id_personal
+                ORDER BY s.linea
+            ) x
+            WHERE error IS NOT NULL;
+        """)
+        rechazadas = cur.fetchall()
+        for r in rechazadas:
+            error(r["linea"], r["error"])
+        if rechazadas:
+            cur.execute("DELETE FROM stg_usuarios WHERE linea = ANY(%s);",
+                        ([r["linea"] for r in rechazadas],))
+
+        # ---- Merge en una sola transacción ----
+        cur.execute("""
+            WITH nuevos AS (
+                INSERT INTO seguridad.usuarios (nombre_usuario, correo_electronico, contrasena_hash)
+                SELECT nombre_usuario, correo_electronico, contrasena_hash
+                FROM stg_usuarios
+                ORDER BY linea
+                ON CONFLICT DO NOTHING
+                RETURNING id_usuario, nombre_usuario
+            )
+            UPDATE stg_usuarios s
+            SET id_usuario = n.id_usuario
+            FROM nuevos n
+            WHERE n.nombre_usuario = s.nombre_usuario;
+        """)
+        cur.execute("SELECT linea FROM stg_usuarios WHERE id_usuario IS NULL;")
+        for r in cur.fetchall():
+            error(r["linea"], "Conflicto: el usuario o correo se registró durante la importación")
+
+        cur.execute("""
+            SELECT s.id_usuario, r.id_rol
+            FROM stg_usuarios s
+            CROSS JOIN LATERAL unnest(string_to_array(s.roles, ';')) AS rn(nombre_rol)
+            JOIN seguridad.roles r ON r.nombre_rol = rn.nombre_rol
+            WHERE s.id_usuario IS NOT NULL;
+        """)
+        roles_por_usuario = {}
+        for r in cur.fetchall():
+            roles_por_usuario.setdefault(r["id_usuario"], []).append(r["id_rol"])
+        sincronizar_roles(cur, roles_por_usuario, modo="agregar")
+        cur.execute("""
+            INSERT INTO seguridad.auth_user_alumno (user_id, numero_control)
+            SELECT id_usuario, numero_control
+            FROM stg_usuarios
+            WHERE id_usuario IS NOT NULL AND numero_control IS NOT NULL;
+        """)
+        cur.execute("""
+            UPDATE rrhh.personal p
+            SET fk_id_usuario = s.id_usuario
+            FROM stg_usuarios s
+            WHERE p.id_personal = s.id_personal
+              AND s.id_usuario IS NOT NULL;
+        """)
+
+        cur.execute("""
+            SELECT linea, correo_electronico, nombre_usuario
+            FROM stg_usuarios
+            WHERE id_usuario IS NOT NULL;
+        """)
+        insertadas = cur.fetchall()
+
+        if dry_run:
+            conn.rollback()
+        else:
+            enqueue_emails(conn, [
+                (
+                    r["correo_electronico"],
+                    "Alta en el Sistema Universitario",
+                    f"Tu usuario es: {r['nombre_usuario']}\n"
+                    f"Tu contraseña temporal es: {generadas[r['linea']]}\n\n"
+                    "Por seguridad, cambia la contraseña después de iniciar sesión.",
+                )
+                for r in insertadas if r["linea"] in generadas
+            ])
+            conn.commit()
+            wake_mail_workers()
+            audit_event(
+                "alta_usuario_masiva",
+                f"Importación CSV: {len(insertadas)} usuarios creados",
+                {"insertadas": len(insertadas), "errores": total_errores, "filas": total},
+                usuario_id=actor_id,
+            )
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    errores.sort(key=lambda e: e["linea"])
+    return {
+        "total": total,
+        "insertadas": len(insertadas),
+        "total_errores": total_errores,
+        "errores": errores,
+    }
+
+
+def _importacion_en_segundo_plano(id_importacion, ruta, dry_run, actor_id):
+    """Ejecuta la importación y va guardando el avance en importaciones_usuarios."""
+    estado_conn = get_connection()
+    estado_conn.autocommit = True
+
+    def guardar(**campos):
+        asignaciones = ", ".join(f"{k} = %s" for k in campos)
+        cur = estado_conn.cursor()
+        cur.execute(
+            f"UPDATE seguridad.importaciones_usuarios SET {asignaciones} "
+            f"WHERE id_importacion = %s;",
+            list(campos.values()) + [id_importacion],
+        )
+        cur.close()
+
+    try:
+        with open(ruta, newline="", encoding="utf-8-sig") as fh:
+            resumen = importar_usuarios_csv(
+                fh, dry_run=dry_run, actor_id=actor_id,
+                progreso=lambda leidas, errs: guardar(filas_leidas=leidas, total_errores=errs),
+            )
+        guardar(
+            estado="completada",
+            filas_leidas=resumen["total"],
+            insertadas=resumen["insertadas"],
+            total_errores=resumen["total_errores"],
+            errores=Json(resumen["errores"]),
+            terminado_en=datetime.now(timezone.utc),
+        )
+    except Exception as e:
+        guardar(estado="fallida", mensaje=str(e), terminado_en=datetime.now(timezone.utc))
+    finally:
+        estado_conn.close()
+        os.remove(ruta)
+
+
+@app.route("/admin/usuarios/importar", methods=["GET", "POST"])
+@login_required
+@role_required("Administrador")
+def admin_usuarios_importar():
+    user = current_user()
+    importaciones = []
+
+    if request.method == "POST":
+        archivo = request.files.get("archivo")
+        dry_run = request.form.get("dry_run") == "on"
+        if not archivo or not archivo.filename:
+            flash("Selecciona un archivo CSV.", "warning")
+            return redirect(url_for("admin_usuarios_importar"))
+
+        fd, ruta = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        archivo.save(ruta)
+
+        conn = None
+        try:
+            conn = get_connection()
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO seguridad.importaciones_usuarios (creado_por, archivo, simulacion)
+                VALUES (%s, %s, %s)
+                RETURNING id_importacion;
+            """, (user["id_usuario"], archivo.filename[:255], dry_run))
+            id_importacion = cur.fetchone()["id_importacion"]
+            conn.commit()
+            cur.close()
+            conn.close()
+        except Exception as e:
+            if conn and not conn.closed:
+                conn.close()
+            os.remove(ruta)
+            flash(f"Error al registrar la importación: {e}", "danger")
+            return redirect(url_for("admin_usuarios_importar"))
+
+        threading.Thread(
+            target=_importacion_en_segundo_plano,
+            args=(id_importacion, ruta, dry_run, user["id_usuario"]),
+            name=f"importacion-{id_importacion}",
+            daemon=True,
+        ).start()
+        return redirect(url_for("admin_usuarios_importacion", id_importacion=id_importacion))
+
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id_importacion, archivo, simulacion, estado, filas_leidas,
+                   insertadas, total_errores, creado_en, terminado_en
+            FROM seguridad.importaciones_usuarios
+            ORDER BY id_importacion DESC
+            LIMIT 10;
+        """)
+        importaciones = cur.fetchall()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        flash(f"Error cargando importaciones: {e}", "danger")
+
+    return render_template(
+        "admin/usuarios_importar.html",
+        user=user,
+        importaciones=importaciones,
+        importacion=None,
+    )
+
+
+@app.route("/admin/usuarios/importar/<int:id_importacion>")
+@login_required
+@role_required("Administrador")
+def admin_usuarios_importacion(id_importacion):
+    user = current_user()
+    importacion = None
+
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT *
+            FROM seguridad.importaciones_usuarios
+            WHERE id_importacion = %s;
+        """, (id_importacion,))
+        importacion = cur.fetchone()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        flash(f"Error cargando importación: {e}", "danger")
+
+    if importacion is None:
+        abort(404)
+
+    return render_template(
+        "admin/usuarios_importar.html",
+        user=user,
+        importaciones=[],
+        importacion=importacion,
+    )
+
+
+@app.cli.command("usuarios-importar")
+@click.argument("archivo", type=click.Path(exists=True, dir_okay=False))
+@click.option("--dry-run", is_flag=True, help="Solo validar; no guarda nada.")
+@click.option("--procesos", type=int, default=None,
+              help="Procesos para bcrypt (por defecto, todos los núcleos).")
+def cli_usuarios_importar(archivo, dry_run, procesos):
+    """Importa usuarios desde un CSV."""
+    with open(archivo, newline="", encoding="utf-8-sig") as fh:
+        resumen = importar_usuarios_csv(
+            fh, dry_run=dry_run, procesos=procesos,
+            progreso=lambda leidas, errs: click.echo(
+                f"  {leidas} filas leídas, {errs} con error", err=True
+            ),
+        )
+    for e in resumen["errores"]:
+        click.echo(f"Línea {e['linea']}: {e['error']}")
+    click.echo(
+        f"{'[simulación] ' if dry_run else ''}"
+        f"Filas: {resumen['total']}  Creados: {resumen['insertadas']}  "
+        f"Errores: {resumen['total_errores']}"
+    )
+
+
+# =====================================
+# ADMIN – ACCIONES MASIVAS SOBRE USUARIOS
+# =====================================
+#
+# Bloquear / desbloquear / reset / baja sobre una selección de ids o un
+# filtro (rol, inactividad por ultimo_acceso_en, rango de creado_en).
+# Cada acción es una sola sentencia set-based en una transacción; el
+# administrador que la ejecuta nunca se incluye. El reset hashea antes de
+# tocar filas y, desde la web, corre en segundo plano.
+
+ACCIONES_MASIVAS = ("bloquear", "desbloquear", "reset", "baja", "agregar_rol", "quitar_rol")
+RESET_PARALELO_MIN = 16  # debajo de esto no vale la pena levantar el pool
+
+
+def _filtro_usuarios_masivo(ids=None, rol=None, inactivo_dias=None,
+                            creado_desde=None, creado_hasta=None, excluir_id=None):
+    """
+    Devuelve (sql_where, params) para seguridad.usuarios u. Exige al menos
+    un criterio para no afectar a todos los usuarios por accidente.
+    """
+    condiciones, params = [], []
+    if ids:
+        condiciones.append("u.id_usuario = ANY(%s)")
+        params.append(list(ids))
+    if rol:
+        condiciones.append("""EXISTS (
+            SELECT 1 FROM seguridad.usuario_rol ur
+            JOIN seguridad.roles r ON r.id_rol = ur.id_rol
+            WHERE ur.id_usuario = u.id_usuario AND r.nombre_rol = %s)""")
+        params.append(rol)
+    if inactivo_dias is not None:
+        # Nunca accedió: cuenta desde la creación.
+        condiciones.append(
+            "COALESCE(u.ultimo_acceso_en, u.creado_en) < NOW() - make_interval(days => %s)"
+        )
+        params.append(inactivo_dias)
+    if creado_desde:
+        condiciones.append("u.creado_en >= %s")
+        params.append(creado_desde)
+    if creado_hasta:
+        condiciones.append("u.creado_en < %s::date + 1")
+        params.append(creado_hasta)
+    if not condiciones:
+        raise ValueError("Indica una selección o al menos un filtro.")
+    if excluir_id is not None:
+        condiciones.append("u.id_usuario <> %s")
+        params.append(excluir_id)
+    return " AND ".join(condiciones), params
+
+
+def _hashear_contrasenas(contrasenas, procesos=None):
+    """bcrypt de una lista; en paralelo cuando son suficientes."""
+    if len(contrasenas) < RESET_PARALELO_MIN:
+        return [_hash_password(p) for p in contrasenas]
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+        chunksize = max(1, len(contrasenas) // ((os.cpu_count() or 1) * 4))
+        return list(pool.map(_hash_password, contrasenas, chunksize=chunksize))
+
+
+def accion_masiva_usuarios(accion, filtro_sql, params, simulacion=False, actor_id=None,
+                           rol_objetivo=None):
+    """
+    Aplica `accion` a los usuarios que cumplen el filtro. Devuelve
+    {accion, seleccionados, afectados, correos_encolados, simulacion}.
+    agregar_rol / quitar_rol usan `rol_objetivo` (nombre del rol).
+    """
+    if accion not in ACCIONES_MASIVAS:
+        raise ValueError(f"Acción desconocida: {accion}")
+    if accion in ("agregar_rol", "quitar_rol") and not rol_objetivo:
+        raise ValueError("Indica el rol a asignar o quitar.")
+
+    resumen = {"accion": accion, "seleccionados": 0, "afectados": 0,
+               "correos_encolados": 0, "simulacion": simulacion}
+    conn = get_connection()
+    try:
         cur = conn.cursor()
 
-        # Primero borrar sus roles
-        cur.execute(
-            "DELETE FROM seguridad.usuario_rol WHERE id_usuario = %s;",
-            (id_usuario,),
-        )
-        # Luego borrar usuario
-        cur.execute(
-            "DELETE FROM seguridad.usuarios WHERE id_usuario = %s;",
-            (id_usuario,),
-        )
+        if accion in ("agregar_rol", "quitar_rol"):
+            cur.execute("SELECT id_rol FROM seguridad.roles WHERE nombre_rol = %s;",
+                        (rol_objetivo,))
+            row = cur.fetchone()
+            if not row:
+                raise ValueError(f"Rol desconocido: {rol_objetivo}")
+            cur.execute(f"""
+                SELECT u.id_usuario
+                FROM seguridad.usuarios u
+                WHERE {filtro_sql};
+            """, params)
+            objetivo = {r["id_usuario"]: [row["id_rol"]] for r in cur.fetchall()}
+            agregados, quitados = sincronizar_roles(
+                cur, objetivo, modo="agregar" if accion == "agregar_rol" else "quitar"
+            )
+            resumen["seleccionados"] = len(objetivo)
+            resumen["afectados"] = len(agregados) + len(quitados)
+        elif accion == "reset":
+            # bcrypt (cost 12) tarda; se calcula fuera de toda transacción y
+            # sin candados. Después, un UPDATE corto que vuelve a aplicar el
+            # filtro: quien ya no lo cumpla (o se borró) queda fuera.
+            cur.execute(f"""
+                SELECT u.id_usuario
+                FROM seguridad.usuarios u
+                WHERE {filtro_sql}
+                ORDER BY u.id_usuario;
+            """, params)
+            ids = [r["id_usuario"] for r in cur.fetchall()]
+            conn.rollback()
+            resumen["seleccionados"] = len(ids)
+            if ids and not simulacion:
+                nuevas = [generate_random_password(10) for _ in ids]
+                hashes = _hashear_contrasenas(nuevas)
+                cur.execute(f"""
+                    UPDATE seguridad.usuarios u
+                    SET contrasena_hash = v.hash
+                    FROM unnest(%s::bigint[], %s::text[]) AS v(id_usuario, hash)
+                    WHERE u.id_usuario = v.id_usuario
+                      AND {filtro_sql}
+                    RETURNING u.id_usuario, u.correo_electronico;
+                """, [ids, hashes] + list(params))
+                actualizados = cur.fetchall()
+                resumen["afectados"] = len(actualizados)
+                por_id = dict(zip(ids, nuevas))
+                mensajes = [
+                    (r["correo_electronico"], "Restablecimiento de contraseña",
+                     f"Tu nueva contraseña temporal es: {por_id[r['id_usuario']]}")
+                    for r in actualizados if r["correo_electronico"]
+                ]
+                enqueue_emails(conn, mensajes)
+                resumen["correos_encolados"] = len(mensajes)
+            else:
+                resumen["afectados"] = len(ids)
+        else:
+            if accion == "baja":
+                cambio = """
+                    DELETE FROM seguridad.usuarios u
+                    USING objetivo o
+                    WHERE u.id_usuario = o.id_usuario
+                    RETURNING u.id_usuario
+                """
+            else:
+                # Solo las cuentas que realmente cambian de estado.
+                activo = accion == "desbloquear"
+                cambio = f"""
+                    UPDATE seguridad.usuarios u
+                    SET activo = {'TRUE' if activo else 'FALSE'}
+                    FROM objetivo o
+                    WHERE u.id_usuario = o.id_usuario
+                      AND u.activo = {'FALSE' if activo else 'TRUE'}
+                    RETURNING u.id_usuario
+                """
+            cur.execute(f"""
+                WITH objetivo AS (
+                    SELECT u.id_usuario
+                    FROM seguridad.usuarios u
+                    WHERE {filtro_sql}
+                ),
+                cambio AS ({cambio})
+                SELECT (SELECT COUNT(*) FROM objetivo) AS seleccionados,
+                       (SELECT COUNT(*) FROM cambio)   AS afectados;
+            """, params)
+            row = cur.fetchone()
+            resumen["seleccionados"] = row["seleccionados"]
+            resumen["afectados"] = row["afectados"]
 
-        conn.commit()
         cur.close()
+        if simulacion:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-        flash("Usuario dado de baja (eliminado).", "info")
-    except Exception as e:
-        flash(f"Error al dar de baja al usuario: {e}", "danger")
 
-    return redirect(url_for("admin_usuarios_list", modo="baja"))
+    if not simulacion:
+        if resumen["correos_encolados"]:
+            wake_mail_workers()
+        if resumen["afectados"]:
+            audit_event(
+                f"{accion}_masivo",
+                f"Acción masiva '{accion}': {resumen['afectados']} usuarios",
+                resumen,
+                usuario_id=actor_id,
+            )
+    return resumen
 
 
-# =====================================
-# ADMIN – BLOCK / UNBLOCK
-# =====================================
+def _reset_masivo_en_segundo_plano(id_accion, filtro_sql, params, actor_id):
+    """Ejecuta el reset y guarda el resumen en seguridad.acciones_masivas."""
+    try:
+        resumen = accion_masiva_usuarios("reset", filtro_sql, params, actor_id=actor_id)
+        campos = {
+            "estado": "completada",
+            "seleccionados": resumen["seleccionados"],
+            "afectados": resumen["afectados"],
+            "correos_encolados": resumen["correos_encolados"],
+        }
+    except Exception as e:
+        print(f"Error en reset masivo: {e}")
+        audit_event("reset_masivo_error", f"Reset masivo fallido: {e}", {}, usuario_id=actor_id)
+        campos = {"estado": "fallida", "mensaje": str(e)}
 
-@app.route("/admin/usuarios/<int:id_usuario>/block", methods=["POST"])
-@login_required
-@role_required("Administrador")
-def admin_usuario_block(id_usuario):
+    conn = get_connection()
     try:
-        conn = get_connection()
         cur = conn.cursor()
-
-        # Alternar activo
+        asignaciones = ", ".join(f"{k} = %s" for k in campos)
         cur.execute(
-            """
-            UPDATE seguridad.usuarios
-            SET activo = NOT activo
-            WHERE id_usuario = %s
-            RETURNING activo;
-            """,
-            (id_usuario,),
+            f"UPDATE seguridad.acciones_masivas SET {asignaciones}, terminado_en = NOW() "
+            f"WHERE id_accion = %s;",
+            list(campos.values()) + [id_accion],
         )
-        row = cur.fetchone()
         conn.commit()
         cur.close()
+    finally:
         conn.close()
 
-        if row and row["activo"]:
-            flash("Usuario desbloqueado.", "success")
-        else:
-            flash("Usuario bloqueado.", "warning")
 
-    except Exception as e:
-        flash(f"Error al bloquear/desbloquear usuario: {e}", "danger")
-
-    return redirect(url_for("admin_usuarios_list", modo="block"))
+@app.route("/admin/usuarios/masivo", methods=["POST"])
+@login_required
+@role_required("Administrador")
+def admin_usuarios_masivo():
+    user = current_user()
+    accion = request.form.get("accion", "")
+    simulacion = request.form.get("simular") == "on"
 
+    try:
+        if request.form.get("alcance") == "seleccion":
+            ids = [int(x) for x in request.form.getlist("ids")]
+            if not ids:
+                raise ValueError("No seleccionaste ningún usuario.")
+            criterios = {"ids": ids}
+        else:
+            dias = request.form.get("inactivo_dias", "").strip()
+            criterios = {
+                "rol": request.form.get("rol") or None,
+                "inactivo_dias": int(dias) if dias else None,
+                "creado_desde": request.form.get("creado_desde") or None,
+                "creado_hasta": request.form.get("creado_hasta") or None,
+            }
+        filtro_sql, params = _filtro_usuarios_masivo(excluir_id=user["id_usuario"], **criterios)
+        if accion == "reset" and not simulacion:
+            # Miles de bcrypt no caben en una petición: se hace en segundo
+            # plano y el resumen se consulta en admin_usuarios_masivo_estado.
+            conn = get_connection()
+            try:
+                cur = conn.cursor()
+                cur.execute("""
+                    INSERT INTO seguridad.acciones_masivas (creado_por, accion)
+                    VALUES (%s, %s)
+                    RETURNING id_accion;
+                """, (user["id_usuario"], accion))
+                id_accion = cur.fetchone()["id_accion"]
+                conn.commit()
+                cur.close()
+            finally:
+                conn.close()
+            threading.Thread(
+                target=_reset_masivo_en_segundo_plano,
+                args=(id_accion, filtro_sql, params, user["id_usuario"]),
+                name=f"reset-masivo-{id_accion}",
+                daemon=True,
+            ).start()
+            if request.accept_mimetypes.best == "application/json":
+                return jsonify({
+                    "accion": accion,
+                    "id_accion": id_accion,
+                    "estado": "procesando",
+                    "url": url_for("admin_usuarios_masivo_estado", id_accion=id_accion),
+                }), 202
+            return redirect(url_for("admin_usuarios_masivo_estado", id_accion=id_accion))
+        resumen = accion_masiva_usuarios(
+            accion, filtro_sql, params, simulacion=simulacion, actor_id=user["id_usuario"],
+            rol_objetivo=request.form.get("rol_objetivo") or None,
+        )
+    except ValueError as e:
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify({"error": str(e)}), 400
+        flash(str(e), "warning")
+        return redirect(url_for("admin_usuarios_list"))
+    except Exception as e:
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify({"error": str(e)}), 500
+        flash(f"Error en la acción masiva: {e}", "danger")
+        return redirect(url_for("admin_usuarios_list"))
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(resumen)
+
+    flash(
+        f"{'[Simulación] ' if simulacion else ''}Acción '{accion}': "
+        f"{resumen['seleccionados']} usuarios seleccionados, "
+        f"{resumen['afectados']} afectados"
+        + (f", {resumen['correos_encolados']} correos encolados" if resumen["correos_encolados"] else "")
+        + ".",
+        "info" if simulacion else "success",
+    )
+    return redirect(url_for("admin_usuarios_list"))
 
-# =====================================
-# ADMIN – RESET PASSWORD
-# =====================================
 
-@app.route("/admin/usuarios/<int:id_usuario>/reset", methods=["POST"])
+@app.route("/admin/usuarios/masivo/<int:id_accion>")
 @login_required
 @role_required("Administrador")
-def admin_usuario_reset(id_usuario):
+def admin_usuarios_masivo_estado(id_accion):
+    user = current_user()
+    accion = None
+
     try:
         conn = get_connection()
         cur = conn.cursor()
-        nueva_pwd = generate_random_password(10)
-
-        # Actualizar contrasena_hash (trigger hará el hash)
-        cur.execute(
-            """
-            UPDATE seguridad.usuarios
-            SET contrasena_hash = %s
-            WHERE id_usuario = %s
-            RETURNING correo_electronico;
-            """,
-            (nueva_pwd, id_usuario),
-        )
-        row = cur.fetchone()
-        conn.commit()
+        cur.execute("""
+            SELECT *
+            FROM seguridad.acciones_masivas
+            WHERE id_accion = %s;
+        """, (id_accion,))
+        accion = cur.fetchone()
         cur.close()
         conn.close()
-
-        correo = row["correo_electronico"] if row else None
-        if correo:
-            send_email(
-                correo,
-                "Restablecimiento de contraseña",
-                f"Tu nueva contraseña temporal es: {nueva_pwd}",
-            )
-
-        flash(
-            "Contraseña restablecida y enviada por correo (si SMTP está configurado).",
-            "success",
-        )
     except Exception as e:
-        flash(f"Error al restablecer contraseña: {e}", "danger")
-
-    return redirect(url_for("admin_usuarios_list", modo="reset"))
+        flash(f"Error cargando la acción masiva: {e}", "danger")
+
+    if accion is None:
+        abort(404)
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({
+            "id_accion": accion["id_accion"],
+            "accion": accion["accion"],
+            "estado": accion["estado"],
+            "seleccionados": accion["seleccionados"],
+            "afectados": accion["afectados"],
+            "omitidos": accion["seleccionados"] - accion["afectados"],
+            "correos_encolados": accion["correos_encolados"],
+            "mensaje": accion["mensaje"],
+        })
+
+    return render_template("admin/usuarios_masivo.html", user=user, accion=accion)
+
+
+@app.cli.command("usuarios-masivo")
+@click.argument("accion", type=click.Choice(ACCIONES_MASIVAS))
+@click.option("--rol", default=None, help="Solo usuarios con este rol.")
+@click.option("--inactivo-dias", type=int, default=None,
+              help="Sin acceso (ultimo_acceso_en) en los últimos N días.")
+@click.option("--creado-desde", default=None, help="Fecha AAAA-MM-DD.")
+@click.option("--creado-hasta", default=None, help="Fecha AAAA-MM-DD (inclusive).")
+@click.option("--rol-objetivo", default=None, help="Rol a asignar o quitar (agregar_rol / quitar_rol).")
+@click.option("--simular", is_flag=True, help="Solo contar; no aplica cambios.")
+def cli_usuarios_masivo(accion, rol, inactivo_dias, creado_desde, creado_hasta, rol_objetivo, simular):
+    """Bloqueo, reset, baja o cambio de rol masivo por filtro (p.ej. egresados al cierre de ciclo)."""
+    filtro_sql, params = _filtro_usuarios_masivo(
+        rol=rol, inactivo_dias=inactivo_dias,
+        creado_desde=creado_desde, creado_hasta=creado_hasta,
+    )
+    resumen = accion_masiva_usuarios(accion, filtro_sql, params, simulacion=simular,
+                                     rol_objetivo=rol_objetivo)
+    click.echo(
+        f"{'[simulación] ' if simular else ''}{accion}: "
+        f"{resumen['seleccionados']} seleccionados, {resumen['afectados']} afectados, "
+        f"{resumen['correos_encolados']} correos encolados"
+    )
 
 
 # =====================================
@@ -2160,7 +5645,7 @@ def admin_parametros_globales():
 
 
 # =====================================
-# ADMIN – CATÁLOGOS ACADÉMICOS (con CRUD simple sobre carrera_materia)
+# ADMIN – CATÁLOGOS ACADÉMICOS (CRUD simple sobre carrera_materia y prerrequisitos)
 # =====================================
 
 @app.route("/admin/catalogos-academicos", methods=["GET", "POST"])
@@ -2172,6 +5657,7 @@ def admin_catalogos():
     carreras = []
     materias = []
     carreras_materias = []
+    prerrequisitos = []
 
     try:
         conn = get_connection()
@@ -2204,6 +5690,46 @@ def admin_catalogos():
                     conn.commit()
                     flash("Relación carrera–materia guardada correctamente.", "success")
 
+                elif form_accion == "agregar_prerrequisito":
+                    materia_id = int(request.form.get("materia_id"))
+                    prerequisito_id = int(request.form.get("prerequisito_id"))
+
+                    # Candado de escritura: dos altas simultáneas no pueden
+                    # cerrar un ciclo entre las dos sin que una lo vea.
+                    cur.execute("LOCK TABLE planes.materia_prerrequisito IN SHARE ROW EXCLUSIVE MODE;")
+                    # Aristas leídas ya con el bloqueo, no las de la caché
+                    grafo = cargar_grafo_prerrequisitos(cur)
+                    if materia_id not in grafo.bit or prerequisito_id not in grafo.bit:
+                        raise ValueError("Materia no encontrada.")
+                    if grafo.crearia_ciclo(materia_id, prerequisito_id):
+                        raise ValueError(
+                            f"{grafo.claves[prerequisito_id]} ya requiere (directa o indirectamente) "
+                            f"{grafo.claves[materia_id]}; el prerrequisito formaría un ciclo."
+                        )
+                    cur.execute(
+                        """
+                        INSERT INTO planes.materia_prerrequisito (materia_id, prerequisito_id)
+                        VALUES (%s, %s)
+                        ON CONFLICT DO NOTHING;
+                        """,
+                        (materia_id, prerequisito_id),
+                    )
+                    conn.commit()
+                    flash("Prerrequisito agregado.", "success")
+
+                elif form_accion == "eliminar_prerrequisito":
+                    materia_id = int(request.form.get("materia_id"))
+                    prerequisito_id = int(request.form.get("prerequisito_id"))
+                    cur.execute(
+                        """
+                        DELETE FROM planes.materia_prerrequisito
+                        WHERE materia_id = %s AND prerequisito_id = %s;
+                        """,
+                        (materia_id, prerequisito_id),
+                    )
+                    conn.commit()
+                    flash("Prerrequisito eliminado.", "info")
+
                 elif form_accion == "eliminar_relacion":
                     cm_id = int(request.form.get("carrera_materia_id"))
                     cur.execute(
@@ -2259,6 +5785,24 @@ def admin_catalogos():
         )
         carreras_materias = cur.fetchall()
 
+        # Prerrequisitos directos
+        cur.execute(
+            """
+            SELECT
+                mp.materia_id,
+                mp.prerequisito_id,
+                m.clave AS materia_clave,
+                m.nombre AS materia_nombre,
+                r.clave AS prerequisito_clave,
+                r.nombre AS prerequisito_nombre
+            FROM planes.materia_prerrequisito mp
+            JOIN planes.materia m ON m.materia_id = mp.materia_id
+            JOIN planes.materia r ON r.materia_id = mp.prerequisito_id
+            ORDER BY m.clave, r.clave;
+            """
+        )
+        prerrequisitos = cur.fetchall()
+
         cur.close()
         conn.close()
     except Exception as e:
@@ -2271,6 +5815,7 @@ def admin_catalogos():
         carreras=carreras,
         materias=materias,
         carreras_materias=carreras_materias,
+        prerrequisitos=prerrequisitos,
     )
 
 
@@ -2460,49 +6005,38 @@ def admin_formulario_eliminar(id_formulario):
 @role_required("Administrador")
 def admin_datos_seguridad():
     user = current_user()
+    filtros, despues, page_size = _args_directorio_usuarios()
     resumen = []
     usuarios = []
+    roles = []
+    siguiente = None
 
     try:
         conn = get_connection()
         cur = conn.cursor()
 
-        # Resumen por rol y estado (activo/bloqueado)
+        # Resumen por rol y estado (tabla de contadores mantenida por triggers)
         cur.execute(
             """
             SELECT
                 COALESCE(r.nombre_rol, 'Sin rol') AS rol,
-                CASE WHEN u.activo THEN 'Activo' ELSE 'Bloqueado' END AS estado,
-                COUNT(*) AS total
-            FROM seguridad.usuarios u
-            LEFT JOIN seguridad.usuario_rol ur ON ur.id_usuario = u.id_usuario
-            LEFT JOIN seguridad.roles r ON r.id_rol = ur.id_rol
-            GROUP BY rol, estado
+                CASE WHEN c.activo THEN 'Activo' ELSE 'Bloqueado' END AS estado,
+                c.total
+            FROM seguridad.resumen_usuarios_rol c
+            LEFT JOIN seguridad.roles r ON r.id_rol = c.id_rol
+            WHERE c.total > 0
             ORDER BY rol, estado;
             """
         )
         resumen = cur.fetchall()
 
-        # Lista de usuarios (solo lectura)
-        cur.execute(
-            """
-            SELECT
-                u.id_usuario,
-                u.nombre_usuario,
-                u.correo_electronico,
-                u.activo,
-                COALESCE(
-                    STRING_AGG(DISTINCT r.nombre_rol, ', ' ORDER BY r.nombre_rol),
-                    'Sin rol'
-                ) AS roles
-            FROM seguridad.usuarios u
-            LEFT JOIN seguridad.usuario_rol ur ON ur.id_usuario = u.id_usuario
-            LEFT JOIN seguridad.roles r ON r.id_rol = ur.id_rol
-            GROUP BY u.id_usuario, u.nombre_usuario, u.correo_electronico, u.activo
-            ORDER BY u.id_usuario;
-            """
+        # Lista de usuarios (solo lectura, paginada)
+        usuarios, siguiente = _pagina_directorio_usuarios(
+            cur, despues=despues, page_size=page_size, **filtros
         )
-        usuarios = cur.fetchall()
+
+        cur.execute("SELECT nombre_rol FROM seguridad.roles ORDER BY nombre_rol;")
+        roles = [r["nombre_rol"] for r in cur.fetchall()]
 
         cur.close()
         conn.close()
@@ -2512,8 +6046,13 @@ def admin_datos_seguridad():
     return render_template(
         "admin/datos_seguridad.html",
         user=user,
-        resumen=resumen,      # lista de tuplas (rol, estado, total)
-        usuarios=usuarios     # lista de tuplas (id, nombre, correo, activo, roles)
+        resumen=resumen,      # lista de (rol, estado, total)
+        usuarios=usuarios,    # página de (id, nombre, correo, activo, roles[])
+        roles=roles,
+        filtros=filtros,
+        page_size=page_size,
+        siguiente=siguiente,
+        es_primera=despues is None,
     )
 
 
@@ -2521,19 +6060,109 @@ def admin_datos_seguridad():
 # ADMIN – CONSOLA DE EVENTOS
 # =====================================
 
+EVENTOS_PAGE_SIZE = 50
+EVENTOS_PAGE_MAX = 200
+
+
+def _parse_fecha_filtro(valor):
+    """Convierte 'YYYY-MM-DDTHH:MM' (input datetime-local) en datetime o None."""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor)
+    except ValueError:
+        flash(f"Fecha inválida ignorada: {valor}", "warning")
+        return None
+
+
+def _parse_cursor_eventos(valor):
+    """Cursor de paginación por llave: '<intentado_en ISO>|<id_intento>'."""
+    if not valor:
+        return None
+    try:
+        fecha, id_intento = valor.rsplit("|", 1)
+        return datetime.fromisoformat(fecha), int(id_intento)
+    except ValueError:
+        return None
+
+
 @app.route("/admin/eventos")
 @login_required
 @role_required("Administrador")
 def admin_eventos():
+    """
+    Consola de intentos de inicio de sesión.
+
+    - Filtros: rango de fechas, IP (o red CIDR), identificador y resultado.
+    - Paginación por llave (intentado_en, id_intento) sobre índices
+      idx_intentos_login_*; nunca usa OFFSET.
+    - Gráficas desde seguridad.resumen_login_*_hora, no desde la tabla cruda.
+    """
     user = current_user()
     eventos = []
+    serie = []
+    top_ips = []
+    top_usuarios = []
+    siguiente = None
+
+    filtros_form = {
+        "desde": request.args.get("desde", "").strip(),
+        "hasta": request.args.get("hasta", "").strip(),
+        "ip": request.args.get("ip", "").strip(),
+        "identificador": request.args.get("identificador", "").strip(),
+        "exitoso": request.args.get("exitoso", "").strip(),
+    }
+    try:
+        page_size = int(request.args.get("n", EVENTOS_PAGE_SIZE))
+    except ValueError:
+        page_size = EVENTOS_PAGE_SIZE
+    page_size = max(1, min(page_size, EVENTOS_PAGE_MAX))
+
+    desde = _parse_fecha_filtro(filtros_form["desde"])
+    hasta = _parse_fecha_filtro(filtros_form["hasta"])
+    cursor = _parse_cursor_eventos(request.args.get("despues", ""))
+
+    ip = filtros_form["ip"]
+    if ip:
+        try:
+            ip = str(ipaddress.ip_network(ip, strict=False))
+        except ValueError:
+            flash(f"IP o red inválida ignorada: {ip}", "warning")
+            ip = ""
 
+    conn = None
     try:
         conn = get_connection()
         cur = conn.cursor()
-        # Usamos seguridad.intentos_login como "eventos" (demo)
-        cur.execute(
-            """
+
+        # ------------------ DETALLE (paginación por llave) ------------------
+        condiciones = []
+        params = []
+        if desde:
+            condiciones.append("il.intentado_en >= %s")
+            params.append(desde)
+        if hasta:
+            condiciones.append("il.intentado_en < %s")
+            params.append(hasta)
+        if ip:
+            condiciones.append("il.direccion_ip <<= %s::inet")
+            params.append(ip)
+        if filtros_form["identificador"]:
+            condiciones.append("LOWER(il.identificador) = LOWER(%s)")
+            params.append(filtros_form["identificador"])
+        if filtros_form["exitoso"] in ("1", "0"):
+            condiciones.append("il.exitoso = %s")
+            params.append(filtros_form["exitoso"] == "1")
+        if cursor:
+            # La condición simple sobre intentado_en permite la poda de
+            # particiones; la comparación de fila sola no la permite.
+            condiciones.append("il.intentado_en <= %s")
+            condiciones.append("(il.intentado_en, il.id_intento) < (%s, %s)")
+            params.append(cursor[0])
+            params.extend(cursor)
+
+        where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+        cur.execute(f"""
             SELECT
                 il.id_intento,
                 il.intentado_en,
@@ -2545,23 +6174,99 @@ def admin_eventos():
             FROM seguridad.intentos_login il
             LEFT JOIN seguridad.usuarios u
               ON u.id_usuario = il.id_usuario
-            ORDER BY il.intentado_en DESC
-            LIMIT 50;
-            """
-        )
+            {where}
+            ORDER BY il.intentado_en DESC, il.id_intento DESC
+            LIMIT %s;
+        """, params + [page_size + 1])
         eventos = cur.fetchall()
+        if len(eventos) > page_size:
+            eventos = eventos[:page_size]
+            ultimo = eventos[-1]
+            siguiente = f"{ultimo['intentado_en'].isoformat()}|{ultimo['id_intento']}"
+
+        # ------------------ GRÁFICAS (resúmenes por hora) ------------------
+        fin = hasta or datetime.now()
+        inicio = desde or (fin - timedelta(hours=24))
+
+        cond_ip = ""
+        params_ip = [inicio, fin]
+        if ip:
+            cond_ip = "AND direccion_ip <<= %s::inet"
+            params_ip.append(ip)
+        cond_usr = ""
+        params_usr = [inicio, fin]
+        if filtros_form["identificador"]:
+            cond_usr = "AND identificador = LOWER(%s)"
+            params_usr.append(filtros_form["identificador"])
+
+        if filtros_form["identificador"] and not ip:
+            tabla_serie, cond_serie, params_serie = (
+                "seguridad.resumen_login_usuario_hora", cond_usr, params_usr
+            )
+        else:
+            tabla_serie, cond_serie, params_serie = (
+                "seguridad.resumen_login_ip_hora", cond_ip, params_ip
+            )
+
+        cur.execute(f"""
+            SELECT hora, SUM(intentos) AS intentos, SUM(fallidos) AS fallidos
+            FROM {tabla_serie}
+            WHERE hora >= date_trunc('hour', %s::timestamptz)
+              AND hora < %s
+              {cond_serie}
+            GROUP BY hora
+            ORDER BY hora;
+        """, params_serie)
+        serie = cur.fetchall()
+
+        cur.execute(f"""
+            SELECT direccion_ip, SUM(intentos) AS intentos, SUM(fallidos) AS fallidos
+            FROM seguridad.resumen_login_ip_hora
+            WHERE hora >= date_trunc('hour', %s::timestamptz)
+              AND hora < %s
+              {cond_ip}
+            GROUP BY direccion_ip
+            ORDER BY fallidos DESC, intentos DESC
+            LIMIT 10;
+        """, params_ip)
+        top_ips = cur.fetchall()
+
+        cur.execute(f"""
+            SELECT identificador, SUM(intentos) AS intentos, SUM(fallidos) AS fallidos
+            FROM seguridad.resumen_login_usuario_hora
+            WHERE hora >= date_trunc('hour', %s::timestamptz)
+              AND hora < %s
+              {cond_usr}
+            GROUP BY identificador
+            ORDER BY fallidos DESC, intentos DESC
+            LIMIT 10;
+        """, params_usr)
+        top_usuarios = cur.fetchall()
+
         cur.close()
         conn.close()
     except Exception as e:
+        if conn and not conn.closed:
+            conn.close()
         flash(
             f"Error cargando consola de eventos (intentos de login): {e}",
             "danger",
         )
 
+    max_serie = max((r["intentos"] for r in serie), default=0)
+
     return render_template(
         "admin/eventos.html",
         user=user,
         eventos=eventos,
+        filtros=filtros_form,
+        page_size=page_size,
+        siguiente=siguiente,
+        es_primera=cursor is None,
+        serie=serie,
+        max_serie=max_serie,
+        top_ips=top_ips,
+        top_usuarios=top_usuarios,
     )
 
 
@@ -2585,6 +6290,111 @@ def estado_loading_demo():
 def estado_reload_demo():
     return render_template("components/reload_state.html")
 
+# =====================================
+# COORDINADOR – VISTAS MATERIALIZADAS
+# =====================================
+#
+# Los paneles del coordinador leen planes.mv_* (ver 4.h en el SQL). Cada
+# cambio en las tablas fuente avanza planes.seq_vistas_coordinador; al
+# cargar un panel, si hay cambios sin refrescar y el último refresco tiene
+# al menos VISTAS_COORDINADOR_MIN_SEGUNDOS, se lanza un refresco
+# CONCURRENTLY en segundo plano (la página no espera). Pasados
+# VISTAS_COORDINADOR_MAX_SEGUNDOS se refresca aunque no haya cambios
+# registrados: la secuencia avanza antes del commit de quien cambia, y un
+# cambio confirmado a media actualización podría quedar fuera.
+
+VISTAS_COORDINADOR = (
+    "planes.mv_materia_alta_detalle",
+    "planes.mv_resumen_ciclo_carrera",
+    "planes.mv_resumen_ciclo",
+)
+VISTAS_COORDINADOR_MIN_SEGUNDOS = int(os.getenv("VISTAS_COORDINADOR_MIN_SEGUNDOS", "60"))
+VISTAS_COORDINADOR_MAX_SEGUNDOS = int(os.getenv("VISTAS_COORDINADOR_MAX_SEGUNDOS", "900"))
+
+_vistas_lock = threading.Lock()
+_vistas_hilo = None
+
+_CONSULTA_ESTADO_VISTAS = """
+    SELECT
+        e.version_refrescada,
+        e.refrescado_en,
+        s.version,
+        EXTRACT(EPOCH FROM now() - e.refrescado_en) AS antiguedad
+    FROM planes.vistas_coordinador_estado e
+    CROSS JOIN (
+        SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version
+        FROM planes.seq_vistas_coordinador
+    ) s
+"""
+
+
+def _vistas_pendientes(estado):
+    return (estado["version"] > estado["version_refrescada"]
+            or estado["antiguedad"] >= VISTAS_COORDINADOR_MAX_SEGUNDOS)
+
+
+def refrescar_vistas_coordinador(conn, forzar=False):
+    """
+    Refresca las vistas materializadas del coordinador si hay cambios
+    pendientes (o siempre, con forzar). Si otra sesión ya está
+    refrescando no hace nada. Devuelve True si refrescó.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(_CONSULTA_ESTADO_VISTAS + " FOR UPDATE OF e SKIP LOCKED;")
+        estado = cur.fetchone()
+        if estado is None or not (forzar or _vistas_pendientes(estado)):
+            conn.rollback()
+            return False
+        for vista in VISTAS_COORDINADOR:
+            cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {vista};")
+        cur.execute("""
+            UPDATE planes.vistas_coordinador_estado
+            SET version_refrescada = %s,
+                refrescado_en = now();
+        """, (estado["version"],))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _refrescar_vistas_en_segundo_plano():
+    conn = None
+    try:
+        conn = get_connection()
+        refrescar_vistas_coordinador(conn)
+    except Exception as e:
+        print(f"Error refrescando vistas del coordinador: {e}")
+    finally:
+        if conn and not conn.closed:
+            conn.close()
+
+
+def estado_vistas_coordinador(cur):
+    """
+    Estado para mostrar en los paneles ({refrescado_en, pendiente}); si hay
+    cambios y ya pasó el intervalo mínimo, pide un refresco en segundo plano.
+    """
+    global _vistas_hilo
+    cur.execute(_CONSULTA_ESTADO_VISTAS + ";")
+    estado = cur.fetchone()
+    pendiente = _vistas_pendientes(estado)
+    if pendiente and estado["antiguedad"] >= VISTAS_COORDINADOR_MIN_SEGUNDOS:
+        with _vistas_lock:
+            if _vistas_hilo is None or not _vistas_hilo.is_alive():
+                _vistas_hilo = threading.Thread(
+                    target=_refrescar_vistas_en_segundo_plano,
+                    name="vistas-coordinador",
+                    daemon=True,
+                )
+                _vistas_hilo.start()
+    return {"refrescado_en": estado["refrescado_en"], "pendiente": pendiente}
+
+
 # =====================================
 # PERFIL – COORDINADOR
 # =====================================
@@ -2598,7 +6408,9 @@ def perfil_coordinador():
 
     Muestra:
       - Resumen académico (carreras, materias, docentes, alumnos) por ciclo.
-      - Tabla de grupos/materias usando planes.vw_materia_alta_detalle.
+      - Tabla de grupos/materias.
+    Ambos salen de las vistas materializadas planes.mv_resumen_ciclo y
+    planes.mv_materia_alta_detalle.
 
     Además calcula un ciclo_actual:
       1) academico.parametros_globales (clave='ciclo_activo')
@@ -2617,6 +6429,7 @@ def perfil_coordinador():
     materias = []
     ciclo_actual = None
     primer_grupo_id = None
+    vistas = None
 
     try:
         conn = get_connection()
@@ -2649,36 +6462,13 @@ def perfil_coordinador():
             ciclo_actual = "2025-1"
 
         # ------------------ RESUMEN ACADÉMICO ------------------
-        # Carreras, materias y docentes desde la vista de detalle
-        cur.execute("""
-            SELECT
-                COUNT(DISTINCT carrera_clave) AS carreras_activas,
-                COUNT(DISTINCT materia_clave) AS materias_en_plan,
-                COUNT(
-                    DISTINCT COALESCE(profesor_nombre, '') || ' ' ||
-                             COALESCE(profesor_ap, '')
-                ) AS docentes
-            FROM planes.vw_materia_alta_detalle
-            WHERE ciclo = %s
-              AND esta_activo = TRUE;
-        """, (ciclo_actual,))
-        row = cur.fetchone()
-        if row:
-            resumen["carreras_activas"] = row["carreras_activas"] or 0
-            resumen["materias_en_plan"] = row["materias_en_plan"] or 0
-            resumen["docentes"] = row["docentes"] or 0
-
-        # Alumnos distintos con inscripción en ese ciclo
+        vistas = estado_vistas_coordinador(cur)
         cur.execute("""
-            SELECT COUNT(DISTINCT ai.fk_alumno) AS alumnos
-            FROM academico.alumno_inscripcion ai
-            JOIN planes.materia_alta ma
-              ON ma.materia_alta_id = ai.fk_materia_alta
-            WHERE ma.ciclo = %s;
+            SELECT carreras_activas, materias_en_plan, docentes, alumnos
+            FROM planes.mv_resumen_ciclo
+            WHERE ciclo = %s;
         """, (ciclo_actual,))
-        row = cur.fetchone()
-        if row:
-            resumen["alumnos"] = row["alumnos"] or 0
+        resumen.update(cur.fetchone() or {})
 
         # ------------------ TABLA GRUPOS Y MATERIAS ------------------
         cur.execute("""
@@ -2689,9 +6479,9 @@ def perfil_coordinador():
               materia_clave,
               materia_nombre,
               semestre,
-              COALESCE(profesor_nombre || ' ' || profesor_ap, 'Sin asignar') AS docente,
+              docente,
               esta_activo
-            FROM planes.vw_materia_alta_detalle
+            FROM planes.mv_materia_alta_detalle
             WHERE ciclo = %s
             ORDER BY semestre, materia_clave;
         """, (ciclo_actual,))
@@ -2714,6 +6504,7 @@ def perfil_coordinador():
         ciclo_actual=ciclo_actual,
         materias=materias,
         primer_grupo_id=primer_grupo_id,
+        vistas=vistas,
     )
 
 
@@ -2789,17 +6580,198 @@ def coord_asignacion_espacios():
             conn.close()
         flash(f"Error cargando asignación de espacios: {e}", "danger")
 
-    return render_template(
-        "coordinador/asignacion_espacios.html",
-        user=user,
-        ciclo_actual=ciclo_actual,
-        asignaciones=asignaciones,
-    )
+    return render_template(
+        "coordinador/asignacion_espacios.html",
+        user=user,
+        ciclo_actual=ciclo_actual,
+        asignaciones=asignaciones,
+    )
+
+
+# =====================================
+# COORDINADOR – ESTADÍSTICAS DE CALIFICACIONES
+# =====================================
+#
+# Las calificaciones de un ciclo se leen en una sola consulta (cada grupo
+# con su arreglo de calificaciones) y se aplanan a columnas (grupo,
+# calificación); todas las estadísticas se sacan con reducciones
+# agrupadas de NumPy (bincount / lexsort), sin una consulta por grupo.
+# El resultado se guarda en memoria por ciclo junto con la
+# versión de los datos (suma de las versiones por grupo del ciclo, 4.g;
+# secuencia de 4.h y calificación aprobatoria) y se recalcula cuando esa
+# versión cambia. Las versiones por grupo son transaccionales; la secuencia
+# de grupos avanza antes del commit, así que además cada entrada caduca
+# tras ESTADISTICAS_TTL_SEGUNDOS.
+
+ESTADISTICAS_BINS = 10  # histograma 0-9, 10-19, …, 90-100
+ESTADISTICAS_TTL_SEGUNDOS = int(os.getenv("ESTADISTICAS_TTL_SEGUNDOS", "900"))
+
+_estadisticas_lock = threading.Lock()
+_estadisticas_cache = {}
+
+
+def _estadisticas_agrupadas(grupo, valores, n_grupos, aprobatoria):
+    """
+    Estadísticas de `valores` agrupados por `grupo` (índices 0..n_grupos-1).
+    Los NaN (sin calificación) cuentan como inscritos pero no entran en las
+    estadísticas. Devuelve un dict de arreglos de longitud n_grupos.
+    """
+    inscritos = np.bincount(grupo, minlength=n_grupos)
+
+    calificada = ~np.isnan(valores)
+    g = grupo[calificada]
+    x = valores[calificada]
+    n = np.bincount(g, minlength=n_grupos)
+    con_datos = n > 0
+    divisor = np.where(con_datos, n, 1)
+
+    media = np.bincount(g, weights=x, minlength=n_grupos) / divisor
+    varianza = np.bincount(g, weights=(x - media[g]) ** 2, minlength=n_grupos) / divisor
+    aprobados = np.bincount(g, weights=(x >= aprobatoria), minlength=n_grupos)
+
+    # Mediana: ordenar por (grupo, calificación) y tomar el centro de cada tramo
+    ordenados = x[np.lexsort((x, g))]
+    inicio = np.concatenate(([0], np.cumsum(n)[:-1]))
+    bajo = np.minimum(inicio + (n - 1) // 2, max(len(ordenados) - 1, 0))
+    alto = np.minimum(inicio + n // 2, max(len(ordenados) - 1, 0))
+    if len(ordenados):
+        mediana = (ordenados[bajo] + ordenados[alto]) / 2
+    else:
+        mediana = np.zeros(n_grupos)
+
+    cubeta = np.minimum((x // (100 / ESTADISTICAS_BINS)).astype(np.int64), ESTADISTICAS_BINS - 1)
+    histograma = np.bincount(
+        g * ESTADISTICAS_BINS + cubeta, minlength=n_grupos * ESTADISTICAS_BINS
+    ).reshape(n_grupos, ESTADISTICAS_BINS)
+
+    vacio = np.where(con_datos, 1.0, np.nan)
+    return {
+        "inscritos": inscritos,
+        "calificados": n,
+        "media": media * vacio,
+        "mediana": mediana * vacio,
+        "desviacion": np.sqrt(varianza) * vacio,
+        "aprobacion": aprobados / divisor * 100 * vacio,
+        "histograma": histograma,
+    }
+
+
+def _filas_estadisticas(stats, etiquetas):
+    """Convierte los arreglos de _estadisticas_agrupadas en filas para la plantilla."""
+    def numero(v):
+        return None if np.isnan(v) else round(float(v), 2)
+
+    filas = []
+    for i, etiqueta in enumerate(etiquetas):
+        fila = dict(etiqueta)
+        fila.update(
+            inscritos=int(stats["inscritos"][i]),
+            calificados=int(stats["calificados"][i]),
+            media=numero(stats["media"][i]),
+            mediana=numero(stats["mediana"][i]),
+            desviacion=numero(stats["desviacion"][i]),
+            aprobacion=numero(stats["aprobacion"][i]),
+            histograma=stats["histograma"][i].tolist(),
+        )
+        filas.append(fila)
+    return filas
+
+
+def _calcular_estadisticas_ciclo(cur, ciclo, aprobatoria):
+    # Grupos y calificaciones en una sola sentencia: con dos, un grupo
+    # creado entre ambas dejaría calificaciones sin grupo en la lista.
+    cur.execute("""
+        SELECT
+          ma.materia_alta_id,
+          c.clave  AS carrera_clave,
+          c.nombre AS carrera_nombre,
+          cm.semestre,
+          m.clave  AS materia_clave,
+          m.nombre AS materia_nombre,
+          COALESCE(p.nombre || ' ' || p.apellido_paterno, 'Sin asignar') AS docente,
+          COALESCE(
+            array_agg(ai.calificacion::float8) FILTER (WHERE ai.inscripcion_id IS NOT NULL),
+            '{}')  AS calificaciones
+        FROM planes.materia_alta ma
+        JOIN planes.carrera_materia cm ON cm.carrera_materia_id = ma.carrera_materia_id
+        JOIN planes.carrera c ON c.carrera_id = cm.carrera_id
+        JOIN planes.materia m ON m.materia_id = cm.materia_id
+        LEFT JOIN rrhh.personal p ON p.id_personal = ma.fk_personal
+        LEFT JOIN academico.alumno_inscripcion ai ON ai.fk_materia_alta = ma.materia_alta_id
+        WHERE ma.ciclo = %s
+        GROUP BY ma.materia_alta_id, c.clave, c.nombre, cm.semestre, m.clave, m.nombre,
+                 p.nombre, p.apellido_paterno
+        ORDER BY c.clave, cm.semestre, m.clave, ma.materia_alta_id;
+    """, (ciclo,))
+    grupos = cur.fetchall()
+
+    # Columnas (índice de grupo, calificación); NULL -> NaN
+    tamanos = np.array([len(g["calificaciones"]) for g in grupos], dtype=np.int64)
+    grupo = np.repeat(np.arange(len(grupos), dtype=np.int64), tamanos)
+    valores = np.array(
+        [v for g in grupos for v in g.pop("calificaciones")], dtype=np.float64
+    )
+
+    por_grupo = _estadisticas_agrupadas(grupo, valores, len(grupos), aprobatoria)
+
+    # Mismo cálculo con la llave (carrera, semestre)
+    claves = [(g["carrera_clave"], g["semestre"]) for g in grupos]
+    secciones = sorted(set(claves))
+    indice_seccion = {k: i for i, k in enumerate(secciones)}
+    seccion_de_grupo = np.array([indice_seccion[k] for k in claves], dtype=np.int64)
+    por_seccion = _estadisticas_agrupadas(
+        seccion_de_grupo[grupo] if len(grupo) else grupo,
+        valores, len(secciones), aprobatoria,
+    )
+
+    nombres = {g["carrera_clave"]: g["carrera_nombre"] for g in grupos}
+    resultado = _filas_estadisticas(
+        por_seccion,
+        [{"carrera_clave": c, "carrera_nombre": nombres[c], "semestre": s, "grupos": []}
+         for c, s in secciones],
+    )
+    for fila, k in zip(_filas_estadisticas(por_grupo, grupos), claves):
+        resultado[indice_seccion[k]]["grupos"].append(fila)
+    return resultado
+
+
+def estadisticas_calificaciones(cur, ciclo):
+    """
+    Estadísticas de calificaciones del ciclo por carrera y semestre, cada
+    sección con sus grupos (media, mediana, desviación, % de aprobación e
+    histograma). Usa la caché mientras la versión de los datos no cambie.
+    """
+    cur.execute("""
+        SELECT
+          (SELECT COALESCE(SUM(i.version), 0)
+             FROM planes.materia_alta_inscritos i
+             JOIN planes.materia_alta ma ON ma.materia_alta_id = i.materia_alta_id
+             WHERE ma.ciclo = %s)                     AS calificaciones,
+          (SELECT CASE WHEN is_called THEN last_value ELSE 0 END
+             FROM planes.seq_vistas_coordinador)      AS grupos,
+          COALESCE((SELECT valor_texto FROM academico.parametros_globales
+                    WHERE clave = 'calificacion_aprobatoria'), '70') AS aprobatoria;
+    """, (ciclo,))
+    row = cur.fetchone()
+    aprobatoria = float(row["aprobatoria"])
+    version = (row["calificaciones"], row["grupos"], aprobatoria)
+
+    ahora = time.monotonic()
+    with _estadisticas_lock:
+        guardado = _estadisticas_cache.get(ciclo)
+    if (guardado and guardado[0] == version
+            and ahora - guardado[1] < ESTADISTICAS_TTL_SEGUNDOS):
+        return guardado[2]
+
+    resultado = _calcular_estadisticas_ciclo(cur, ciclo, aprobatoria)
+    with _estadisticas_lock:
+        _estadisticas_cache[ciclo] = (version, ahora, resultado)
+    return resultado
 
 
 # =====================================
 # COORDINADOR – REPORTES ACADÉMICOS
-# (resumen simple por carrera/materia)
+# (resumen por carrera y estadísticas de calificaciones)
 # =====================================
 
 @app.route("/coordinador/reportes")
@@ -2810,6 +6782,8 @@ def coord_reportes_academicos():
     conn = None
     ciclo_actual = None
     resumen_carrera = []
+    estadisticas = []
+    vistas = None
 
     try:
         conn = get_connection()
@@ -2835,20 +6809,18 @@ def coord_reportes_academicos():
             ciclo_actual = row["ciclo"] if row else "2025-1"
 
         # Resumen por carrera
+        vistas = estado_vistas_coordinador(cur)
         cur.execute("""
-            SELECT
-              v.carrera_clave,
-              v.carrera_nombre,
-              COUNT(DISTINCT v.materia_clave)      AS materias,
-              COUNT(DISTINCT v.materia_alta_id)    AS grupos,
-              COUNT(DISTINCT v.profesor_nombre || ' ' || v.profesor_ap) AS docentes
-            FROM planes.vw_materia_alta_detalle v
-            WHERE v.ciclo = %s
-            GROUP BY v.carrera_clave, v.carrera_nombre
-            ORDER BY v.carrera_clave;
+            SELECT carrera_clave, carrera_nombre, materias, grupos, docentes
+            FROM planes.mv_resumen_ciclo_carrera
+            WHERE ciclo = %s
+            ORDER BY carrera_clave;
         """, (ciclo_actual,))
         resumen_carrera = cur.fetchall()
 
+        # Estadísticas de calificaciones por carrera, semestre y grupo
+        estadisticas = estadisticas_calificaciones(cur, ciclo_actual)
+
         cur.close()
         conn.close()
 
@@ -2862,6 +6834,8 @@ def coord_reportes_academicos():
         user=user,
         ciclo_actual=ciclo_actual,
         resumen_carrera=resumen_carrera,
+        estadisticas=estadisticas,
+        vistas=vistas,
     )
 
 
@@ -2942,6 +6916,7 @@ def coord_carga_academica():
     conn = None
     ciclo_actual = None
     carga = []
+    vistas = None
 
     try:
         conn = get_connection()
@@ -2965,24 +6940,23 @@ def coord_carga_academica():
             row = cur.fetchone()
             ciclo_actual = row["ciclo"] if row else "2025-1"
 
+        vistas = estado_vistas_coordinador(cur)
         cur.execute("""
             SELECT
-              v.materia_alta_id,
-              v.ciclo,
-              v.carrera_clave,
-              v.materia_clave,
-              v.materia_nombre,
-              v.semestre,
-              COALESCE(v.profesor_nombre || ' ' || v.profesor_ap, 'Sin asignar') AS docente,
-              v.esta_activo,
-              cm.horas_teoricas,
-              cm.horas_practicas,
-              cm.horas_totales
-            FROM planes.vw_materia_alta_detalle v
-            JOIN planes.carrera_materia cm
-              ON cm.carrera_materia_id = v.carrera_materia_id
-            WHERE v.ciclo = %s
-            ORDER BY v.semestre, v.materia_clave;
+              materia_alta_id,
+              ciclo,
+              carrera_clave,
+              materia_clave,
+              materia_nombre,
+              semestre,
+              docente,
+              esta_activo,
+              horas_teoricas,
+              horas_practicas,
+              horas_totales
+            FROM planes.mv_materia_alta_detalle
+            WHERE ciclo = %s
+            ORDER BY semestre, materia_clave;
         """, (ciclo_actual,))
         carga = cur.fetchall()
 
@@ -2999,9 +6973,793 @@ def coord_carga_academica():
         user=user,
         ciclo_actual=ciclo_actual,
         carga=carga,
+        vistas=vistas,
+    )
+
+
+
+
+# =====================================
+# MANTENIMIENTO – BITÁCORAS PARTICIONADAS (CLI)
+# =====================================
+
+# tabla -> (columna id, columna de partición)
+BITACORAS_PARTICIONADAS = {
+    "intentos_login": ("id_intento", "intentado_en"),
+    "eventos": ("id_evento", "fecha"),
+}
+BITACORA_MESES_ADELANTE = int(os.getenv("BITACORA_MESES_ADELANTE", "3"))
+BITACORA_RETENCION_MESES = int(os.getenv("BITACORA_RETENCION_MESES", "12"))
+
+
+def _es_particionada(cur, tabla):
+    cur.execute("""
+        SELECT c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'seguridad' AND c.relname = %s;
+    """, (tabla,))
+    row = cur.fetchone()
+    return bool(row) and row["relkind"] == "p"
+
+
+def _particionar_bitacora(conn, tabla, col_id, col_fecha, intentos_lock=5):
+    """
+    Convierte seguridad.<tabla> en tabla particionada por mes sin bloqueos
+    largos. `conn` debe estar en autocommit.
+
+    1. Índice único (id, fecha) con CREATE INDEX CONCURRENTLY.
+    2. CHECK (fecha < límite) NOT VALID + VALIDATE (no bloquea escrituras).
+    3. Transacción corta (lock_timeout): renombrar a <tabla>_legacy, crear la
+       tabla particionada con el nombre original (índices, FKs, triggers y
+       permisos equivalentes) y adjuntar la anterior como partición
+       (MINVALUE, límite). El CHECK validado evita re-escanearla y los
+       índices equivalentes se reutilizan.
+    """
+    cur = conn.cursor()
+    if _es_particionada(cur, tabla):
+        cur.close()
+        return False
+
+    legacy = f"{tabla}_legacy"
+    ck = f"ck_{tabla}_legacy_rango"
+
+    cur.execute(
+        "SELECT (date_trunc('month', NOW()) + INTERVAL '1 month') AS limite;"
+    )
+    limite = cur.fetchone()["limite"]
+
+    cur.execute(
+        f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_{tabla}_id_fecha "
+        f"ON seguridad.{tabla} ({col_id}, {col_fecha});"
     )
+    cur.execute(f"ALTER TABLE seguridad.{tabla} DROP CONSTRAINT IF EXISTS {ck};")
+    cur.execute(
+        f"ALTER TABLE seguridad.{tabla} ADD CONSTRAINT {ck} "
+        f"CHECK ({col_fecha} < %s) NOT VALID;",
+        (limite,),
+    )
+    cur.execute(f"ALTER TABLE seguridad.{tabla} VALIDATE CONSTRAINT {ck};")
+
+    for intento in range(intentos_lock):
+        try:
+            cur.execute("BEGIN;")
+            cur.execute("SET LOCAL lock_timeout = '5s';")
+
+            # Definiciones a replicar en la tabla nueva
+            cur.execute("""
+                SELECT i.indexrelid::regclass::text AS nombre,
+                       pg_get_indexdef(i.indexrelid)  AS definicion
+                FROM pg_index i
+                WHERE i.indrelid = %s::regclass
+                  AND NOT i.indisprimary
+                  AND NOT i.indisunique;
+            """, (f"seguridad.{tabla}",))
+            indices = cur.fetchall()
+            cur.execute("""
+                SELECT conname, pg_get_constraintdef(oid) AS definicion
+                FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype = 'f';
+            """, (f"seguridad.{tabla}",))
+            fks = cur.fetchall()
+            cur.execute("""
+                SELECT tgname, pg_get_triggerdef(oid) AS definicion
+                FROM pg_trigger
+                WHERE tgrelid = %s::regclass AND NOT tgisinternal;
+            """, (f"seguridad.{tabla}",))
+            triggers = cur.fetchall()
+            cur.execute("""
+                SELECT grantee, privilege_type
+                FROM information_schema.role_table_grants
+                WHERE table_schema = 'seguridad' AND table_name = %s
+                  AND grantee <> current_user;
+            """, (tabla,))
+            permisos = cur.fetchall()
+            cur.execute("SELECT pg_get_serial_sequence(%s, %s) AS seq;",
+                        (f"seguridad.{tabla}", col_id))
+            secuencia = cur.fetchone()["seq"]
+
+            cur.execute(f"ALTER TABLE seguridad.{tabla} RENAME TO {legacy};")
+            for t in triggers:
+                cur.execute(f"DROP TRIGGER {t['tgname']} ON seguridad.{legacy};")
+            for idx in indices:
+                nombre = idx["nombre"].split(".")[-1]
+                cur.execute(f"ALTER INDEX seguridad.{nombre} RENAME TO {nombre}_legacy;")
+
+            cur.execute(
+                f"CREATE TABLE seguridad.{tabla} "
+                f"(LIKE seguridad.{legacy} INCLUDING DEFAULTS) "
+                f"PARTITION BY RANGE ({col_fecha});"
+            )
+            cur.execute(
+                f"ALTER TABLE seguridad.{tabla} ADD PRIMARY KEY ({col_id}, {col_fecha});"
+            )
+            for idx in indices:
+                nombre = idx["nombre"].split(".")[-1]
+                cuerpo = idx["definicion"].split(" USING ", 1)[1]
+                cur.execute(f"CREATE INDEX {nombre} ON seguridad.{tabla} USING {cuerpo};")
+            for fk in fks:
+                cur.execute(
+                    f"ALTER TABLE seguridad.{tabla} "
+                    f"ADD CONSTRAINT {fk['conname']} {fk['definicion']};"
+                )
+            for t in triggers:
+                # La definición apunta a seguridad.<tabla>: ahora es la nueva
+                cur.execute(t["definicion"])
+            if secuencia:
+                cur.execute(f"ALTER SEQUENCE {secuencia} OWNED BY seguridad.{tabla}.{col_id};")
+            for p in permisos:
+                cur.execute(
+                    f"GRANT {p['privilege_type']} ON seguridad.{tabla} TO \"{p['grantee']}\";"
+                )
+
+            cur.execute(
+                f"ALTER TABLE seguridad.{tabla} ATTACH PARTITION seguridad.{legacy} "
+                f"FOR VALUES FROM (MINVALUE) TO (%s);",
+                (limite,),
+            )
+            cur.execute("COMMIT;")
+            break
+        except psycopg2.errors.LockNotAvailable:
+            cur.execute("ROLLBACK;")
+            print(f"⚠ {tabla}: no se obtuvo el bloqueo (intento {intento + 1}); reintentando")
+            time.sleep(2 ** intento)
+        except Exception:
+            cur.execute("ROLLBACK;")
+            raise
+    else:
+        cur.close()
+        raise RuntimeError(f"No se pudo particionar seguridad.{tabla}: tabla ocupada.")
+
+    cur.close()
+    return True
+
+
+def crear_particiones_bitacoras(conn, meses=BITACORA_MESES_ADELANTE):
+    cur = conn.cursor()
+    creadas = 0
+    for tabla in BITACORAS_PARTICIONADAS:
+        if _es_particionada(cur, tabla):
+            cur.execute(
+                "SELECT seguridad.fn_crear_particiones_mensuales(%s, %s) AS n;",
+                (tabla, meses),
+            )
+            creadas += cur.fetchone()["n"]
+    if not conn.autocommit:
+        conn.commit()
+    cur.close()
+    return creadas
+
+
+def purgar_bitacoras(conn, meses=BITACORA_RETENCION_MESES, dir_archivo=None):
+    """
+    Desadjunta (DETACH ... CONCURRENTLY) y elimina las particiones cuyo
+    límite superior quedó fuera de la retención. Si hay `dir_archivo`, antes
+    se exporta cada partición a <dir>/<particion>.csv.gz. Requiere autocommit.
+    """
+    cur = conn.cursor()
+    resultado = []
+    for tabla in BITACORAS_PARTICIONADAS:
+        if not _es_particionada(cur, tabla):
+            continue
+        cur.execute("""
+            SELECT particion, hasta
+            FROM seguridad.fn_particiones(%s::regclass)
+            WHERE hasta <= date_trunc('month', NOW()) - make_interval(months => %s);
+        """, (f"seguridad.{tabla}", meses))
+        for row in cur.fetchall():
+            particion = row["particion"]
+            if dir_archivo:
+                os.makedirs(dir_archivo, exist_ok=True)
+                ruta = os.path.join(dir_archivo, f"{particion}.csv.gz")
+                with gzip.open(ruta, "wb") as fh:
+                    cur.copy_expert(
+                        f"COPY {particion} TO STDOUT WITH (FORMAT csv, HEADER)", fh
+                    )
+            cur.execute(
+                f"ALTER TABLE seguridad.{tabla} DETACH PARTITION {particion} CONCURRENTLY;"
+            )
+            cur.execute(f"DROP TABLE {particion};")
+            resultado.append(particion)
+    cur.close()
+    return resultado
+
+
+@app.cli.command("bitacoras-particionar")
+@click.option("--meses", default=BITACORA_MESES_ADELANTE, show_default=True,
+              help="Meses a crear por adelantado.")
+def cli_bitacoras_particionar(meses):
+    """Migra las bitácoras de seguridad a particiones mensuales y crea las siguientes."""
+    conn = get_maintenance_connection()
+    conn.autocommit = True
+    try:
+        for tabla, (col_id, col_fecha) in BITACORAS_PARTICIONADAS.items():
+            if _particionar_bitacora(conn, tabla, col_id, col_fecha):
+                click.echo(f"seguridad.{tabla}: convertida a tabla particionada.")
+        click.echo(f"Particiones creadas: {crear_particiones_bitacoras(conn, meses)}")
+    finally:
+        conn.close()
+
+
+@app.cli.command("bitacoras-retencion")
+@click.option("--meses", default=BITACORA_RETENCION_MESES, show_default=True,
+              help="Meses completos a conservar.")
+@click.option("--archivar", "dir_archivo", default=None,
+              help="Directorio donde guardar cada partición como .csv.gz antes de borrarla.")
+def cli_bitacoras_retencion(meses, dir_archivo):
+    """
+    Política de retención: crea particiones futuras y purga las vencidas.
+    Pensado para cron diario, p.ej.:
+        0 3 * * *  flask --app app bitacoras-retencion --archivar /var/backups/bitacoras
+    """
+    conn = get_maintenance_connection()
+    conn.autocommit = True
+    try:
+        click.echo(f"Particiones creadas: {crear_particiones_bitacoras(conn)}")
+        for particion in purgar_bitacoras(conn, meses, dir_archivo):
+            click.echo(f"Eliminada {particion}")
+    finally:
+        conn.close()
+
+
+# =====================================
+# MANTENIMIENTO – COLA DE CORREOS (CLI)
+# =====================================
+
+@app.cli.command("correos-worker")
+@click.option("--hilos", default=MAIL_WORKERS, show_default=True,
+              help="Hilos de envío (cada uno con su conexión SMTP).")
+def cli_correos_worker(hilos):
+    """Procesa seguridad.cola_correos en primer plano hasta Ctrl+C."""
+    start_mail_workers(hilos)
+    click.echo(f"Enviando correos con {hilos} hilo(s)…")
+    try:
+        while any(t.is_alive() for t in _mail_threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop_mail_workers()
+
+
+# =====================================
+# MANTENIMIENTO – RESUMEN DE BIBLIOTECA (CLI)
+# =====================================
+
+@app.cli.command("biblioteca-resumen")
+@click.option("--verificar", is_flag=True,
+              help="Compara los contadores con un conteo completo.")
+@click.option("--corregir", is_flag=True,
+              help="Con --verificar: reescribe los contadores que no cuadren.")
+def cli_biblioteca_resumen(verificar, corregir):
+    """
+    Barrido programado de préstamos retrasados (para cron, cada pocos
+    minutos) y, opcionalmente, verificación de los contadores.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT biblioteca.fn_resumen_biblioteca_retrasados() AS retrasados;")
+        click.echo(f"Préstamos retrasados: {cur.fetchone()['retrasados']}")
+        conn.commit()
+        if not verificar:
+            return
+
+        diferencias = []
+
+        # Contadores por alumno (base de estudiantes_con_prestamo y del límite).
+        # Bloqueo compartido: los préstamos no cambian durante la verificación.
+        cur.execute("LOCK TABLE biblioteca.prestamos IN SHARE MODE;")
+        cur.execute("""
+            SELECT
+                COALESCE(c.fk_alumno, r.fk_alumno) AS fk_alumno,
+                COALESCE(c.activos, 0)             AS contador,
+                COALESCE(r.activos, 0)             AS real
+            FROM biblioteca.prestamos_activos_alumno c
+            FULL JOIN (
+                SELECT fk_alumno, COUNT(*) AS activos
+                FROM biblioteca.prestamos
+                WHERE fk_alumno IS NOT NULL AND estado <> 'Devuelto'
+                GROUP BY fk_alumno
+            ) r ON r.fk_alumno = c.fk_alumno
+            WHERE COALESCE(c.activos, 0) <> COALESCE(r.activos, 0);
+        """)
+        alumnos = cur.fetchall()
+        for r in alumnos:
+            diferencias.append(f"alumno {r['fk_alumno']}: {r['contador']} vs {r['real']}")
+        if alumnos and corregir:
+            # Corrige por alumno; el trigger ajusta estudiantes_con_prestamo.
+            execute_values(cur, """
+                INSERT INTO biblioteca.prestamos_activos_alumno AS c (fk_alumno, activos)
+                VALUES %s
+                ON CONFLICT (fk_alumno) DO UPDATE SET activos = EXCLUDED.activos;
+            """, [(r["fk_alumno"], r["real"]) for r in alumnos])
+
+        cur.execute("""
+            SELECT
+                r.total_libros, r.prestamos_activos, r.prestamos_vencidos,
+                r.estudiantes_con_prestamo,
+                c.total_libros AS real_total_libros,
+                c.prestamos_activos AS real_prestamos_activos,
+                c.prestamos_vencidos AS real_prestamos_vencidos,
+                c.estudiantes_con_prestamo AS real_estudiantes_con_prestamo
+            FROM biblioteca.resumen_biblioteca r,
+                 biblioteca.fn_resumen_biblioteca_recuento() c;
+        """)
+        fila = cur.fetchone()
+        campos = ("total_libros", "prestamos_activos", "prestamos_vencidos",
+                  "estudiantes_con_prestamo")
+        malos = [c for c in campos if fila[c] != fila[f"real_{c}"]]
+        for c in malos:
+            diferencias.append(f"{c}: {fila[c]} vs {fila['real_' + c]}")
+        if malos and corregir:
+            cur.execute(f"""
+                UPDATE biblioteca.resumen_biblioteca r
+                SET {", ".join(f"{c} = x.{c}" for c in campos)}
+                FROM biblioteca.fn_resumen_biblioteca_recuento() x;
+            """)
+
+        if corregir:
+            conn.commit()
+        else:
+            conn.rollback()
+
+        for d in diferencias:
+            click.echo(f"DIFERENCIA {d}")
+        if diferencias and not corregir:
+            raise click.ClickException(f"{len(diferencias)} contadores no cuadran.")
+        click.echo("Contadores corregidos." if diferencias else "Contadores consistentes.")
+    finally:
+        conn.close()
+
+
+# =====================================
+# MANTENIMIENTO – PRÉSTAMOS VENCIDOS (CLI)
+# =====================================
+
+@app.cli.command("biblioteca-vencidos")
+@click.option("--lote", default=VENCIDOS_LOTE, show_default=True,
+              help="Préstamos marcados por transacción.")
+def cli_biblioteca_vencidos(lote):
+    """
+    Marca préstamos vencidos y envía un resumen por alumno (para cron).
+    Se puede correr en paralelo desde varios servidores.
+    """
+    conn = get_connection()
+    try:
+        r = barrer_prestamos_vencidos(conn, lote)
+    finally:
+        conn.close()
+    click.echo(f"Préstamos marcados como vencidos: {r['marcados']}")
+    click.echo(f"Resúmenes enviados a alumnos: {r['avisos']}")
+    click.echo(f"Préstamos retrasados: {r['retrasados']}")
+
+
+# =====================================
+# MANTENIMIENTO – RESERVAS DE BIBLIOTECA (CLI)
+# =====================================
+
+@app.cli.command("biblioteca-reservas")
+@click.option("--lote", default=RESERVAS_LOTE, show_default=True,
+              help="Apartados liberados por transacción.")
+def cli_biblioteca_reservas(lote):
+    """Libera apartados vencidos y atiende colas con ejemplares libres (cron)."""
+    conn = get_connection()
+    try:
+        n = liberar_reservas(conn, lote)
+    finally:
+        conn.close()
+    click.echo(f"Ejemplares reasignados: {n}")
+
+
+# =====================================
+# MANTENIMIENTO – RECOMENDACIONES DE BIBLIOTECA (CLI)
+# =====================================
+
+@app.cli.command("biblioteca-recomendaciones")
+@click.option("--completo", is_flag=True,
+              help="Reconstruye la matriz completa en vez de solo los préstamos nuevos.")
+@click.option("--k", default=RECOMENDACIONES_K, show_default=True,
+              help="Recomendaciones guardadas por libro.")
+def cli_biblioteca_recomendaciones(completo, k):
+    """Actualiza las recomendaciones de libros (para cron)."""
+    conn = get_connection()
+    try:
+        libros = actualizar_recomendaciones(conn, completo=completo, k=k)
+    finally:
+        conn.close()
+    click.echo(f"Libros recalculados: {libros}")
+
+
+# =====================================
+# MANTENIMIENTO – ESTADÍSTICAS DE CIRCULACIÓN (CLI)
+# =====================================
+
+@app.cli.command("biblioteca-estadisticas")
+@click.option("--completo", is_flag=True, help="Recalcula todos los días.")
+def cli_biblioteca_estadisticas(completo):
+    """Actualiza los acumulados diarios de circulación (para cron)."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT biblioteca.fn_circulacion_actualizar(%s) AS dias;", (completo,))
+        dias = cur.fetchone()["dias"]
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    click.echo(f"Días recalculados: {dias}")
+
+
+# =====================================
+# MANTENIMIENTO – CARGA DE DOCENTES (CLI)
+# =====================================
+
+@app.cli.command("docentes-carga")
+@click.option("--corregir", is_flag=True,
+              help="Recalcula los docentes y grupos cuyos contadores no cuadren.")
+@click.option("--reconstruir", is_flag=True,
+              help="Vuelve a generar todo el resumen desde cero.")
+def cli_docentes_carga(corregir, reconstruir):
+    """
+    Compara rrhh.docente_carga y planes.materia_alta_inscritos con los
+    agregados en vivo (verificación de consistencia).
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        if reconstruir:
+            cur.execute("SELECT rrhh.fn_docente_carga_reconstruir();")
+            conn.commit()
+            click.echo("Resumen de carga docente reconstruido.")
+            return
+
+        # Bloqueo compartido: inscripciones y grupos no cambian durante la verificación
+        cur.execute("LOCK TABLE planes.materia_alta, academico.alumno_inscripcion IN SHARE MODE;")
+        cur.execute("""
+            SELECT
+                COALESCE(c.fk_personal, r.fk_personal) AS fk_personal,
+                COALESCE(c.ciclo, r.ciclo)             AS ciclo,
+                c.materias, c.grupos, c.alumnos, c.inscripciones,
+                r.materias      AS real_materias,
+                r.grupos        AS real_grupos,
+                r.alumnos       AS real_alumnos,
+                r.inscripciones AS real_inscripciones
+            FROM rrhh.docente_carga c
+            FULL JOIN rrhh.fn_docente_carga_recuento(NULL) r
+              ON r.fk_personal = c.fk_personal AND r.ciclo = c.ciclo
+            WHERE (c.materias, c.grupos, c.alumnos, c.inscripciones)
+                  IS DISTINCT FROM (r.materias, r.grupos, r.alumnos, r.inscripciones)
+            ORDER BY 1, 2;
+        """)
+        docentes = cur.fetchall()
+        for r in docentes:
+            click.echo(
+                f"docente {r['fk_personal']} ciclo {r['ciclo']}: "
+                f"{r['materias']}/{r['grupos']}/{r['alumnos']}/{r['inscripciones']} vs "
+                f"{r['real_materias']}/{r['real_grupos']}/{r['real_alumnos']}/{r['real_inscripciones']}"
+            )
+
+        cur.execute("""
+            SELECT
+                ma.materia_alta_id,
+                i.inscritos,
+                COALESCE(x.inscritos, 0) AS real
+            FROM planes.materia_alta ma
+            LEFT JOIN planes.materia_alta_inscritos i
+              ON i.materia_alta_id = ma.materia_alta_id
+            LEFT JOIN (
+                SELECT fk_materia_alta, COUNT(*) AS inscritos
+                FROM academico.alumno_inscripcion
+                GROUP BY fk_materia_alta
+            ) x ON x.fk_materia_alta = ma.materia_alta_id
+            WHERE i.inscritos IS DISTINCT FROM COALESCE(x.inscritos, 0)
+            ORDER BY ma.materia_alta_id;
+        """)
+        grupos = cur.fetchall()
+        for r in grupos:
+            click.echo(f"grupo {r['materia_alta_id']}: {r['inscritos']} vs {r['real']} inscritos")
+
+        if corregir and (docentes or grupos):
+            cur.execute(
+                "SELECT rrhh.fn_docente_carga_recalcular(%s::bigint[]);",
+                (sorted({r["fk_personal"] for r in docentes}),),
+            )
+            if grupos:
+                execute_values(cur, """
+                    INSERT INTO planes.materia_alta_inscritos AS i (materia_alta_id, inscritos)
+                    VALUES %s
+                    ON CONFLICT (materia_alta_id) DO UPDATE SET inscritos = EXCLUDED.inscritos;
+                """, [(r["materia_alta_id"], r["real"]) for r in grupos])
+            conn.commit()
+        else:
+            conn.rollback()
+        cur.close()
+    finally:
+        conn.close()
+
+    if not (docentes or grupos):
+        click.echo("El resumen de carga docente coincide con los datos.")
+    elif corregir:
+        click.echo(f"Corregidos: {len({r['fk_personal'] for r in docentes})} docentes, {len(grupos)} grupos.")
 
 
+# =====================================
+# MANTENIMIENTO – KÁRDEX DE ALUMNOS (CLI)
+# =====================================
+
+@app.cli.command("alumnos-kardex")
+@click.option("--corregir", is_flag=True,
+              help="Recalcula a los alumnos cuyo kárdex no cuadre.")
+@click.option("--reconstruir", is_flag=True,
+              help="Vuelve a generar todo el kárdex desde cero.")
+def cli_alumnos_kardex(corregir, reconstruir):
+    """
+    Compara academico.alumno_kardex con el recuento en vivo de
+    alumno_inscripcion (verificación de consistencia).
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        if reconstruir:
+            cur.execute("SELECT academico.fn_alumno_kardex_reconstruir();")
+            conn.commit()
+            click.echo("Kárdex de alumnos reconstruido.")
+            return
+
+        # Bloqueo compartido: las inscripciones no cambian durante la verificación
+        cur.execute("LOCK TABLE academico.alumno_inscripcion IN SHARE MODE;")
+        cur.execute("""
+            SELECT
+                r.fk_alumno,
+                k.materias_cursadas, k.creditos_cursados, k.creditos_aprobados,
+                k.suma_ponderada, k.ultimo_ciclo,
+                r.materias_cursadas  AS real_materias,
+                r.creditos_cursados  AS real_cursados,
+                r.creditos_aprobados AS real_aprobados,
+                r.suma_ponderada     AS real_suma,
+                r.ultimo_ciclo       AS real_ciclo
+            FROM academico.fn_alumno_kardex_recuento(NULL) r
+            LEFT JOIN academico.alumno_kardex k ON k.fk_alumno = r.fk_alumno
+            WHERE (COALESCE(k.materias_cursadas, 0), COALESCE(k.materias_aprobadas, 0),
+                   COALESCE(k.materias_reprobadas, 0), COALESCE(k.creditos_cursados, 0),
+                   COALESCE(k.creditos_aprobados, 0), COALESCE(k.suma_ponderada, 0),
+                   k.ultimo_ciclo)
+                  IS DISTINCT FROM
+                  (r.materias_cursadas, r.materias_aprobadas, r.materias_reprobadas,
+                   r.creditos_cursados, r.creditos_aprobados, r.suma_ponderada,
+                   r.ultimo_ciclo)
+            ORDER BY r.fk_alumno;
+        """)
+        alumnos = cur.fetchall()
+        for r in alumnos:
+            click.echo(
+                f"alumno {r['fk_alumno']}: "
+                f"{r['materias_cursadas']}/{r['creditos_cursados']}/{r['creditos_aprobados']}/"
+                f"{r['suma_ponderada']}/{r['ultimo_ciclo']} vs "
+                f"{r['real_materias']}/{r['real_cursados']}/{r['real_aprobados']}/"
+                f"{r['real_suma']}/{r['real_ciclo']}"
+            )
+
+        if corregir and alumnos:
+            cur.execute(
+                "SELECT academico.fn_alumno_kardex_recalcular(%s::varchar[]);",
+                ([r["fk_alumno"] for r in alumnos],),
+            )
+            conn.commit()
+        else:
+            conn.rollback()
+        cur.close()
+    finally:
+        conn.close()
+
+    if not alumnos:
+        click.echo("El kárdex de alumnos coincide con los datos.")
+    elif corregir:
+        click.echo(f"Corregidos: {len(alumnos)} alumnos.")
+
+
+# =====================================
+# MANTENIMIENTO – VISTAS DEL COORDINADOR (CLI)
+# =====================================
+
+@app.cli.command("coordinador-vistas")
+@click.option("--forzar", is_flag=True, help="Refresca aunque no haya cambios pendientes.")
+def cli_coordinador_vistas(forzar):
+    """Refresca las vistas materializadas del coordinador (para cron)."""
+    conn = get_connection()
+    try:
+        refrescadas = refrescar_vistas_coordinador(conn, forzar=forzar)
+    finally:
+        conn.close()
+    click.echo("Vistas refrescadas." if refrescadas else "Sin cambios pendientes (o refresco en curso).")
+
+
+# =====================================
+# MANTENIMIENTO – PRUEBA DE CARGA DE PRÉSTAMOS (CLI)
+# =====================================
+#
+# Solo para bases desechables (flask biblioteca-estres --dsn ...): escribe
+# préstamos reales. Nunca contra la base de producción.
+
+@app.cli.command("biblioteca-estres")
+@click.option("--ejemplares", default=5, show_default=True, help="Ejemplares del libro de prueba.")
+@click.option("--hilos", default=32, show_default=True, help="Clientes concurrentes.")
+@click.option("--solicitudes", default=400, show_default=True, help="Operaciones por fase.")
+@click.option("--alumnos", default=50, show_default=True, help="Alumnos existentes a usar.")
+@click.option("--conservar", is_flag=True, help="No borrar el libro ni los préstamos de prueba.")
+@click.option("--dsn", required=True,
+              help="Base de datos desechable (copia o esquema de pruebas), p.ej. "
+                   "'dbname=universidad_pruebas user=...'. Nunca la de producción.")
+def cli_biblioteca_estres(ejemplares, hilos, solicitudes, alumnos, conservar, dsn):
+    """
+    Prueba de carga de prestar_libro / devolver_prestamo sobre un libro
+    temporal: muchos checkouts y devoluciones simultáneos (incluida la
+    misma devolución dos veces) y al final verifica que no hubo sobreventa
+    y que inventario, préstamos y contadores por alumno cuadran.
+
+    NO correr contra datos reales: crea préstamos confirmados (varias
+    conexiones concurrentes, no cabe en una transacción que se revierta)
+    para alumnos existentes y mueve inventario y contadores. Por eso exige
+    --dsn y se niega si apunta a la misma base que la app (DB_*).
+    """
+    def conectar():
+        return psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+
+    identidad = """
+        SELECT current_database() AS db,
+               COALESCE(host(inet_server_addr()), 'local') AS host,
+               inet_server_port() AS puerto;
+    """
+    conn = conectar()
+    cur = conn.cursor()
+    cur.execute(identidad)
+    destino = cur.fetchone()
+    try:
+        app_conn = get_connection()
+    except psycopg2.Error:
+        app_conn = None
+    if app_conn is not None:
+        try:
+            app_cur = app_conn.cursor()
+            app_cur.execute(identidad)
+            misma = app_cur.fetchone() == destino
+        finally:
+            app_conn.close()
+        if misma:
+            conn.close()
+            raise click.ClickException(
+                "--dsn apunta a la misma base que la aplicación; usa una copia de pruebas."
+            )
+    conn.rollback()
+    click.echo(f"Base de pruebas: {destino['db']} en {destino['host']}:{destino['puerto']}")
+
+    cur.execute("SELECT MIN(id_clasificacion) AS c FROM biblioteca.clasificaciones;")
+    id_clasificacion = cur.fetchone()["c"]
+    cur.execute("SELECT MIN(id_editorial) AS e FROM biblioteca.editoriales;")
+    id_editorial = cur.fetchone()["e"]
+    cur.execute("SELECT numero_control FROM academico.alumnos ORDER BY numero_control LIMIT %s;",
+                (alumnos,))
+    numeros = [r["numero_control"] for r in cur.fetchall()]
+    if id_clasificacion is None or id_editorial is None or not numeros:
+        conn.close()
+        raise click.ClickException("Se necesita al menos una clasificación, una editorial y un alumno.")
+
+    cur.execute("""
+        INSERT INTO biblioteca.libros (id_clasificacion, titulo_libro, id_editorial)
+        VALUES (%s, %s, %s)
+        RETURNING id_libro;
+    """, (id_clasificacion, f"PRUEBA DE CARGA {datetime.now():%Y%m%d%H%M%S}", id_editorial))
+    id_libro = cur.fetchone()["id_libro"]
+    cur.execute("""
+        INSERT INTO biblioteca.inventario (id_libro, cantidad, cantidad_disponible)
+        VALUES (%s, %s, %s);
+    """, (id_libro, ejemplares, ejemplares))
+    conn.commit()
+    click.echo(f"Libro de prueba {id_libro} con {ejemplares} ejemplares.")
+
+    local = threading.local()
+
+    def conexion():
+        if getattr(local, "conn", None) is None:
+            local.conn = conectar()
+            abiertas.append(local.conn)
+        return local.conn
+
+    def checkout(_):
+        try:
+            return prestar_libro(conexion(), id_libro, fk_alumno=secrets.choice(numeros))
+        except ValueError:
+            return None
+
+    def devolucion(id_prestamo):
+        return devolver_prestamo(conexion(), id_prestamo)
+
+    abiertas = []
+    fallas = []
+    try:
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            # Fase 1: solo checkouts, muchos más que ejemplares.
+            prestados = [p for p in pool.map(checkout, range(solicitudes)) if p]
+            click.echo(f"Fase 1: {len(prestados)} préstamos concedidos de {solicitudes} solicitudes.")
+            if len(prestados) > ejemplares:
+                fallas.append(f"sobreventa: {len(prestados)} préstamos con {ejemplares} ejemplares")
+
+            # Fase 2: cada devolución se envía dos veces, mezclada con checkouts.
+            tareas = [(devolucion, p) for p in prestados for _ in range(2)]
+            tareas += [(checkout, None) for _ in range(solicitudes)]
+            secrets.SystemRandom().shuffle(tareas)
+            resultados = list(pool.map(lambda t: (t[0], t[1], t[0](t[1])), tareas))
+
+        devueltos = sum(1 for f, _, r in resultados if f is devolucion and r)
+        nuevos = sum(1 for f, _, r in resultados if f is checkout and r)
+        click.echo(f"Fase 2: {devueltos} devoluciones efectivas, {nuevos} préstamos nuevos.")
+        if devueltos != len(prestados):
+            fallas.append(f"devoluciones: {devueltos} efectivas para {len(prestados)} préstamos")
+
+        # Verificación final contra las tablas
+        cur.execute("""
+            SELECT
+                inv.cantidad,
+                inv.cantidad_disponible,
+                (SELECT COUNT(*) FROM biblioteca.prestamos p
+                 WHERE p.id_libro = inv.id_libro AND p.estado <> 'Devuelto') AS abiertos
+            FROM biblioteca.inventario inv
+            WHERE inv.id_libro = %s;
+        """, (id_libro,))
+        inv = cur.fetchone()
+        click.echo(
+            f"Inventario: {inv['cantidad_disponible']}/{inv['cantidad']} disponibles, "
+            f"{inv['abiertos']} préstamos abiertos."
+        )
+        if inv["cantidad_disponible"] + inv["abiertos"] != inv["cantidad"]:
+            fallas.append("inventario y préstamos abiertos no cuadran")
+        if inv["abiertos"] != len(prestados) - devueltos + nuevos:
+            fallas.append("préstamos abiertos distintos a los concedidos menos devueltos")
+
+        cur.execute("""
+            SELECT a.fk_alumno, a.activos, COUNT(p.id_prestamo) AS real
+            FROM biblioteca.prestamos_activos_alumno a
+            LEFT JOIN biblioteca.prestamos p
+              ON p.fk_alumno = a.fk_alumno AND p.estado <> 'Devuelto'
+            WHERE a.fk_alumno = ANY(%s)
+            GROUP BY a.fk_alumno, a.activos
+            HAVING a.activos <> COUNT(p.id_prestamo);
+        """, (numeros,))
+        for r in cur.fetchall():
+            fallas.append(f"contador de {r['fk_alumno']}: {r['activos']} vs {r['real']} reales")
+        conn.commit()
+    finally:
+        for c in abiertas:
+            c.close()
+        if not conservar:
+            conn.rollback()
+            cur.execute("DELETE FROM biblioteca.prestamos WHERE id_libro = %s;", (id_libro,))
+            cur.execute("DELETE FROM biblioteca.libros WHERE id_libro = %s;", (id_libro,))
+            conn.commit()
+        conn.close()
+
+    if fallas:
+        raise click.ClickException("; ".join(fallas))
+    click.echo("OK: sin sobreventa; inventario, préstamos y contadores consistentes.")
 
 
 # =====================================
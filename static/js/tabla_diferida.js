@@ -0,0 +1,66 @@
+// Carga diferida de tablas paginadas: <tbody data-fragmento="url"> recibe
+// filas <tr> del servidor; la última fila (tr[data-siguiente]) trae la URL
+// de la página siguiente y se pide sola al acercarse al final.
+(function () {
+  "use strict";
+
+  function iniciar(tbody) {
+    var columnas = tbody.closest("table").querySelectorAll("thead th").length || 1;
+
+    var observador = new IntersectionObserver(function (entradas) {
+      entradas.forEach(function (e) {
+        if (e.isIntersecting) {
+          observador.unobserve(e.target);
+          cargar(e.target.getAttribute("data-siguiente"), e.target);
+        }
+      });
+    }, { rootMargin: "300px" });
+
+    function mensaje(texto) {
+      var tr = document.createElement("tr");
+      var td = document.createElement("td");
+      td.colSpan = columnas;
+      td.className = "text-center text-muted py-3";
+      td.textContent = texto;
+      tr.appendChild(td);
+      return tr;
+    }
+
+    function cargar(url, filaPendiente) {
+      fetch(url, { credentials: "same-origin" })
+        .then(function (r) {
+          // Sesión vencida: el servidor redirige al login
+          if (r.redirected) { window.location.reload(); return null; }
+          if (!r.ok) { throw new Error(r.status); }
+          return r.text();
+        })
+        .then(function (html) {
+          if (html === null) { return; }
+          if (filaPendiente) { filaPendiente.remove(); }
+          tbody.insertAdjacentHTML("beforeend", html);
+          var siguiente = tbody.querySelector("tr[data-siguiente]:not([data-observada])");
+          if (siguiente) {
+            siguiente.setAttribute("data-observada", "");
+            var boton = siguiente.querySelector("button");
+            if (boton) {
+              boton.addEventListener("click", function () {
+                observador.unobserve(siguiente);
+                cargar(siguiente.getAttribute("data-siguiente"), siguiente);
+              });
+            }
+            observador.observe(siguiente);
+          }
+        })
+        .catch(function () {
+          var fila = mensaje("No se pudieron cargar más registros. Recarga la página.");
+          if (filaPendiente) { filaPendiente.replaceWith(fila); } else { tbody.appendChild(fila); }
+        });
+    }
+
+    var inicial = mensaje("Cargando…");
+    tbody.appendChild(inicial);
+    cargar(tbody.getAttribute("data-fragmento"), inicial);
+  }
+
+  document.querySelectorAll("tbody[data-fragmento]").forEach(iniciar);
+})();